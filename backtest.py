@@ -0,0 +1,355 @@
+"""
+Vectorized backtester for the rating-weighted allocation scheme.
+
+Daily closes for the whole universe are downloaded once into a dates x symbols
+price matrix, cached on disk and memory-mapped. Historical Chaikin ratings are
+replayed from the snapshot store (or any dates x symbols ratings matrix), and each
+configuration of weight scheme, rating cutoff and rebalance frequency is simulated
+for every day at once with NumPy. `sweep` runs a grid of configurations on a pool
+of processes that all map the same cached matrices.
+
+The simulation holds fractional shares, rebalances fully to the targets on every
+rebalance day and leaves the 0.1% that `rebalance_portfolio` does not allocate in
+cash.
+"""
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rebalance import TOTAL_PERCENTAGE
+
+TRADING_DAYS = 252
+MAX_RATING = 7  # Chaikin Power Gauge ratings run from 1 (very bearish) to 7 (very bullish)
+MIN_TRADE_WEIGHT = 1e-4  # weight changes below 0.01% of the portfolio are not counted as trades
+
+# Rating weights: None doubles the weight per rating step like `rebalance_portfolio`,
+# a dict is a `rating_weights_override` (missing ratings weigh 1.0)
+WEIGHT_SCHEMES: Dict[str, Optional[Dict[int, float]]] = {
+    "double": None,
+    "linear": {rating: float(rating) for rating in range(MAX_RATING + 1)},
+    "equal": {rating: 1.0 for rating in range(MAX_RATING + 1)},
+    "top_heavy": {rating: 4.0 ** rating for rating in range(MAX_RATING + 1)},
+}
+CUTOFFS = (4, 5, 6, 7)
+FREQUENCIES = (1, 5, 21, 63)  # trading days between rebalances
+
+
+def _cache_dir() -> str:
+    return os.environ.get("BACKTEST_CACHE_DIR",
+                          os.path.join(os.path.expanduser("~"), ".cache", "ib_trade_helper", "backtest"))
+
+
+class PriceMatrix:
+    """
+    Daily closes of a symbol universe: `closes[day, symbol]`, forward-filled, 0
+    before a symbol's first close, and their reciprocals (0 where there is no
+    close), which turn per-rebalance position sizing into a multiplication. Saved
+    as .npy files and loaded memory-mapped, so opening a cached matrix costs no
+    reads and worker processes share its pages.
+    """
+
+    def __init__(self, dates: np.ndarray, symbols: List[str], closes: np.ndarray,
+                 inverse: Optional[np.ndarray] = None, path: Optional[str] = None):
+        """
+        Args:
+            dates (np.ndarray): The trading days, as datetime64[D]
+            symbols (list): The symbols, one per column
+            closes (np.ndarray): The days x symbols closes
+            inverse (np.ndarray, optional): The reciprocals of `closes`. Computed if not given
+            path (str, optional): The directory the matrix is stored in, if any
+        """
+        self.dates = dates
+        self.symbols = symbols
+        self.closes = closes
+        self.inverse = inverse if inverse is not None else inverse_prices(closes)
+        self.path = path
+
+    def save(self, path: str) -> "PriceMatrix":
+        """
+        Writes the matrix to a directory and returns it reopened from there.
+
+        Args:
+            path (str): The directory
+
+        Returns:
+            PriceMatrix: The memory-mapped matrix
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "dates.npy"), self.dates.astype("datetime64[D]"))
+        np.save(os.path.join(path, "closes.npy"), np.ascontiguousarray(self.closes, dtype=np.float64))
+        np.save(os.path.join(path, "inverse.npy"), np.ascontiguousarray(self.inverse, dtype=np.float64))
+        with open(os.path.join(path, "symbols.json"), "w") as f:
+            json.dump(self.symbols, f)
+        return PriceMatrix.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> "PriceMatrix":
+        """
+        Args:
+            path (str): A directory written by `save`
+
+        Returns:
+            PriceMatrix: The memory-mapped matrix
+        """
+        with open(os.path.join(path, "symbols.json")) as f:
+            symbols = json.load(f)
+        return cls(np.load(os.path.join(path, "dates.npy")), symbols,
+                   np.load(os.path.join(path, "closes.npy"), mmap_mode="r"),
+                   np.load(os.path.join(path, "inverse.npy"), mmap_mode="r"), path)
+
+    @classmethod
+    def download(cls, symbols: Iterable[str], start: str, end: str, cache_dir: Optional[str] = None) -> "PriceMatrix":
+        """
+        Returns the daily closes from Yahoo Finance, downloading them only if the same
+        universe and date range is not cached yet.
+
+        Args:
+            symbols (iterable): The symbol universe
+            start (str): First day, YYYY-MM-DD
+            end (str): Day after the last day, YYYY-MM-DD
+            cache_dir (str, optional): Defaults to the BACKTEST_CACHE_DIR environment
+                                       variable or ~/.cache/ib_trade_helper/backtest
+
+        Returns:
+            PriceMatrix: The memory-mapped matrix
+        """
+        symbols = sorted(set(symbols))
+        key = hashlib.sha1(json.dumps([symbols, start, end]).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir or _cache_dir(), key)
+        if os.path.exists(os.path.join(path, "symbols.json")):
+            return cls.load(path)
+
+        import yfinance as yf
+
+        data = yf.download(symbols, start=start, end=end, progress=False, auto_adjust=True)
+        closes = data["Close"]
+        if not hasattr(closes, "columns"):  # Single ticker downloads may come back as a Series
+            closes = closes.to_frame(name=symbols[0])
+        closes = closes.reindex(columns=symbols).ffill().fillna(0.0)
+        dates = closes.index.values.astype("datetime64[D]")
+        return cls(dates, symbols, closes.to_numpy(dtype=np.float64)).save(path)
+
+
+def inverse_prices(closes: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: 1 / closes, and 0 where there is no close
+    """
+    return np.divide(1.0, closes, out=np.zeros(closes.shape), where=np.asarray(closes) > 0)
+
+
+def rating_history(store: Any) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """
+    Collects the ratings of every recorded run in a snapshot store, one row per day
+    (the last run of a day wins).
+
+    Args:
+        store (SnapshotStore): The snapshot store
+
+    Returns:
+        tuple: The days (datetime64[D]), the symbols, and the days x symbols ratings,
+               0 where a symbol was not on the watchlist
+    """
+    by_day: Dict[np.datetime64, Dict[str, int]] = {}
+    for run_id in store.runs():
+        snapshot = store.load(run_id)
+        by_day[np.datetime64(int(snapshot.meta["time"]), "s").astype("datetime64[D]")] = snapshot.ratings()
+    days = sorted(by_day)
+    symbols = sorted({symbol for ratings in by_day.values() for symbol in ratings})
+    column = {symbol: i for i, symbol in enumerate(symbols)}
+    matrix = np.zeros((len(days), len(symbols)), dtype=np.int16)
+    for row, day in enumerate(days):
+        ratings = by_day[day]
+        matrix[row, [column[symbol] for symbol in ratings]] = list(ratings.values())
+    return np.array(days, dtype="datetime64[D]"), symbols, matrix
+
+
+def align_ratings(prices: PriceMatrix, rating_days: np.ndarray, rating_symbols: Sequence[str],
+                  ratings: np.ndarray) -> np.ndarray:
+    """
+    Replays rating snapshots onto the price matrix: each trading day gets the ratings
+    of the latest snapshot on or before it, and 0 before the first snapshot and on
+    days a symbol has no price, so that it is never held without one.
+
+    Args:
+        prices (PriceMatrix): The price matrix
+        rating_days (np.ndarray): The snapshot days, ascending
+        rating_symbols (sequence): The rated symbols, one per column of `ratings`
+        ratings (np.ndarray): The snapshots x symbols ratings
+
+    Returns:
+        np.ndarray: The days x symbols ratings, aligned with `prices.closes`
+    """
+    rows = np.searchsorted(rating_days, prices.dates, side="right") - 1
+    column = {symbol: i for i, symbol in enumerate(prices.symbols)}
+    aligned = np.zeros(prices.closes.shape, dtype=np.int16)
+    known = [(i, column[symbol]) for i, symbol in enumerate(rating_symbols) if symbol in column]
+    if known:
+        source, target = map(list, zip(*known))
+        after_first = rows >= 0
+        aligned[np.ix_(after_first, target)] = ratings[np.ix_(rows[after_first], source)]
+    aligned[np.asarray(prices.closes) <= 0] = 0
+    return aligned
+
+
+def weight_lookup(scheme: Optional[Dict[int, float]]) -> np.ndarray:
+    """
+    Args:
+        scheme (dict, optional): A `WEIGHT_SCHEMES` entry
+
+    Returns:
+        np.ndarray: The weight of each rating, indexed by rating
+    """
+    if scheme is None:
+        # Doubling relative to the lowest rating held normalizes to the same targets as absolute powers of two
+        return 2.0 ** np.arange(MAX_RATING + 1)
+    return np.array([scheme.get(rating, 1.0) for rating in range(MAX_RATING + 1)], dtype=np.float64)
+
+
+def simulate(closes: np.ndarray, ratings: np.ndarray, weights: np.ndarray, cutoff: int, frequency: int,
+             cost_bps: float = 0.0, inverse: Optional[np.ndarray] = None) -> Dict[str, float]:
+    """
+    Backtests one configuration over the whole history in a handful of array passes.
+
+    Every `frequency` trading days the portfolio is reset to the targets of that
+    day's ratings: symbols rated at least `cutoff` with a price, weighted by rating
+    and normalized to TOTAL_PERCENTAGE. In between, each symbol's weight drifts with
+    its price, so the portfolio value on day t of a period is its value at the start
+    of the period times the weighted price relatives since then.
+
+    Args:
+        closes (np.ndarray): The days x symbols closes
+        ratings (np.ndarray): The days x symbols ratings, 0 where there is no close, see `align_ratings`
+        weights (np.ndarray): The weight of each rating, see `weight_lookup`
+        cutoff (int): The lowest rating held, as in `filter_watchlist`
+        frequency (int): Trading days between rebalances
+        cost_bps (float): Trading cost in basis points of the traded value
+        inverse (np.ndarray, optional): `inverse_prices(closes)`, computed if not given
+
+    Returns:
+        dict: total_return, cagr, volatility, sharpe, max_drawdown, turnover (annualized,
+              one-sided), trades and rebalances
+    """
+    n_days, n_symbols = closes.shape
+    frequency = max(1, frequency)
+    n_periods = -(-n_days // frequency)
+    if inverse is None:
+        inverse = inverse_prices(closes)
+
+    # Targets of every rebalance day, normalized like `rebalance_portfolio`. Rebalance days
+    # are strided views of the matrices, not copies
+    lookup = np.where(np.arange(len(weights)) >= max(cutoff, 1), weights, 0.0)
+    targets = np.take(lookup, ratings[::frequency], mode="clip")
+    totals = targets.sum(axis=1)
+    targets *= np.divide(TOTAL_PERCENTAGE / 100, totals, out=np.zeros_like(totals), where=totals > 0)[:, np.newaxis]
+    cash = 1.0 - targets.sum(axis=1)
+    # Shares held per unit of portfolio value at the start of each period
+    shares = targets * inverse[::frequency]
+
+    # Growth of each period's portfolio from its start, on every day of the period. Whole
+    # periods are a reshape of the price matrix, so no per-day copy of the holdings is made
+    full = n_days // frequency
+    growth = np.einsum("pfn,pn->pf", closes[:full * frequency].reshape(full, frequency, n_symbols),
+                       shares[:full]).ravel()
+    if full < n_periods:
+        growth = np.concatenate([growth, closes[full * frequency:] @ shares[full]])
+    period = np.arange(n_days) // frequency
+    growth += cash[period]
+
+    # Weights at the end of each period, just before the next rebalance
+    drifted = shares[:-1] * closes[frequency::frequency]
+    end_growth = drifted.sum(axis=1) + cash[:-1]
+    drifted /= end_growth[:, np.newaxis]
+    traded = np.empty_like(targets)
+    traded[0] = targets[0]
+    np.subtract(targets[1:], drifted, out=traded[1:])
+    np.abs(traded, out=traded)
+    traded_value = traded.sum(axis=1)
+
+    cost = cost_bps / 10_000
+    start_values = np.cumprod(np.concatenate([[1.0], end_growth]) * (1 - cost * traded_value))
+    values = start_values[period] * growth
+
+    returns = values[1:] / values[:-1] - 1
+    years = n_days / TRADING_DAYS
+    volatility = float(np.std(returns) * np.sqrt(TRADING_DAYS)) if len(returns) else 0.0
+    return {
+        "total_return": float(values[-1] - 1),
+        "cagr": float(values[-1] ** (1 / years) - 1) if years else 0.0,
+        "volatility": volatility,
+        "sharpe": float(np.mean(returns) * TRADING_DAYS / volatility) if volatility else 0.0,
+        "max_drawdown": float(np.min(values / np.maximum.accumulate(values)) - 1),
+        "turnover": float(traded_value[1:].sum() / 2 / years) if years else 0.0,
+        "trades": int(np.count_nonzero(traded > MIN_TRADE_WEIGHT)),
+        "rebalances": n_periods,
+    }
+
+
+def grid(schemes: Optional[Dict[str, Optional[Dict[int, float]]]] = None, cutoffs: Sequence[int] = CUTOFFS,
+         frequencies: Sequence[int] = FREQUENCIES) -> List[Tuple[str, int, int]]:
+    """
+    Returns:
+        list: Every (scheme name, cutoff, frequency) combination
+    """
+    return list(itertools.product(schemes or WEIGHT_SCHEMES, cutoffs, frequencies))
+
+
+# Per-process state of the sweep workers
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(prices_path: str, ratings_path: str, schemes: Dict[str, Optional[Dict[int, float]]],
+                 cost_bps: float) -> None:
+    _worker["prices"] = PriceMatrix.load(prices_path)
+    _worker["ratings"] = np.load(ratings_path, mmap_mode="r")
+    _worker["weights"] = {name: weight_lookup(scheme) for name, scheme in schemes.items()}
+    _worker["cost_bps"] = cost_bps
+
+
+def _run(config: Tuple[str, int, int]) -> Dict[str, Any]:
+    scheme, cutoff, frequency = config
+    prices = _worker["prices"]
+    result = simulate(prices.closes, _worker["ratings"], _worker["weights"][scheme], cutoff, frequency,
+                      _worker["cost_bps"], prices.inverse)
+    return {"scheme": scheme, "cutoff": cutoff, "frequency": frequency, **result}
+
+
+def sweep(prices: PriceMatrix, ratings: np.ndarray, configs: Optional[List[Tuple[str, int, int]]] = None,
+          schemes: Optional[Dict[str, Optional[Dict[int, float]]]] = None, cost_bps: float = 0.0,
+          workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Backtests many configurations in parallel. The workers memory-map the price and
+    ratings matrices from disk instead of receiving copies.
+
+    Args:
+        prices (PriceMatrix): The price matrix
+        ratings (np.ndarray): The days x symbols ratings, see `align_ratings`
+        configs (list, optional): (scheme name, cutoff, frequency) tuples. Defaults to the full `grid`
+        schemes (dict, optional): Weight schemes by name. Defaults to `WEIGHT_SCHEMES`
+        cost_bps (float): Trading cost in basis points of the traded value
+        workers (int, optional): Worker processes. Defaults to the number of CPUs; 1 runs in this process
+
+    Returns:
+        list: One result dict per configuration, in `configs` order, as returned by
+              `simulate` plus the scheme, cutoff and frequency
+    """
+    schemes = schemes or WEIGHT_SCHEMES
+    configs = configs or grid(schemes)
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(prefix="backtest-") as tmp:
+        prices_path = prices.path or prices.save(os.path.join(tmp, "prices")).path
+        ratings_path = os.path.join(tmp, "ratings.npy")
+        np.save(ratings_path, np.ascontiguousarray(ratings, dtype=np.int16))
+
+        initargs = (prices_path, ratings_path, schemes, cost_bps)
+        if workers == 1:
+            _init_worker(*initargs)
+            return [_run(config) for config in configs]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            return list(executor.map(_run, configs, chunksize=max(1, len(configs) // (workers * 4))))
@@ -0,0 +1,426 @@
+import contextlib
+import os
+import queue
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from logs import get_logger
+
+# TWS basket import layout: one DES row per symbol with its target percentage in column J
+HEADER = "CSVEXPORT\r\n"
+ROW_FORMAT = "DES,%s,STK,SMART/AMEX,,,,,,%s\r\n"
+ROW_SEPARATORS = 9
+# Record of every row of an incremental export, the base the next one is compared against
+HOLDINGS_HEADER = "Account,Symbol,Target,Shares\r\n"
+HOLDINGS_FORMAT = "%s,%s,%s,%d\r\n"
+HOLDINGS_SEPARATORS = 3
+BATCH_SIZE = 4096  # rows formatted, compared and written at a time
+WRITE_BUFFER = 1 << 20  # bytes buffered per combined output file
+MAX_EXPORT_WORKERS = 4
+QUEUE_BATCHES = 2  # batches waiting for each per-account writer before the export blocks
+HOLDINGS_NAME = re.compile(r"^\d{8} (?P<suffix>.+) holdings\.csv$")
+MANIFEST_FILE = ".basket-export"  # marks an account directory as written by an export, so it may be replaced
+
+# (account, symbol, target percentage, shares)
+BasketRow = Tuple[str, str, float, int]
+
+logger = get_logger(__name__)
+
+
+def target_rows(desired_alloc: Mapping[str, float], books: Mapping[str, Mapping[str, Tuple[Any, ...]]],
+                prices: Mapping[str, float]) -> Iterator[BasketRow]:
+    """
+    Yields the target holding of every account, sorted by account and symbol, one
+    account at a time.
+
+    Held symbols outside the desired allocation get a target of 0 shares. Desired
+    symbols without a positive price cannot be sized and are left out.
+
+    Args:
+        desired_alloc (dict): Symbols mapped to their target percentages
+        books (dict): Accounts mapped to their positions, symbol: (quantity, price, ...)
+                      mappings with a `total_market_value` such as `Portfolio`
+        prices (dict): Prices of the desired symbols. A held position's price is used
+                       for symbols missing from it
+
+    Yields:
+        tuple: (account, symbol, target, shares) rows
+    """
+    for account in sorted(books):
+        book = books[account]
+        total = book.total_market_value
+        for symbol in sorted(set(desired_alloc).union(book)):
+            target = desired_alloc.get(symbol)
+            if target is None:
+                yield account, symbol, 0.0, 0
+                continue
+            price = prices.get(symbol) or (book[symbol][1] if symbol in book else 0.0)
+            if price > 0:
+                yield account, symbol, target, int(total * target / 100 / price)
+
+
+def _account_file_name(account: str) -> str:
+    return re.sub(r"[^\w.-]", "_", account) or "default"
+
+
+class _AccountWriters:
+    """
+    Writes rows to one file per account from a pool of writer threads. Each account
+    is owned by a single thread, which keeps that account's file open until `close`.
+    Every thread reads a bounded queue, so a slow disk blocks the export instead of
+    buffering rows in memory.
+    """
+
+    def __init__(self, path_for: Callable[[str], str], workers: int):
+        """
+        Args:
+            path_for (callable): Maps an account to the path of its file
+            workers (int): Number of writer threads
+        """
+        self.path_for = path_for
+        self.paths: Dict[str, str] = {}
+        self._owner: Dict[str, int] = {}
+        self._queues = [queue.Queue(maxsize=QUEUE_BATCHES) for _ in range(max(1, workers))]
+        self._executor = ThreadPoolExecutor(max_workers=len(self._queues), thread_name_prefix="basket-writer")
+        self._futures = [self._executor.submit(self._run, q) for q in self._queues]
+
+    def _run(self, text_queue: "queue.Queue") -> None:
+        files: Dict[str, Any] = {}
+        error: Optional[OSError] = None
+        try:
+            while True:
+                item = text_queue.get()
+                if item is None:
+                    break
+                if error is not None:  # Keep draining so that the export does not block
+                    continue
+                account, text = item
+                try:
+                    f = files.get(account)
+                    if f is None:
+                        f = files[account] = open(self.paths[account], "w", newline="")
+                        f.write(HEADER)
+                    f.write(text)
+                except OSError as e:
+                    error = e
+        finally:
+            for f in files.values():
+                f.close()
+        if error is not None:
+            raise error
+
+    def write(self, accounts: List[str], lines: List[str]) -> None:
+        """
+        Hands a batch of rows to the threads owning their accounts.
+
+        Args:
+            accounts (list): The account of each row
+            lines (list): The formatted rows
+        """
+        # One hand-off per run of consecutive rows of the same account
+        for account, run in groupby(zip(accounts, lines), key=itemgetter(0)):
+            owner = self._owner.get(account)
+            if owner is None:
+                owner = self._owner[account] = len(self._owner) % len(self._queues)
+                self.paths[account] = self.path_for(account)
+            self._queues[owner].put((account, "".join(map(itemgetter(1), run))))
+
+    def close(self) -> None:
+        """
+        Waits for the threads to write and close every file.
+
+        Raises:
+            OSError: If a file could not be written
+        """
+        for q in self._queues:
+            q.put(None)
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+
+
+class _Changes:
+    """
+    Merge join of a sorted row stream against the holdings record of the previous
+    export, also sorted by account and symbol, that reads both in step so only one
+    row of each is held. Rows are compared as formatted record lines up to the share
+    count, which the basket files do not carry, so an unchanged row costs one string
+    comparison.
+    """
+
+    def __init__(self, path: Optional[str]):
+        """
+        Args:
+            path (str, optional): The previous holdings record. Every row is a change when None
+        """
+        self._file = open(path, newline="", buffering=WRITE_BUFFER) if path else None
+        self._lines = iter(self._file) if self._file else iter(())
+        next(self._lines, None)  # Header
+        self._old: Optional[str] = next(self._lines, None)
+        self._old_key: Tuple[str, str] = ("", "")  # Key of the last previous row passed
+        self._last_key: Tuple[str, str] = ("", "")
+
+    def _parse_old(self) -> Tuple[str, str]:
+        account, symbol, _rest = self._old.split(",", 2)
+        if (account, symbol) <= self._old_key:
+            raise ValueError(f"Previous holdings {self._file.name} are not sorted by account and symbol")
+        return account, symbol
+
+    def changes(self, rows: List[BasketRow], lines: List[str]) -> List[BasketRow]:
+        """
+        Args:
+            rows (list): The next rows of the new export
+            lines (list): The same rows formatted as holdings record lines
+
+        Returns:
+            list: The rows that are new or have a new target, with a zero row for every
+                  previous row that sorts before them and is no longer in the export
+
+        Raises:
+            ValueError: If the rows are not sorted by account and symbol
+        """
+        changed: List[BasketRow] = []
+        old, old_key, last_key = self._old, self._old_key, self._last_key
+        for row, line in zip(rows, lines):
+            key = (row[0], row[1])
+            if key <= last_key:
+                raise ValueError(f"Incremental exports need rows sorted by account and symbol, "
+                                 f"got {key} after {last_key}")
+            last_key = key
+            if old == line or old is not None and old.startswith(line[:line.rindex(",") + 1]):  # Same target
+                old_key = key
+                old = next(self._lines, None)
+                continue
+            while old is not None:
+                self._old, self._old_key = old, old_key
+                current = self._parse_old()
+                if current > key:
+                    break
+                old_key = current
+                if current < key:
+                    changed.append((*current, 0.0, 0))
+                old = next(self._lines, None)
+            changed.append(row)
+        self._old, self._old_key, self._last_key = old, old_key, last_key
+        return changed
+
+    def removed(self) -> Iterator[List[BasketRow]]:
+        """
+        Yields:
+            list: Batches of zero rows for the previous rows after the last new row
+        """
+        while self._old is not None:
+            rows: List[BasketRow] = []
+            while self._old is not None and len(rows) < BATCH_SIZE:
+                self._old_key = self._parse_old()
+                rows.append((*self._old_key, 0.0, 0))
+                self._old = next(self._lines, None)
+            yield rows
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+def _check_separators(text: str, count: int, separators: int) -> None:
+    # Every row has a fixed number of separators and one line break unless a name needs quoting
+    if text.count(",") != separators * count or text.count("\n") != count or '"' in text:
+        raise ValueError("Basket accounts and symbols cannot contain commas, quotes or line breaks")
+
+
+class BasketExporter:
+    """
+    Streams (account, symbol, target, shares) rows to IB basket CSV files in the TWS
+    layout: a CSVEXPORT row, then one `DES,<symbol>,STK,SMART/AMEX,,,,,,<target>` row
+    per symbol. A basket file has no account column, so every account gets its own
+    file, written by a pool of threads: rows of account "" go to
+    `<date> <suffix>.csv`, and the rows of each named account to `<account>.csv` in a
+    `<date> <suffix>` directory.
+
+    Rows are read, formatted and written in batches of BATCH_SIZE through large
+    write buffers, so memory does not grow with the number of rows.
+
+    In incremental mode every row is also recorded, with its share count, in
+    `<date> <suffix> holdings.csv`. The rows are compared against the latest earlier
+    holdings record in the directory, and only the rows that are new, have a new
+    target or were removed are written, to `<date> <suffix> changes.csv` and the
+    `<date> <suffix> changes` directory instead. A removed row has a target of 0. The
+    comparison is a merge join, so incremental exports need their rows sorted by
+    account and symbol, as `target_rows` yields them.
+
+    Files are written to a temporary directory and renamed into place once the whole
+    export succeeded, so a failed export leaves the previous files untouched. An
+    account directory is only replaced or removed if an export wrote it, which it
+    marks with a MANIFEST_FILE; any other directory in the way is left alone.
+    """
+
+    def __init__(self, directory: str = ".", suffix: str = "basket", incremental: bool = False,
+                 workers: int = MAX_EXPORT_WORKERS):
+        """
+        Args:
+            directory (str): Directory the files are written to
+            suffix (str): File name suffix after the date
+            incremental (bool): Whether to write the rows changed since the previous export
+            workers (int): Threads writing the account files
+        """
+        self.directory = directory
+        self.suffix = suffix
+        self.incremental = incremental
+        self.workers = workers
+        self.rows_written = 0
+        self.rows_changed = 0
+        self.paths: List[str] = []
+
+    def export_path(self, date: str, name: Optional[str] = None) -> str:
+        """
+        Args:
+            date (str): The export date as YYYYMMDD
+            name (str, optional): Appended to the suffix, e.g. "changes" or "holdings"
+
+        Returns:
+            str: Path of the export file
+        """
+        suffix = f"{self.suffix} {name}" if name else self.suffix
+        return os.path.join(self.directory, f"{date} {suffix}.csv")
+
+    def latest(self) -> Optional[str]:
+        """
+        Returns:
+            str: Path of the most recent holdings record with this suffix, or None
+        """
+        if not os.path.isdir(self.directory):
+            return None
+        records = sorted(name for name in os.listdir(self.directory)
+                         if (match := HOLDINGS_NAME.match(name)) and match.group("suffix") == self.suffix)
+        return os.path.join(self.directory, records[-1]) if records else None
+
+    def export(self, rows: Iterable[BasketRow]) -> List[str]:
+        """
+        Streams the rows to the basket files.
+
+        Args:
+            rows (iterable): (account, symbol, target, shares) tuples
+
+        Returns:
+            list: Paths of the files written
+
+        Raises:
+            ValueError: If a symbol, or in incremental mode an account, contains a comma, quote
+                        or line break, or if an incremental export's rows are not sorted by
+                        account and symbol
+            FileExistsError: If account files are to be written where a directory not written
+                        by an export exists
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        date = datetime.now().strftime("%Y%m%d")
+        basket_path = self.export_path(date, "changes" if self.incremental else None)
+        account_dir = os.path.splitext(basket_path)[0]
+        holdings_path = self.export_path(date, "holdings") if self.incremental else None
+        tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        tmp_account_dir = os.path.join(tmp_path, "accounts")
+        os.mkdir(tmp_account_dir)
+        open(os.path.join(tmp_account_dir, MANIFEST_FILE), "w").close()
+
+        holdings = diff = None
+        account_writers = _AccountWriters(
+            lambda account: os.path.join(tmp_account_dir, f"{_account_file_name(account)}.csv") if account
+            else os.path.join(tmp_path, "basket.csv"), self.workers)
+        self.rows_written = self.rows_changed = 0
+        try:
+            if self.incremental:
+                diff = _Changes(self.latest())
+                holdings = open(os.path.join(tmp_path, "holdings.csv"), "w", newline="", buffering=WRITE_BUFFER)
+                holdings.write(HOLDINGS_HEADER)
+
+            rows = iter(rows)
+            while batch := list(islice(rows, BATCH_SIZE)):
+                self.rows_written += len(batch)
+                if diff is not None:
+                    records = [HOLDINGS_FORMAT % row for row in batch]
+                    text = "".join(records)
+                    _check_separators(text, len(records), HOLDINGS_SEPARATORS)
+                    holdings.write(text)
+                    batch = diff.changes(batch, records)
+                    self.rows_changed += len(batch)
+                lines = [ROW_FORMAT % (symbol, target) for _account, symbol, target, _shares in batch]
+                if diff is None:
+                    _check_separators("".join(lines), len(lines), ROW_SEPARATORS)
+                if lines:
+                    account_writers.write([row[0] for row in batch], lines)
+            if diff is not None:
+                for batch in diff.removed():
+                    self.rows_changed += len(batch)
+                    account_writers.write([row[0] for row in batch],
+                                          [ROW_FORMAT % (symbol, target) for _account, symbol, target, _shares in batch])
+
+            if holdings is not None:
+                holdings.close()
+            account_writers.close()
+        except BaseException:
+            if holdings is not None:
+                holdings.close()
+            with contextlib.suppress(OSError):
+                account_writers.close()
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        finally:
+            if diff is not None:
+                diff.close()
+
+        exported_dir = os.path.isfile(os.path.join(account_dir, MANIFEST_FILE))
+        if any(account_writers.paths) and os.path.lexists(account_dir) and not exported_dir:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise FileExistsError(f"{account_dir} was not written by a basket export, not replacing it")
+
+        # Replace every basket of an earlier export of the day, so none is left over from it
+        self.paths = []
+        if "" in account_writers.paths:
+            os.replace(account_writers.paths[""], basket_path)
+            self.paths.append(basket_path)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(basket_path)
+        if exported_dir:
+            # Moved into the temporary directory and removed with it
+            os.rename(account_dir, os.path.join(tmp_path, "previous"))
+        if any(account_writers.paths):
+            os.rename(tmp_account_dir, account_dir)
+            self.paths.extend(os.path.join(account_dir, f"{_account_file_name(account)}.csv")
+                              for account in account_writers.paths if account)
+        if holdings_path:
+            os.replace(os.path.join(tmp_path, "holdings.csv"), holdings_path)
+            self.paths.append(holdings_path)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return self.paths
+
+    def report(self) -> None:
+        """
+        Logs how many rows the last export wrote and where.
+        """
+        changed = f", {self.rows_changed} changed" if self.incremental else ""
+        logger.info("Exported %s basket rows%s to %s files in %s", self.rows_written, changed, len(self.paths),
+                    self.directory)
+
+
+def _flag(name: str) -> bool:
+    return os.environ.get(name, "0").lower() not in ("0", "false", "no", "")
+
+
+def create_default_exporter() -> Optional[BasketExporter]:
+    """
+    Creates a BasketExporter writing to the BASKET_DIR directory. BASKET_INCREMENTAL
+    (set to 1) enables incremental mode.
+
+    Returns:
+        BasketExporter: The exporter, or None when BASKET_DIR is not set
+    """
+    path = os.environ.get("BASKET_DIR")
+    if not path:
+        return None
+    return BasketExporter(path, incremental=_flag("BASKET_INCREMENTAL"))
@@ -0,0 +1,108 @@
+"""
+Benchmark of the vectorized backtester on a synthetic universe.
+
+Generates five years of daily closes for 2000 symbols (random walks, with some
+symbols listing late) and weekly rating snapshots, checks `backtest.simulate`
+against a day-by-day reference loop, then times a sweep of a few hundred weight
+scheme x cutoff x frequency configurations in one process and across all CPUs.
+
+Run from the repository root:
+    python benchmarks/bench_backtest.py [--symbols 2000] [--years 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backtest  # noqa: E402
+
+CUTOFFS = (3, 4, 5, 6, 7)
+FREQUENCIES = (1, 2, 5, 10, 21, 42, 63)
+COST_BPS = 5.0
+SEED = 7
+
+
+def synthetic_history(n_symbols, years, seed=SEED):
+    rng = np.random.default_rng(seed)
+    n_days = years * backtest.TRADING_DAYS
+    returns = rng.normal(0.0003, 0.02, size=(n_days, n_symbols))
+    closes = 50 * np.exp(np.cumsum(returns, axis=0))
+    listed = rng.integers(0, n_days // 2, size=n_symbols) * (rng.random(n_symbols) < 0.1)
+    closes[np.arange(n_days)[:, np.newaxis] < listed] = 0.0
+    dates = np.datetime64("2020-01-01") + np.arange(n_days).astype("timedelta64[D]")
+    symbols = [f"S{i:05d}" for i in range(n_symbols)]
+
+    # Weekly snapshots in which a tenth of the ratings move by one step
+    rating_days = dates[::5]
+    ratings = np.empty((len(rating_days), n_symbols), dtype=np.int16)
+    ratings[0] = rng.integers(1, backtest.MAX_RATING + 1, size=n_symbols)
+    for row in range(1, len(rating_days)):
+        step = rng.integers(-1, 2, size=n_symbols) * (rng.random(n_symbols) < 0.1)
+        ratings[row] = np.clip(ratings[row - 1] + step, 1, backtest.MAX_RATING)
+    return backtest.PriceMatrix(dates, symbols, closes), rating_days, symbols, ratings
+
+
+def reference(closes, ratings, weights, cutoff, frequency, cost_bps):
+    """
+    Day-by-day simulation with explicit fractional share holdings.
+    """
+    cost = cost_bps / 10_000
+    n_days, n_symbols = closes.shape
+    shares = np.zeros(n_symbols)
+    cash = 1.0
+    values = []
+    for day in range(n_days):
+        prices = closes[day]
+        value = cash + float(shares @ prices)
+        if day % frequency == 0:
+            eligible = (prices > 0) & (ratings[day] >= cutoff)
+            raw = np.where(eligible, weights[ratings[day]], 0.0)
+            target = raw / raw.sum() * (backtest.TOTAL_PERCENTAGE / 100) if raw.sum() else raw
+            current = shares * prices / value
+            value *= 1 - cost * np.abs(target - current).sum()
+            shares = np.divide(target * value, prices, out=np.zeros(n_symbols), where=prices > 0)
+            cash = value - float(shares @ prices)
+        values.append(value)
+    return values[-1] - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args()
+
+    prices, rating_days, rating_symbols, ratings = synthetic_history(args.symbols, args.years)
+    with tempfile.TemporaryDirectory() as cache:
+        prices = prices.save(os.path.join(cache, "prices"))
+        aligned = backtest.align_ratings(prices, rating_days, rating_symbols, ratings)
+
+        small = slice(0, 200)
+        for scheme, cutoff, frequency in (("double", 5, 5), ("linear", 4, 21), ("equal", 6, 1)):
+            weights = backtest.weight_lookup(backtest.WEIGHT_SCHEMES[scheme])
+            closes = np.asarray(prices.closes[:, small])
+            got = backtest.simulate(closes, aligned[:, small], weights, cutoff, frequency, COST_BPS)["total_return"]
+            expected = reference(closes, aligned[:, small], weights, cutoff, frequency, COST_BPS)
+            assert abs(got - expected) < 1e-9, f"{scheme}/{cutoff}/{frequency}: {got} != {expected}"
+
+        configs = backtest.grid(cutoffs=CUTOFFS, frequencies=FREQUENCIES)
+        print(f"{len(configs)} configurations, {len(prices.dates)} days x {len(prices.symbols)} symbols")
+        for workers in (1, os.cpu_count() or 1):
+            start = time.perf_counter()
+            results = backtest.sweep(prices, aligned, configs, cost_bps=COST_BPS, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>3} worker(s): {elapsed:7.2f}s  {len(configs) / elapsed:7.1f} configurations/s")
+
+        best = max(results, key=lambda result: result["sharpe"])
+        print(f"best Sharpe: {best['scheme']} cutoff {best['cutoff']} every {best['frequency']} days, "
+              f"sharpe {best['sharpe']:.2f}, CAGR {best['cagr']:.1%}, turnover {best['turnover']:.1f}x/yr, "
+              f"{best['trades']} trades")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the streaming basket export.
+
+Exports target holdings for many accounts over a large universe from a row
+generator to one TWS basket file per account, first in full, then incrementally
+with about one row in a hundred changed. Each mode is timed without tracing, then run
+again under tracemalloc to check that the peak memory does not grow with the
+number of rows.
+
+Run from the repository root:
+    python benchmarks/bench_basket_export.py [--accounts 100] [--symbols 3000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import repeat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from basket_export import BasketExporter  # noqa: E402
+
+CHANGE_EVERY = 97  # every n-th row gets a different target in the second run
+
+
+def rows(accounts, symbols, changed=False):
+    names = [f"S{s:05d}" for s in range(symbols)]
+    target = round(100 / symbols, 4)
+    for a in range(accounts):
+        targets = [target] * symbols
+        if changed:
+            for s in range(-(a * symbols) % CHANGE_EVERY, symbols, CHANGE_EVERY):
+                targets[s] = round(target * 2, 4)
+        yield from zip(repeat(f"U{a:07d}"), names, targets, ((a * 31 + s * 7) % 500 for s in range(symbols)))
+
+
+def measure(exporter, accounts, symbols, incremental):
+    """
+    Returns:
+        tuple: Wall time without tracing and peak traced memory of one export
+    """
+    results = []
+    for trace in (False, True):
+        if incremental:  # Export the unchanged rows as the previous export to compare against
+            BasketExporter(exporter.directory, incremental=True).export(rows(accounts, symbols))
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            exporter.export(rows(accounts, symbols, changed=incremental))
+            results.append(time.perf_counter() - start)
+            if trace:
+                results.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            if trace:
+                tracemalloc.stop()
+    return results[0], results[2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--symbols", type=int, default=3000)
+    args = parser.parse_args()
+
+    print(f"{args.accounts} accounts x {args.symbols} symbols = {args.accounts * args.symbols} rows")
+    print(f"{'mode':<28} {'time (s)':>9} {'peak MB':>8} {'files':>6} {'changed':>8}")
+    for name, incremental in (("full", False), ("incremental", True)):
+        with tempfile.TemporaryDirectory() as directory:
+            exporter = BasketExporter(directory, incremental=incremental)
+            for accounts in (max(1, args.accounts // 10), args.accounts):
+                elapsed, peak = measure(exporter, accounts, args.symbols, incremental)
+                label = name if accounts == args.accounts else f"  at a tenth of the accounts"
+                print(f"{label:<28} {elapsed:>9.3f} {peak / 2 ** 20:>8.2f} {len(exporter.paths):>6} "
+                      f"{exporter.rows_changed if incremental else '-':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+End-to-end benchmark of every rebalance stage against local stand-ins.
+
+Chaikin and Yahoo Finance are replaced by the fixture HTTP server in
+`benchmarks/fakes.py`, the Playwright login runs against its static login page,
+and TWS is replaced by `tws_simulator`. Each stage runs at several portfolio
+sizes and records its wall time, the net number of memory blocks it left
+allocated, and its peak traced memory. The results are written as JSON so that
+runs can be compared across changes, optionally against a baseline file.
+
+Order pacing is lifted for the order placement stage so that it measures the
+client's own overhead rather than the 40 messages per second limit.
+
+Run from the repository root:
+    python benchmarks/bench_end_to_end.py [--sizes 50 500 2000] [--repeats 3]
+                                          [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chaikin  # noqa: E402
+import logs  # noqa: E402
+import pricing  # noqa: E402
+import rebalance_steps  # noqa: E402
+import yahoo_finance  # noqa: E402
+from fakes import FIXTURE_TOKEN, FakeYFinance, FixtureServer  # noqa: E402
+from order_scheduler import OrderScheduler  # noqa: E402
+from rate_limit import TokenBucket  # noqa: E402
+from rebalance import rebalance_portfolio  # noqa: E402
+from tws_api import TWSConnection  # noqa: E402
+from tws_simulator import TWSSimulator  # noqa: E402
+
+SIZES = (50, 500, 2000)
+REPEATS = 3
+LISTS = 4  # Chaikin lists fetched together by the multi-list stage
+CHART_MISSING_EVERY = 50  # Every 50th symbol has no chart data and is priced by the per-symbol fallback
+ORDERS_TIMEOUT = 120  # seconds
+POSITIONS_TIMEOUT = 600  # seconds, tracing slows the positions download of large books
+REGRESSION_RATIO = 1.2
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def measure(fn, setup=None, repeats=REPEATS):
+    """
+    Times `fn(setup())` over several untraced runs, then repeats it once under
+    tracemalloc to record memory.
+
+    Returns:
+        dict: Wall time statistics in seconds, net allocated blocks and peak traced bytes
+    """
+    times = []
+    for _ in range(repeats):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state)
+        times.append(time.perf_counter() - start)
+
+    state = setup() if setup else None
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        fn(state)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "repeats": repeats,
+        "wall_s": {"min": min(times), "median": statistics.median(times), "max": max(times)},
+        "net_blocks": sys.getallocatedblocks() - blocks,
+        "peak_bytes": peak,
+    }
+
+
+def quiet(fn):
+    def run(state):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn(state)
+    return run
+
+
+def point_chaikin_at(fixture):
+    chaikin.WATCHLIST_URL = f"{fixture.base_url}/my-chaikin/lists/health-check/my-stocks?listId=2370927&listType=User"
+    chaikin.SUGGESTIONS_API_FULL = f"{fixture.base_url}/{chaikin.SUGGESTIONS_API}"
+    # Lets the fast login's host filter and cookie capture accept the fixture host
+    chaikin.CHAIKIN_DOMAIN = "127.0.0.1"
+
+
+def save_fixture_session(fixture):
+    session = {
+        "headers": {"jwttoken": FIXTURE_TOKEN, "content-type": "application/json"},
+        "watchlist_url": f"{fixture.base_url}/{chaikin.WATCHLIST_API}",
+        "watchlist_method": "GET",
+        "cookies": {},
+    }
+    chaikin._save_session(session)
+
+
+def bench_login(repeats):
+    try:
+        return measure(quiet(lambda _state: chaikin._browser_login(fast=True)), repeats=repeats)
+    except Exception as e:  # Chromium not installed, sandbox restrictions, ...
+        return {"skipped": f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"}
+
+
+def run_size(size, repeats):
+    # Half of the watchlist is already held, the rest of the held book is closed out
+    watchlist_symbols = [f"SIM{i:05d}" for i in range(size // 2, size // 2 + size)]
+    chart_missing = set(watchlist_symbols[::CHART_MISSING_EVERY])
+    # The watchlist split over several lists, for the multi-list fetch
+    lists = {f"list{i}": watchlist_symbols[i::LISTS] for i in range(LISTS)}
+    results = {}
+
+    with FixtureServer(watchlist_symbols, chart_missing=chart_missing, lists=lists) as fixture, \
+            TWSSimulator(positions=size) as simulator:
+        point_chaikin_at(fixture)
+        yahoo_finance.yf = FakeYFinance(fixture.base_url)
+
+        results["chaikin_login"] = bench_login(repeats)
+        save_fixture_session(fixture)
+        results["get_watchlist"] = measure(lambda _state: chaikin.get_watchlist(), repeats=repeats)
+        results["get_watchlist_lists"] = measure(lambda _state: chaikin.get_watchlist(list(lists)), repeats=repeats)
+
+        raw_suggestions = fixture.suggestions(watchlist_symbols)
+        results["parse_suggestions"] = measure(lambda _state: chaikin.parse_suggestions(raw_suggestions),
+                                               repeats=repeats)
+        watchlist = {symbol: details for symbol, details in chaikin.parse_suggestions(raw_suggestions).items()
+                     if details["rating_id"] >= 5}
+
+        results["get_price"] = measure(lambda _state: yahoo_finance.get_price(watchlist_symbols[1]), repeats=repeats)
+        results["get_prices"] = measure(lambda _state: yahoo_finance.get_prices(watchlist_symbols), repeats=repeats)
+        os.environ[yahoo_finance.BATCH_PRICES_ENV] = "0"
+        try:
+            results["get_prices_quotes"] = measure(lambda _state: yahoo_finance.get_prices(watchlist_symbols),
+                                                   repeats=repeats)
+        finally:
+            del os.environ[yahoo_finance.BATCH_PRICES_ENV]
+        results["rebalance_portfolio"] = measure(lambda _state: rebalance_portfolio(watchlist), repeats=repeats)
+        desired = rebalance_portfolio(watchlist)
+
+        with TWSConnection(port=simulator.port) as app:
+            results["download_positions"] = measure(quiet(lambda _state: rebalance_steps.download_positions(app)),
+                                                    setup=pricing.price_cache.clear, repeats=repeats)
+            # The watchlist fetch warms the price cache before orders are generated
+            pricing.get_prices(desired)
+            results["create_rebalance_orders"] = measure(quiet(lambda _state: app.create_rebalance_orders(desired)),
+                                                         repeats=repeats)
+            orders = app.orders
+            app.limiter = TokenBucket(1_000_000)
+
+            def place_orders(_state):
+                scheduler = OrderScheduler(app)
+                scheduler.add_all(orders)
+                submitted = scheduler.submit()
+                if not app.order_tracker.wait_for([order_id for order_id, *_rest in submitted],
+                                                  timeout=ORDERS_TIMEOUT):
+                    raise RuntimeError("Orders did not complete")
+
+            results["place_orders"] = measure(quiet(place_orders), repeats=repeats)
+            results["place_orders"]["orders"] = len(orders)
+        results["fixture_requests"] = dict(fixture.requests)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    baseline_stages = {(run["size"], stage): metrics for run in baseline["runs"]
+                       for stage, metrics in run["stages"].items() if "wall_s" in metrics}
+    print(f"\n{'size':>6} {'stage':<24} {'baseline (s)':>13} {'current (s)':>12} {'ratio':>7}")
+    for run in report["runs"]:
+        for stage, metrics in run["stages"].items():
+            before = baseline_stages.get((run["size"], stage))
+            if before is None or "wall_s" not in metrics:
+                continue
+            ratio = metrics["wall_s"]["median"] / before["wall_s"]["median"]
+            flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+            print(f"{run['size']:>6} {stage:<24} {before['wall_s']['median']:>13.4f} "
+                  f"{metrics['wall_s']['median']:>12.4f} {ratio:>6.2f}x{flag}")
+
+
+def main():
+    # Keep the per-position and per-order log lines out of the timings and the report
+    logs.configure(level="WARNING")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", help="Results file. Defaults to benchmarks/results/end_to_end_<time>.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    os.environ.pop("PRICE_PROVIDER", None)
+    rebalance_steps.POSITIONS_TIMEOUT = POSITIONS_TIMEOUT
+    os.environ.setdefault("PRICE_FETCH_TIMEOUT", str(POSITIONS_TIMEOUT))
+    os.environ.setdefault("CHAIKIN_EMAIL", "bench@example.com")
+    os.environ.setdefault("CHAIKIN_PASSWORD", "bench")
+    started = datetime.now(timezone.utc)
+    report = {
+        "benchmark": "end_to_end",
+        "started": started.isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as session_dir:
+        os.environ["CHAIKIN_SESSION_DIR"] = session_dir
+        for size in args.sizes:
+            stages = run_size(size, args.repeats)
+            fixture_requests = stages.pop("fixture_requests")
+            report["runs"].append({"size": size, "stages": stages, "fixture_requests": fixture_requests})
+            print(f"\nPortfolio size {size}")
+            for stage, metrics in stages.items():
+                if "skipped" in metrics:
+                    print(f"  {stage:<24} skipped ({metrics['skipped']})")
+                else:
+                    print(f"  {stage:<24} {metrics['wall_s']['median']:>9.4f}s  "
+                          f"peak {metrics['peak_bytes'] / 1e6:>8.2f} MB  net blocks {metrics['net_blocks']:>8}")
+
+    report["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    output = args.output or os.path.join(RESULTS_DIR, f"end_to_end_{started:%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Load test of IBApp's message handling against the offline TWS simulator.
+
+Times a full reqPositions round trip (position callbacks, positionEnd and the
+position book build) for books of 1k to 50k positions, then a burst of market
+orders whose fills arrive in several parts with duplicated status messages, and
+checks that the order tracker saw every order reach a terminal state exactly once.
+Prices come from the simulator itself, so no network access is needed.
+
+Run from the repository root:
+    python benchmarks/bench_ibapp_messages.py
+"""
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logs  # noqa: E402
+from order_scheduler import OrderScheduler  # noqa: E402
+from pricing import PriceProvider  # noqa: E402
+from rate_limit import TokenBucket  # noqa: E402
+from tws_api import TWSConnection  # noqa: E402
+from tws_simulator import TWSSimulator  # noqa: E402
+
+POSITION_COUNTS = (1000, 10000, 50000)
+ORDER_COUNTS = (100, 1000)
+PARTIAL_FILLS = 3
+DUPLICATE_STATUSES = 2
+TIMEOUT = 120  # seconds
+
+
+class SimulatorPriceProvider(PriceProvider):
+    name = "simulator"
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def get_prices(self, symbols):
+        return {symbol: self.simulator.price(symbol) for symbol in symbols}
+
+
+def time_positions(app):
+    received = threading.Event()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.get_my_positions(callback=lambda _positions_map: received.set())
+        if not received.wait(TIMEOUT):
+            raise RuntimeError("Timed out waiting for positions")
+    return time.perf_counter() - start
+
+
+def time_orders(app, simulator, n_orders):
+    # Pacing is the simulator's concern here; measure the client's own overhead
+    app.limiter = TokenBucket(1_000_000)
+    scheduler = OrderScheduler(app)
+    symbols = list(simulator.books[simulator.accounts[0]])
+    scheduler.add_all([(symbols[i % len(symbols)], "BUY" if i % 2 else "SELL", 10) for i in range(n_orders)])
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        submitted = scheduler.submit()
+        done = app.order_tracker.wait_for([order_id for order_id, *_rest in submitted], timeout=TIMEOUT)
+    elapsed = time.perf_counter() - start
+    assert done, "orders did not all reach a terminal status"
+    return elapsed
+
+
+def main():
+    # Log every position and order as usual, to a sink that discards them
+    logs.configure(stream=open(os.devnull, "w"))
+    print(f"{'positions':>9} {'round trip (s)':>15} {'positions/s':>12}")
+    for n_positions in POSITION_COUNTS:
+        with TWSSimulator(positions=n_positions) as simulator:
+            with TWSConnection(port=simulator.port) as app:
+                app.price_provider = SimulatorPriceProvider(simulator)
+                elapsed = time_positions(app)
+                assert len(app.positions_map) == n_positions, "positions missing"
+            print(f"{n_positions:>9} {elapsed:>15.3f} {n_positions / elapsed:>12.0f}")
+
+    print()
+    print(f"{'orders':>9} {'statuses':>9} {'submit+fill (s)':>16} {'statuses/s':>11}")
+    for n_orders in ORDER_COUNTS:
+        with TWSSimulator(positions=1000, partial_fills=PARTIAL_FILLS,
+                          duplicate_statuses=DUPLICATE_STATUSES) as simulator:
+            with TWSConnection(port=simulator.port) as app:
+                elapsed = time_orders(app, simulator, n_orders)
+                statuses = simulator.stats["order_statuses"]
+            print(f"{n_orders:>9} {statuses:>9} {elapsed:>16.3f} {statuses / elapsed:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold start benchmark of the non-trading CLI commands.
+
+Runs `cli.py watchlist`, `plan` and `export-csv` against a saved suggestions
+response in fresh interpreters, and compares their wall time with loading the
+modules every entry point used to import eagerly (Playwright, requests,
+yfinance/pandas, ibapi and NumPy). `python -X importtime` is used to check that
+none of those heavy modules is loaded by the non-trading commands.
+
+Run from the repository root:
+    python benchmarks/bench_import_time.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, "cli.py")
+REPEATS = 7
+WATCHLIST_SIZE = 500
+HEAVY_MODULES = ("playwright", "requests", "yfinance", "pandas", "ibapi", "numpy")
+EAGER_IMPORTS = "import playwright.sync_api, requests, yfinance, ibapi.client, ibapi.wrapper, numpy"
+
+
+def write_suggestions(path):
+    suggestions = {"data": {"data": [
+        {"symbol": f"S{i:04d}", "name": f"Stock {i}", "ratingName": "Bullish", "pgrRating": 4 + i % 4}
+        for i in range(WATCHLIST_SIZE)
+    ]}}
+    with open(path, "w") as f:
+        json.dump(suggestions, f)
+
+
+def run(command, cwd):
+    """
+    Returns:
+        tuple: Median wall time in seconds and the top-level modules imported, from the last run
+    """
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", *command], cwd=cwd, capture_output=True,
+                                text=True, check=True)
+        times.append(time.perf_counter() - start)
+    # importtime lines: "import time: self [us] | cumulative | imported package", nested ones indented
+    modules = {line.rsplit("|", 1)[-1].strip().split(".")[0] for line in result.stderr.splitlines()
+               if line.startswith("import time:") and "|" in line}
+    return statistics.median(times), modules
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        suggestions = os.path.join(workdir, "suggestions.json")
+        write_suggestions(suggestions)
+
+        baseline, _modules = run(["-c", EAGER_IMPORTS], workdir)
+        interpreter, _modules = run(["-c", "pass"], workdir)
+        print(f"{'command':<34} {'median (s)':>11} {'vs eager':>9}  heavy modules loaded")
+        print(f"{'python -c pass':<34} {interpreter:>11.3f} {interpreter / baseline:>8.0%}")
+        print(f"{'eager imports (previous main.py)':<34} {baseline:>11.3f} {1:>8.0%}")
+        for command in ("watchlist", "plan", "export-csv"):
+            elapsed, modules = run([CLI, command, "--input", suggestions], workdir)
+            heavy = sorted(modules.intersection(HEAVY_MODULES))
+            print(f"{'cli.py ' + command:<34} {elapsed:>11.3f} {elapsed / baseline:>8.0%}  {', '.join(heavy) or '-'}")
+            assert not heavy, f"{command} imported {heavy}"
+
+
+if __name__ == "__main__":
+    main()
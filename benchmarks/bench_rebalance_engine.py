@@ -0,0 +1,100 @@
+"""
+Benchmark of the vectorized rebalance engine against the scalar implementation.
+
+Checks that `rebalance_engine` produces exactly the same targets and orders as
+`rebalance.rebalance_portfolio` and `IBApp.create_rebalance_orders`, then times
+both across universe sizes up to 10k symbols x 100 accounts.
+
+Run from the repository root:
+    python benchmarks/bench_rebalance_engine.py
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logs  # noqa: E402
+from rebalance import rebalance_portfolio  # noqa: E402
+from rebalance_engine import share_deltas, target_percentages  # noqa: E402
+from tws_api import IBApp  # noqa: E402
+
+SYMBOL_COUNTS = (100, 1000, 10000)
+ACCOUNT_COUNTS = (1, 10, 100)
+SEED = 7
+
+
+def make_universe(n_symbols, n_accounts, rng):
+    symbols = [f"S{i:05d}" for i in range(n_symbols)]
+    ratings = rng.integers(5, 8, size=n_symbols)
+    prices = np.round(rng.uniform(1, 500, size=n_symbols), 2)
+    quantities = rng.integers(0, 200, size=(n_accounts, n_symbols))
+    # Hold some symbols that are not in the watchlist so that closing sells are exercised
+    in_watchlist = rng.random(n_symbols) < 0.9
+    return symbols, ratings, prices, quantities, in_watchlist
+
+
+def scalar_rebalance(app, symbols, ratings, prices, quantities, in_watchlist):
+    watchlist = {sym: {"rating_id": int(r)} for sym, r, keep in zip(symbols, ratings, in_watchlist) if keep}
+    desired = rebalance_portfolio(watchlist)
+    all_orders = []
+    for account_quantities in quantities:
+        app.positions_map = {sym: (int(q), float(p), float(p) * int(q), 0.0)
+                             for sym, q, p in zip(symbols, account_quantities, prices)}
+        app.total_market_value = sum(value[2] for value in app.positions_map.values())
+        with contextlib.redirect_stdout(io.StringIO()):
+            all_orders.append(app.create_rebalance_orders(desired))
+    return desired, all_orders
+
+
+def vectorized_rebalance(symbols, ratings, prices, quantities, in_watchlist):
+    watch_idx = np.flatnonzero(in_watchlist)
+    ordered_symbols, percentages = target_percentages([symbols[i] for i in watch_idx], ratings[watch_idx])
+    index = {sym: i for i, sym in enumerate(symbols)}
+    desired_idx = np.array([index[sym] for sym in ordered_symbols], dtype=np.int64)
+    closing_idx = np.flatnonzero(~in_watchlist)
+    columns = np.concatenate([desired_idx, closing_idx])
+    targets = np.concatenate([percentages, np.full(len(closing_idx), np.nan)])
+    # Sum market values in position order, like IBApp does
+    totals = np.cumsum(prices * quantities, axis=1)[:, -1]
+    deltas = share_deltas(targets, prices[columns], quantities[:, columns], totals)
+    return ordered_symbols, percentages, columns, deltas
+
+
+def deltas_to_orders(symbols, columns, account_deltas):
+    return [(symbols[columns[i]], "BUY" if account_deltas[i] > 0 else "SELL", abs(int(account_deltas[i])))
+            for i in np.flatnonzero(account_deltas)]
+
+
+def main():
+    # Keep the per-position and per-order log lines out of the timings and the report
+    logs.configure(level="WARNING")
+    rng = np.random.default_rng(SEED)
+    app = IBApp()
+    print(f"{'symbols':>8} {'accounts':>8} {'scalar (s)':>11} {'vectorized (s)':>15} {'speedup':>8}")
+    for n_symbols in SYMBOL_COUNTS:
+        for n_accounts in ACCOUNT_COUNTS:
+            universe = make_universe(n_symbols, n_accounts, rng)
+            symbols = universe[0]
+
+            start = time.perf_counter()
+            desired, scalar_orders = scalar_rebalance(app, *universe)
+            scalar_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ordered_symbols, percentages, columns, deltas = vectorized_rebalance(*universe)
+            vector_time = time.perf_counter() - start
+
+            assert list(desired.items()) == list(zip(ordered_symbols, percentages.tolist())), "targets differ"
+            for account_deltas, expected in zip(deltas, scalar_orders):
+                assert deltas_to_orders(symbols, columns, account_deltas) == expected, "orders differ"
+
+            print(f"{n_symbols:>8} {n_accounts:>8} {scalar_time:>11.4f} {vector_time:>15.4f} {scalar_time / vector_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
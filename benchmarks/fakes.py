@@ -0,0 +1,257 @@
+"""
+Local stand-ins for the external services used by the end-to-end benchmark.
+
+`FixtureServer` is an HTTP server that serves a static copy of the Chaikin
+login flow, the Chaikin watchlist and suggestions APIs, and Yahoo Finance style
+chart and quote endpoints for a deterministic symbol universe. `FakeYFinance`
+is a drop-in for the parts of the yfinance module `yahoo_finance` uses, fetching
+from the fixture server instead of Yahoo. Together with `tws_simulator` they let
+every stage of a rebalance run without network access.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import requests
+
+import chaikin
+
+FIXTURE_TOKEN = "fixture-token"
+CHART_DAYS = 5
+
+LOGIN_PAGE = """<!doctype html>
+<html>
+<head><title>Chaikin Analytics</title></head>
+<body>
+<form id="login" onsubmit="return false">
+  <input type="email" aria-label="email">
+  <input type="password" aria-label="password">
+  <button id="submit">Log into Chaikin Analytics</button>
+</form>
+<script>
+const headers = {"jwttoken": "%(token)s", "x-api-key": "fixture", "content-type": "application/json"};
+document.getElementById("submit").addEventListener("click", async () => {
+  const watchlist = await (await fetch("/%(watchlist_api)s", {headers})).json();
+  await fetch("/%(suggestions_api)s", {method: "POST", headers, body: JSON.stringify(
+    {count: 500, page: 1, symbols: watchlist.data.symbols})});
+  document.getElementById("login").remove();
+  const heading = document.createElement("h1");
+  heading.textContent = "My Chaikin";
+  document.body.appendChild(heading);
+});
+</script>
+</body>
+</html>
+"""
+
+
+def fixture_price(symbol: str) -> float:
+    """
+    Returns:
+        float: A deterministic price between 5 and 500 for the symbol
+    """
+    digest = int(hashlib.sha1(symbol.encode()).hexdigest()[:8], 16)
+    return round(5 + digest % 49500 / 100, 2)
+
+
+def fixture_rating(symbol: str) -> int:
+    """
+    Returns:
+        int: A deterministic Chaikin rating id between 1 and 7 for the symbol
+    """
+    return int(hashlib.sha1(symbol.encode()).hexdigest()[8:10], 16) % 7 + 1
+
+
+class FixtureServer:
+    """
+    Threaded HTTP server for the Chaikin and Yahoo fixtures.
+
+    The watchlist and suggestions APIs require the fixture token in the `jwttoken`
+    header and answer 401 otherwise, like an expired Chaikin session. Suggestions
+    are paged by the request's `count` and `page`, like the real backend. Symbols in
+    `chart_missing` have no chart data, so the bulk download misses them and the
+    per-symbol quote fallback is exercised.
+    """
+
+    def __init__(self, symbols: List[str], latency: float = 0.0, chart_missing: Optional[set] = None,
+                 lists: Optional[Dict[str, List[str]]] = None):
+        """
+        Args:
+            symbols (list): The watchlist symbols
+            latency (float): Seconds added to every response, to model a network round trip
+            chart_missing (set, optional): Symbols the chart endpoint has no data for
+            lists (dict, optional): Watchlist symbols by list ID. Other list IDs get `symbols`
+        """
+        self.symbols = symbols
+        self.lists = lists or {}
+        self.latency = latency
+        self.chart_missing = chart_missing or set()
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def _count(self, route: str) -> None:
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def suggestions(self, symbols: List[str], count: Optional[int] = None, page: int = 1) -> Dict:
+        if count:
+            symbols = symbols[(page - 1) * count:page * count]
+        return {"data": {"data": [
+            {"symbol": symbol, "name": f"{symbol} Inc.", "ratingName": f"Rating {fixture_rating(symbol)}",
+             "pgrRating": fixture_rating(symbol)}
+            for symbol in symbols
+        ]}}
+
+    def chart(self, symbol: str) -> Dict:
+        now = int(time.time())
+        timestamps = [now - day * 86400 for day in range(CHART_DAYS, 0, -1)]
+        price = fixture_price(symbol)
+        closes = [round(price * (1 + 0.001 * (day - CHART_DAYS + 1)), 2) for day in range(CHART_DAYS)]
+        return {"chart": {"result": [{"meta": {"symbol": symbol, "regularMarketPrice": price},
+                                      "timestamp": timestamps,
+                                      "indicators": {"quote": [{"close": closes}]}}], "error": None}}
+
+    def _handler(self):
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoints
+            disable_nagle_algorithm = True
+
+            def log_message(self, *_args) -> None:
+                pass
+
+            def _reply(self, status: int, body, content_type: str = "application/json", headers=None) -> None:
+                data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self) -> bool:
+                if self.headers.get("jwttoken") == FIXTURE_TOKEN:
+                    return True
+                self._reply(401, {"error": "unauthorized"})
+                return False
+
+            def _route(self) -> None:
+                if fixture.latency:
+                    time.sleep(fixture.latency)
+                url = urlparse(self.path)
+                path = url.path.lstrip("/")
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                if "api/chaikinlist/mylists/watchlist" in path:
+                    fixture._count("watchlist")
+                    if self._authorized():
+                        list_id = parse_qs(url.query).get("listId", [""])[0]
+                        self._reply(200, {"data": {"symbols": fixture.lists.get(list_id, fixture.symbols)}})
+                elif path == chaikin.SUGGESTIONS_API:
+                    fixture._count("suggestions")
+                    if self._authorized():
+                        payload = json.loads(body or b"{}")
+                        self._reply(200, fixture.suggestions(payload.get("symbols", []), payload.get("count"),
+                                                             payload.get("page", 1)))
+                elif path.startswith("v8/finance/chart/"):
+                    fixture._count("chart")
+                    symbol = path.rsplit("/", 1)[-1]
+                    if symbol in fixture.chart_missing:
+                        self._reply(404, {"chart": {"result": None, "error": {"code": "Not Found"}}})
+                    else:
+                        self._reply(200, fixture.chart(symbol))
+                elif path == "v7/finance/quote":
+                    fixture._count("quote")
+                    symbols = parse_qs(url.query).get("symbols", [""])[0].split(",")
+                    self._reply(200, {"quoteResponse": {"result": [
+                        {"symbol": symbol, "regularMarketPrice": fixture_price(symbol)} for symbol in symbols]}})
+                elif path.startswith("my-chaikin"):
+                    fixture._count("login_page")
+                    page = LOGIN_PAGE % {"token": FIXTURE_TOKEN, "watchlist_api": chaikin.WATCHLIST_API,
+                                         "suggestions_api": chaikin.SUGGESTIONS_API}
+                    self._reply(200, page, "text/html", {"Set-Cookie": "JSESSIONID=fixture; Path=/"})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            do_GET = _route
+            do_POST = _route
+
+        return Handler
+
+
+class _FakeTicker:
+    def __init__(self, yf: "FakeYFinance", symbol: str):
+        self._yf = yf
+        self.symbol = symbol
+
+    @property
+    def info(self) -> Dict:
+        resp = self._yf.session.get(f"{self._yf.base_url}/v7/finance/quote", params={"symbols": self.symbol})
+        resp.raise_for_status()
+        return resp.json()["quoteResponse"]["result"][0]
+
+    def history(self, period: str = "1d") -> pd.DataFrame:
+        closes = self._yf.closes(self.symbol)
+        return pd.DataFrame({"Close": closes if closes is not None else pd.Series(dtype=float)})
+
+
+class FakeYFinance:
+    """
+    Replacement for the yfinance module inside `yahoo_finance`, backed by the
+    fixture server's chart and quote endpoints. `download` returns the same
+    (field, ticker) column layout as yfinance.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def closes(self, symbol: str) -> Optional[pd.Series]:
+        resp = self.session.get(f"{self.base_url}/v8/finance/chart/{symbol}")
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        result = resp.json()["chart"]["result"][0]
+        return pd.Series(result["indicators"]["quote"][0]["close"],
+                         index=pd.to_datetime(result["timestamp"], unit="s"), name=symbol)
+
+    def download(self, symbols, period: str = "5d", interval: str = "1d", progress: bool = False, threads: int = 1,
+                 auto_adjust: bool = False) -> pd.DataFrame:
+        symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        with ThreadPoolExecutor(max_workers=max(1, int(threads))) as executor:
+            series = [closes for closes in executor.map(self.closes, symbols) if closes is not None]
+        if not series:
+            return pd.DataFrame()
+        return pd.concat({"Close": pd.concat(series, axis=1)}, axis=1)
+
+    def Ticker(self, symbol: str) -> _FakeTicker:  # noqa: N802, mirrors yfinance.Ticker
+        return _FakeTicker(self, symbol)
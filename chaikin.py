@@ -1,12 +1,46 @@
+import concurrent.futures
+import contextlib
 import os
 import json
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
-from playwright.sync_api import sync_playwright, expect, Response
-import requests
+import telemetry
+from logs import get_logger
+
+# requests and Playwright are imported where they are used, so that parsing a
+# saved watchlist does not pay for loading them
+if TYPE_CHECKING:
+    import requests
+    from playwright.sync_api import Page, Response, Route
 
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36"
 
+WATCHLIST_URL = "https://members.chaikinanalytics.com/my-chaikin/lists/health-check/my-stocks?listId=2370927&listType=User"
+WATCHLIST_API = "api/chaikinlist/mylists/watchlist?listId=2370927"
+SUGGESTIONS_API = "api/suggestions"
+SUGGESTIONS_API_FULL = "https://members-backend.chaikinanalytics.com/api/suggestions"
+CHAIKIN_DOMAIN = "chaikinanalytics.com"
+DEFAULT_LIST_ID = "2370927"
+
+# Direct API fetches
+SUGGESTIONS_PAGE_SIZE = 500  # suggestions per page, the most the backend returns at once
+MAX_FETCH_WORKERS = 8  # concurrent requests, and pooled keep-alive connections per host
+HTTP_TIMEOUT = 30  # seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5  # seconds, doubled on every retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Resource types the fast login mode never downloads
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet", "texttrack", "manifest"}
+LOGIN_TIMEOUT = 30000  # milliseconds
+
+SESSION_FILE = "chaikin_session.json"
+STORAGE_STATE_FILE = "chaikin_storage_state.json"  # written by earlier versions, removed on the next login
+
+logger = get_logger(__name__)
+
 
 def parse_suggestions(suggestions: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     """
@@ -33,102 +67,422 @@ def parse_suggestions(suggestions: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     return parsed_suggestions
 
 
-def get_watchlist() -> Dict[str, Dict[str, Any]]:
+class ChaikinAuthError(RuntimeError):
+    """Raised when the Chaikin backend rejects the stored session (HTTP 401/403)."""
+
+
+def _session_dir() -> str:
+    return os.environ.get("CHAIKIN_SESSION_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ib_trade_helper"))
+
+
+def _write_private_file(path: str, content: str) -> None:
+    """
+    Writes a file that only the current user can read, since it holds session credentials.
+    """
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.chmod(path, 0o600)
+
+
+def _load_session() -> Optional[Dict[str, Any]]:
+    """
+    Loads the persisted Chaikin session, if any.
+
+    Returns:
+        dict: The stored session with 'headers', 'watchlist_url', 'watchlist_method'
+              and 'cookies' keys, or None if no usable session is stored.
+    """
+    try:
+        with open(os.path.join(_session_dir(), SESSION_FILE)) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not session.get("headers") or not session.get("watchlist_url"):
+        return None
+    return session
+
+
+def _save_session(session: Dict[str, Any]) -> None:
+    """
+    Persists the captured API session. The browser storage state is not kept: every
+    browser login starts from a fresh context, and later runs only need the session.
+
+    Args:
+        session (dict): The captured headers, watchlist endpoint and cookies
+    """
+    _write_private_file(os.path.join(_session_dir(), SESSION_FILE), json.dumps(session))
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(_session_dir(), STORAGE_STATE_FILE))
+
+
+def _check_auth(resp: "requests.Response") -> None:
+    if resp.status_code in (401, 403):
+        raise ChaikinAuthError(f"Chaikin session rejected with HTTP {resp.status_code}.")
+    resp.raise_for_status()
+
+
+def _watchlist_url(session: Dict[str, Any], list_id: str) -> str:
+    """
+    Returns the watchlist API URL captured at login, pointed at another list.
+
+    Args:
+        session (dict): The stored session as returned by `_load_session`
+        list_id (str): The Chaikin list ID
+
+    Returns:
+        str: The watchlist API URL for the list
+    """
+    url = urlparse(session["watchlist_url"])
+    query = [(key, list_id if key == "listId" else value) for key, value in parse_qsl(url.query)]
+    if "listId" not in dict(query):
+        query.append(("listId", list_id))
+    return urlunparse(url._replace(query=urlencode(query)))
+
+
+def _http_session(session: Dict[str, Any]) -> "requests.Session":
+    """
+    Creates a `requests.Session` that sends the captured auth headers and cookies,
+    keeps up to `MAX_FETCH_WORKERS` connections alive per host and retries
+    throttled or failed requests with exponential backoff.
+
+    Args:
+        session (dict): The stored session as returned by `_load_session`
+
+    Returns:
+        requests.Session: The pooled HTTP session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,  # The suggestions POST is a read and safe to repeat
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=MAX_FETCH_WORKERS, max_retries=retry)
+    http = requests.Session()
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    http.headers.update(session["headers"])
+    http.cookies.update(session.get("cookies") or {})
+    return http
+
+
+def _fetch_watchlist_symbols(session: Dict[str, Any], http: "requests.Session",
+                             list_id: Optional[str] = None) -> List[str]:
+    """
+    Fetches the watchlist symbols directly from the Chaikin backend.
+
+    Args:
+        session (dict): The stored session as returned by `_load_session`
+        http (requests.Session): The pooled HTTP session from `_http_session`
+        list_id (str, optional): The list to fetch. Defaults to the list captured at login
+
+    Returns:
+        list: The symbols in the watchlist
+
+    Raises:
+        ChaikinAuthError: If the session is no longer accepted
+    """
+    url = _watchlist_url(session, list_id) if list_id else session["watchlist_url"]
+    resp = http.request(session.get("watchlist_method", "GET"), url, timeout=HTTP_TIMEOUT)
+    telemetry.count("http_requests_total", service="chaikin", endpoint="watchlist", status=resp.status_code)
+    _check_auth(resp)
+    return resp.json().get("data", {}).get("symbols", [])
+
+
+def _fetch_suggestions(http: "requests.Session", watchlist_symbols: List[str], page: int = 1) -> Dict[str, Any]:
+    """
+    Fetches one page of the raw suggestions for the given symbols from the Chaikin backend.
+
+    Args:
+        http (requests.Session): The pooled HTTP session from `_http_session`
+        watchlist_symbols (list): The symbols to get suggestions for
+        page (int): The 1-based page of `SUGGESTIONS_PAGE_SIZE` suggestions
+
+    Returns:
+        dict: The raw suggestions API response
+
+    Raises:
+        ChaikinAuthError: If the session is no longer accepted
+    """
+    # Prepare payload for suggestions API
+    payload = {
+        "count": SUGGESTIONS_PAGE_SIZE,
+        "page": page,
+        "sortField": "week1ChangePct",
+        "sortDirection": "desc",
+        "fromDate": None,
+        "toDate": None,
+        "symbols": watchlist_symbols,
+        "listId": None
+    }
+    resp = http.post(SUGGESTIONS_API_FULL, data=json.dumps(payload), timeout=HTTP_TIMEOUT)
+    telemetry.count("http_requests_total", service="chaikin", endpoint="suggestions", status=resp.status_code)
+    _check_auth(resp)
+    return resp.json()
+
+
+def _extract_suggestions_headers(headers: Dict[str, str]) -> Dict[str, str]:
     """
-    Logs into Chaikin Analytics using credentials from environment variables,
-    intercepts the suggestions API response, and returns parsed suggestions.
+    Picks the headers needed for proactive suggestions API requests out of an
+    intercepted browser request.
+
+    Args:
+        headers (dict): The headers of the intercepted suggestions request
+
+    Returns:
+        dict: The headers to send with direct API requests, without empty values
+    """
+    suggestions_headers = {
+        'x-api-key': headers.get('x-api-key'),
+        'jwttoken': headers.get('jwttoken'),
+        'uuid': headers.get('uuid'),
+        'x-session-id': headers.get('x-session-id'),
+        'x-app-id': headers.get('x-app-id'),
+        'jsessionid': headers.get('jsessionid'),
+        'content-type': headers.get('content-type', 'application/json'),
+        'accept': headers.get('accept', 'application/json, text/plain, */*'),
+        'accept-language': headers.get('accept-language', 'en-US,en;q=0.9'),
+        'referer': 'https://members.chaikinanalytics.com/',
+    }
+    # Clean up headers for requests
+    return {k: v for k, v in suggestions_headers.items() if v}
+
+
+def _is_chaikin_host(host: str) -> bool:
+    """
+    Args:
+        host (str): A host name or cookie domain, without a leading dot
+
+    Returns:
+        bool: Whether the host is CHAIKIN_DOMAIN or one of its subdomains
+    """
+    return host == CHAIKIN_DOMAIN or host.endswith("." + CHAIKIN_DOMAIN)
+
+
+def _is_fast_login_enabled() -> bool:
+    return os.environ.get("CHAIKIN_FAST_LOGIN", "1").lower() not in ("0", "false", "no")
+
+
+def _block_non_essential(route: "Route") -> None:
+    """
+    Route handler used by the fast login mode. Aborts heavy resource types and any
+    request to a host outside of Chaikin Analytics (analytics, trackers, CDNs for fonts, ...).
+    """
+    request = route.request
+    host = urlparse(request.url).hostname or ""
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or not _is_chaikin_host(host):
+        route.abort()
+    else:
+        route.continue_()
+
+
+def _fill_login_form(page: "Page") -> None:
+    page.get_by_role("textbox", name="email").fill(os.environ.get("CHAIKIN_EMAIL", ""))
+    page.get_by_role("textbox", name="password").fill(os.environ.get("CHAIKIN_PASSWORD", ""))
+
+
+def _browser_login(fast: Optional[bool] = None) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Logs into Chaikin Analytics with headless Chromium using credentials from
+    environment variables and captures the API session from the network traffic.
+    The captured session is persisted for later runs.
+
+    In fast mode non-essential resources and third-party hosts are blocked, and the
+    login resolves as soon as the watchlist response and the suggestions request
+    have been seen instead of waiting for the page to go idle.
+
+    Args:
+        fast (bool, optional): Whether to use the fast login mode. Defaults to the
+                               CHAIKIN_FAST_LOGIN environment variable (enabled unless set to 0).
 
     Returns:
-        dict: Parsed suggestions data as returned by `parse_suggestions`.
+        tuple: The captured session and the watchlist symbols seen during login
     """
     # Validate that the required environment variables are set
     if not os.environ.get("CHAIKIN_EMAIL") or not os.environ.get("CHAIKIN_PASSWORD"):
         raise ValueError("Please set CHAIKIN_EMAIL and CHAIKIN_PASSWORD environment variables.")
 
-    WATCHLIST_URL = "https://members.chaikinanalytics.com/my-chaikin/lists/health-check/my-stocks?listId=2370927&listType=User"
-    WATCHLIST_API = "api/chaikinlist/mylists/watchlist?listId=2370927"
-    SUGGESTIONS_API = "api/suggestions"
-    SUGGESTIONS_API_FULL = "https://members-backend.chaikinanalytics.com/api/suggestions"
+    from playwright.sync_api import sync_playwright, expect
 
-    with (sync_playwright() as playwright):
+    if fast is None:
+        fast = _is_fast_login_enabled()
+
+    start_time = time.monotonic()
+    with telemetry.span("browser_login", fast=fast), sync_playwright() as playwright:
         browser = playwright.chromium.launch(headless=True)
         context = browser.new_context(user_agent=USER_AGENT)
         page = context.new_page()
         relevant_watchlist_responses = []
+        watchlist_request = {}
         suggestions_headers = {}
-        suggestions_cookies = None
-        suggestions_api_key = None
-        suggestions_jwttoken = None
-        suggestions_uuid = None
-        suggestions_x_session_id = None
-        suggestions_x_app_id = None
-        suggestions_jsessionid = None
-        suggestions_headers_found = False
-
-        def handle_response(response: Response) -> None:
-            nonlocal suggestions_headers_found
-            url = response.url
-            if WATCHLIST_API in url:
-                data = response.json()
-                relevant_watchlist_responses.append(data)
-            elif SUGGESTIONS_API in url and not suggestions_headers_found:
-                req = response.request
-                # Extract headers needed for the proactive request
-                headers = req.headers.copy()
-                # Save relevant headers
-                suggestions_headers['x-api-key'] = headers.get('x-api-key')
-                suggestions_headers['jwttoken'] = headers.get('jwttoken')
-                suggestions_headers['uuid'] = headers.get('uuid')
-                suggestions_headers['x-session-id'] = headers.get('x-session-id')
-                suggestions_headers['x-app-id'] = headers.get('x-app-id')
-                suggestions_headers['jsessionid'] = headers.get('jsessionid')
-                suggestions_headers['content-type'] = headers.get('content-type', 'application/json')
-                suggestions_headers['accept'] = headers.get('accept', 'application/json, text/plain, */*')
-                suggestions_headers['accept-language'] = headers.get('accept-language', 'en-US,en;q=0.9')
-                suggestions_headers['referer'] = 'https://members.chaikinanalytics.com/'
-                suggestions_headers_found = True
-
-        page.on("response", handle_response)
-        page.goto(WATCHLIST_URL)
-        page.get_by_role("textbox", name="email").fill(os.environ.get("CHAIKIN_EMAIL", ""))
-        page.get_by_role("textbox", name="password").fill(os.environ.get("CHAIKIN_PASSWORD", ""))
-        page.get_by_role("button", name="Log into Chaikin Analytics").click()
-        page.wait_for_load_state("networkidle", timeout=5000)
-        expect(page.get_by_role("heading", name="My Chaikin")).to_be_visible(timeout=10000)
 
+        if fast:
+            context.route("**/*", _block_non_essential)
+            page.goto(WATCHLIST_URL, wait_until="domcontentloaded")
+            _fill_login_form(page)
+            # Wait on the exact network events we need rather than a page-idle heuristic
+            with page.expect_response(lambda r: WATCHLIST_API in r.url, timeout=LOGIN_TIMEOUT) as watchlist_info, \
+                    page.expect_request(lambda r: SUGGESTIONS_API in r.url, timeout=LOGIN_TIMEOUT) as suggestions_info:
+                page.get_by_role("button", name="Log into Chaikin Analytics").click()
+            watchlist_response = watchlist_info.value
+            relevant_watchlist_responses.append(watchlist_response.json())
+            watchlist_request["url"] = watchlist_response.url
+            watchlist_request["method"] = watchlist_response.request.method
+            suggestions_headers = _extract_suggestions_headers(suggestions_info.value.headers)
+        else:
+            def handle_response(response: "Response") -> None:
+                nonlocal suggestions_headers
+                url = response.url
+                if WATCHLIST_API in url:
+                    data = response.json()
+                    relevant_watchlist_responses.append(data)
+                    watchlist_request.setdefault("url", url)
+                    watchlist_request.setdefault("method", response.request.method)
+                elif SUGGESTIONS_API in url and not suggestions_headers:
+                    # Extract headers needed for the proactive request
+                    suggestions_headers = _extract_suggestions_headers(response.request.headers.copy())
+
+            page.on("response", handle_response)
+            page.goto(WATCHLIST_URL)
+            _fill_login_form(page)
+            page.get_by_role("button", name="Log into Chaikin Analytics").click()
+            page.wait_for_load_state("networkidle", timeout=5000)
+            expect(page.get_by_role("heading", name="My Chaikin")).to_be_visible(timeout=10000)
+
+        storage_state = context.storage_state()
         context.close()
         browser.close()
 
-        if not relevant_watchlist_responses:
-            raise RuntimeError("Failed to get watchlist response.")
-        if not suggestions_headers_found:
-            raise RuntimeError("Failed to get suggestions API headers.")
-
-        # Get symbols from watchlist
-        watchlist_symbols = relevant_watchlist_responses[0].get("data", {}).get("symbols", [])
-        # Prepare payload for suggestions API
-        payload = {
-            "count": 500,
-            "page": 1,
-            "sortField": "week1ChangePct",
-            "sortDirection": "desc",
-            "fromDate": None,
-            "toDate": None,
-            "symbols": watchlist_symbols,
-            "listId": None
-        }
-        # Clean up headers for requests
-        req_headers = {k: v for k, v in suggestions_headers.items() if v}
-        # Make proactive POST request to suggestions API
-        resp = requests.post(
-            SUGGESTIONS_API_FULL,
-            headers=req_headers,
-            data=json.dumps(payload),
-            cookies=None  # If needed, can extract cookies from Playwright context
-        )
-        resp.raise_for_status()
-        suggestions_response = resp.json()
-        return parse_suggestions(suggestions_response)
+    logger.debug("Chaikin browser login (%s mode) took %.2fs", "fast" if fast else "full", time.monotonic() - start_time)
+
+    if not relevant_watchlist_responses:
+        raise RuntimeError("Failed to get watchlist response.")
+    if not suggestions_headers:
+        raise RuntimeError("Failed to get suggestions API headers.")
+
+    session = {
+        "headers": suggestions_headers,
+        "watchlist_url": watchlist_request["url"],
+        "watchlist_method": watchlist_request["method"],
+        "cookies": {
+            cookie["name"]: cookie["value"]
+            for cookie in storage_state.get("cookies", [])
+            if _is_chaikin_host(cookie.get("domain", "").lstrip("."))
+        },
+    }
+    _save_session(session)
+
+    # Get symbols from watchlist
+    watchlist_symbols = relevant_watchlist_responses[0].get("data", {}).get("symbols", [])
+    return session, watchlist_symbols
+
+
+def watchlist_ids() -> List[str]:
+    """
+    Reads the Chaikin lists to fetch from the CHAIKIN_LIST_IDS environment variable,
+    a comma-separated list of list IDs.
+
+    Returns:
+        list: The list IDs, `DEFAULT_LIST_ID` when the variable is not set
+    """
+    value = os.environ.get("CHAIKIN_LIST_IDS", "")
+    return [list_id.strip() for list_id in value.split(",") if list_id.strip()] or [DEFAULT_LIST_ID]
+
+
+def _fetch_lists(session: Dict[str, Any], list_ids: List[str],
+                 known_symbols: Optional[Dict[str, List[str]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetches the watchlists and every suggestions page of the given lists
+    concurrently over one pooled HTTP session.
+
+    Each list's suggestion pages are requested as soon as its watchlist arrives,
+    and each page is parsed as soon as it arrives. The pages are merged in list
+    and page order, so the result does not depend on response timing.
+
+    Args:
+        session (dict): The stored session as returned by `_load_session`
+        list_ids (list): The Chaikin list IDs
+        known_symbols (dict, optional): Watchlist symbols already known by list ID, e.g.
+                                        captured during the browser login, which are not fetched again
+
+    Returns:
+        dict: The parsed suggestions of all lists, as returned by `parse_suggestions`
+
+    Raises:
+        ChaikinAuthError: If the session is no longer accepted
+    """
+    known_symbols = known_symbols or {}
+    pages: Dict[Tuple[int, int], Dict[str, Dict[str, Any]]] = {}
+    with _http_session(session) as http, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS,
+                                                  thread_name_prefix="chaikin-fetch") as executor:
+        pending: Dict[concurrent.futures.Future, Tuple[str, int, int]] = {}
+
+        def request_pages(list_index: int, symbols: List[str]) -> None:
+            n_pages = max(1, -(-len(symbols) // SUGGESTIONS_PAGE_SIZE))
+            for page in range(1, n_pages + 1):
+                pending[executor.submit(_fetch_suggestions, http, symbols, page)] = ("suggestions", list_index, page)
+
+        for list_index, list_id in enumerate(list_ids):
+            if list_id in known_symbols:
+                request_pages(list_index, known_symbols[list_id])
+            else:
+                pending[executor.submit(_fetch_watchlist_symbols, session, http, list_id)] = ("watchlist", list_index, 0)
+
+        try:
+            while pending:
+                done, _not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    kind, list_index, page = pending.pop(future)
+                    if kind == "watchlist":
+                        request_pages(list_index, future.result())
+                    else:
+                        pages[(list_index, page)] = parse_suggestions(future.result())
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    merged: Dict[str, Dict[str, Any]] = {}
+    for key in sorted(pages):
+        merged.update(pages[key])
+    return merged
+
+
+def get_watchlist(list_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the parsed Chaikin Analytics suggestions for one or more watchlists.
+
+    A persisted API session is reused when available, so a warm run calls the
+    watchlist and suggestions APIs directly. The browser login only runs when no
+    session is stored or the stored one is rejected with a 401/403, and its auth
+    is then used for every list.
+
+    Args:
+        list_ids (list, optional): The Chaikin list IDs. Defaults to `watchlist_ids`
+
+    Returns:
+        dict: Parsed suggestions data of all lists as returned by `parse_suggestions`.
+              A symbol on several lists appears once.
+    """
+    list_ids = list_ids or watchlist_ids()
+    session = _load_session()
+    if session:
+        try:
+            return _fetch_lists(session, list_ids)
+        except ChaikinAuthError as e:
+            logger.info("Stored Chaikin session expired (%s), logging in again", e)
+
+    session, watchlist_symbols = _browser_login()
+    login_list_id = dict(parse_qsl(urlparse(session["watchlist_url"]).query)).get("listId", DEFAULT_LIST_ID)
+    return _fetch_lists(session, list_ids, known_symbols={login_list_id: watchlist_symbols})
 
 
 if __name__ == "__main__":
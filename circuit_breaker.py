@@ -0,0 +1,83 @@
+import threading
+import time
+from typing import Optional
+
+import telemetry
+
+DEFAULT_FAILURE_THRESHOLD = 3  # consecutive failures that open the circuit
+DEFAULT_BASE_DELAY = 1.0  # seconds the circuit stays open the first time
+DEFAULT_MAX_DELAY = 300.0  # seconds
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for a remote dependency.
+
+    After `failure_threshold` consecutive failures the circuit opens and `allow`
+    refuses calls, so callers fail fast instead of waiting on a dependency that is
+    down or rate limiting them. Once the open delay has passed a single trial call
+    is let through (half-open). A success closes the circuit; a failure reopens it
+    for twice as long as the last time, up to `max_delay`.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        Args:
+            name (str): The dependency name, used in telemetry
+            failure_threshold (int): Consecutive failures that open the circuit
+            base_delay (float): Seconds the circuit stays open after it first opens
+            max_delay (float): Maximum seconds the circuit stays open
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures: int = 0
+        self.opened: int = 0  # times the circuit opened since it was last closed
+        self._open_until: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._open_until is not None and time.monotonic() < self._open_until
+
+    def retry_in(self) -> float:
+        """
+        Returns:
+            float: Seconds until the circuit lets a trial call through, 0 if it is closed
+        """
+        with self._lock:
+            return max(0.0, self._open_until - time.monotonic()) if self._open_until is not None else 0.0
+
+    def allow(self) -> bool:
+        """
+        Returns:
+            bool: Whether a call may be made now. While half-open only one trial call is allowed
+        """
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if time.monotonic() < self._open_until or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened = 0
+            self._open_until = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                delay = min(self.max_delay, self.base_delay * 2 ** self.opened)
+                self.opened += 1
+                self._open_until = time.monotonic() + delay
+                self._trial_in_flight = False
+                telemetry.count("circuit_opened_total", breaker=self.name)
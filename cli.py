@@ -0,0 +1,162 @@
+"""
+Command line entry point.
+
+    python cli.py watchlist  [--input FILE] [--output FILE]
+    python cli.py plan       [--input FILE]
+    python cli.py export-csv [--input FILE] [--suffix SUFFIX]
+    python cli.py execute    [--sequential] [--accounts A,B | ALL]
+    python cli.py diff       [OLD_RUN NEW_RUN]
+    python cli.py backtest   --end YYYY-MM-DD [--start YYYY-MM-DD] [--cost-bps BPS] [--workers N]
+
+Heavy dependencies (Playwright, requests, yfinance/pandas, ibapi, NumPy) are only
+imported by the code path that needs them, so the commands that work from a saved
+watchlist start without loading any of them.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional
+
+
+def load_watchlist(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Loads the watchlist from a file, or fetches it from Chaikin Analytics.
+
+    Args:
+        path (str, optional): A saved watchlist, either the raw suggestions API response
+                              or the parsed watchlist written by the `watchlist` command.
+                              Fetched from Chaikin when None
+
+    Returns:
+        dict: The parsed, unfiltered watchlist
+    """
+    if path is None:
+        from chaikin import get_watchlist
+        return get_watchlist()
+
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data.get("data"), dict):  # Raw suggestions API response
+        from chaikin import parse_suggestions
+        return parse_suggestions(data)
+    return data
+
+
+def plan_portfolio(path: Optional[str]) -> Dict[str, float]:
+    from rebalance import filter_watchlist, rebalance_portfolio
+    return rebalance_portfolio(filter_watchlist(load_watchlist(path)))
+
+
+def cmd_watchlist(args: argparse.Namespace) -> None:
+    text = json.dumps(load_watchlist(args.input), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Saved watchlist to {args.output}")
+    else:
+        print(text)
+
+
+def cmd_plan(args: argparse.Namespace) -> None:
+    portfolio = plan_portfolio(args.input)
+    for symbol, percent in portfolio.items():
+        print(f"{symbol:<8} {percent:>8.4f}%")
+    print(f"{len(portfolio)} symbols, {sum(portfolio.values()):.4f}% allocated")
+
+
+def cmd_export_csv(args: argparse.Namespace) -> None:
+    from rebalance import download_rebalance_csv
+    download_rebalance_csv(plan_portfolio(args.input), args.suffix)
+    print("Saved rebalance portfolio to CSV file.")
+
+
+def cmd_execute(args: argparse.Namespace) -> None:
+    import main
+    accounts: Optional[List[str]] = None
+    if args.accounts:
+        accounts = [] if args.accounts.upper() == "ALL" else [a.strip() for a in args.accounts.split(",") if a.strip()]
+    main.main(concurrent=not args.sequential, accounts=accounts)
+
+
+def cmd_diff(args: argparse.Namespace) -> None:
+    from snapshot_store import create_default_store
+    store = create_default_store()
+    if store is None:
+        sys.exit("Set SNAPSHOT_DIR to the snapshot store directory.")
+    runs = store.runs()
+    if len(args.runs) == 2:
+        old_run, new_run = args.runs
+    elif args.runs:
+        sys.exit("Give two run numbers, or none to compare the last two runs.")
+    elif len(runs) >= 2:
+        old_run, new_run = runs[-2:]
+    else:
+        sys.exit(f"Need two recorded runs to compare, found {len(runs)}.")
+    print(store.diff(old_run, new_run).report())
+
+
+def cmd_backtest(args: argparse.Namespace) -> None:
+    import backtest
+    from snapshot_store import create_default_store
+    store = create_default_store()
+    if store is None or not store.runs():
+        sys.exit("Set SNAPSHOT_DIR to a snapshot store with recorded runs to replay.")
+    rating_days, rating_symbols, ratings = backtest.rating_history(store)
+    prices = backtest.PriceMatrix.download(rating_symbols, args.start or str(rating_days[0]), args.end)
+    results = backtest.sweep(prices, backtest.align_ratings(prices, rating_days, rating_symbols, ratings),
+                             cost_bps=args.cost_bps, workers=args.workers)
+    print(f"{'scheme':<10} {'cutoff':>6} {'every':>5} {'CAGR':>8} {'vol':>7} {'Sharpe':>7} {'max DD':>8} "
+          f"{'turnover':>9} {'trades':>7}")
+    for result in sorted(results, key=lambda result: -result["sharpe"]):
+        print(f"{result['scheme']:<10} {result['cutoff']:>6} {result['frequency']:>5} {result['cagr']:>8.2%} "
+              f"{result['volatility']:>7.2%} {result['sharpe']:>7.2f} {result['max_drawdown']:>8.2%} "
+              f"{result['turnover']:>8.1f}x {result['trades']:>7}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Chaikin watchlist rebalancing for Interactive Brokers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    watchlist = commands.add_parser("watchlist", help="Fetch or parse the Chaikin watchlist and print it as JSON")
+    watchlist.add_argument("--input", help="Saved suggestions response or watchlist JSON instead of fetching")
+    watchlist.add_argument("--output", help="Write the watchlist to this file instead of stdout")
+    watchlist.set_defaults(func=cmd_watchlist)
+
+    plan = commands.add_parser("plan", help="Print the target allocation for the watchlist")
+    plan.add_argument("--input", help="Saved suggestions response or watchlist JSON instead of fetching")
+    plan.set_defaults(func=cmd_plan)
+
+    export_csv = commands.add_parser("export-csv", help="Write the target allocation as a TWS basket CSV")
+    export_csv.add_argument("--input", help="Saved suggestions response or watchlist JSON instead of fetching")
+    export_csv.add_argument("--suffix", default="rebal", help="File name suffix after the date")
+    export_csv.set_defaults(func=cmd_export_csv)
+
+    execute = commands.add_parser("execute", help="Rebalance the TWS account(s) and place the orders")
+    execute.add_argument("--sequential", action="store_true",
+                         help="Fetch the watchlist and the positions one after the other")
+    execute.add_argument("--accounts", help="Comma-separated accounts to rebalance separately, or ALL. "
+                                            "Defaults to the TWS_ACCOUNTS environment variable")
+    execute.set_defaults(func=cmd_execute)
+
+    diff = commands.add_parser("diff", help="Show what changed between two recorded runs in SNAPSHOT_DIR")
+    diff.add_argument("runs", type=int, nargs="*", metavar="RUN",
+                      help="The two run numbers to compare. Defaults to the last two runs")
+    diff.set_defaults(func=cmd_diff)
+
+    backtest = commands.add_parser("backtest", help="Replay the ratings recorded in SNAPSHOT_DIR over a grid of "
+                                                    "weight schemes, rating cutoffs and rebalance frequencies")
+    backtest.add_argument("--start", help="First day of prices. Defaults to the first recorded run")
+    backtest.add_argument("--end", required=True, help="Day after the last day of prices")
+    backtest.add_argument("--cost-bps", type=float, default=0.0, help="Trading cost in basis points")
+    backtest.add_argument("--workers", type=int, help="Worker processes. Defaults to the number of CPUs")
+    backtest.set_defaults(func=cmd_backtest)
+    return parser
+
+
+def run(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
@@ -0,0 +1,335 @@
+import contextlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+import telemetry
+from basket_export import create_default_exporter
+from logs import get_logger
+from orders import create_stock_contract
+from portfolio import Portfolio
+from rebalance import rebalance_portfolio
+from rebalance_steps import configured_accounts, download_positions, execute_rebalance, fetch_watchlist
+from snapshot_store import DRIFT_THRESHOLD, create_default_store
+from tws_api import MAX_SNAPSHOTS_IN_FLIGHT, IBApp, IBPriceProvider, TWSConnection
+
+RATINGS_INTERVAL = 15 * 60  # seconds between Chaikin rating checks
+REBALANCE_COOLDOWN = 5 * 60  # minimum seconds between two rebalances
+MAX_REBALANCE_BACKOFF = 4 * 60 * 60  # cap on the cooldown after rebalances that did not reduce the drift
+RESTART_DELAY = 30  # seconds before restarting after a failure, doubled while failures repeat
+MAX_PRICE_STREAMS = 50  # streaming market data lines, leaving the rest of IB's default 100 to snapshots
+POLL_INTERVAL = 60  # seconds between snapshot prices for the held symbols beyond MAX_PRICE_STREAMS
+
+logger = get_logger(__name__)
+
+
+class DriftMonitor:
+    """
+    Tracks live allocations from streaming TWS data and signals when a rebalance is needed.
+
+    Quantities come from a reqAccountUpdates subscription and prices from streaming
+    market data. IB limits how many market data lines may be open, so only the
+    largest positions are streamed and the rest are priced by `poll`. Each update adjusts one symbol in a Portfolio book, which keeps
+    market values and the running total current in constant time, and checks that
+    symbol's drift against its target. A full scan of all symbols only runs when
+    the total has moved enough to shift every allocation by the threshold. A
+    change in Chaikin ratings also triggers a rebalance.
+    """
+
+    def __init__(self, app: IBApp, watchlist: Dict[str, Dict[str, Any]], threshold: float = DRIFT_THRESHOLD,
+                 account: str = "", max_streams: int = MAX_PRICE_STREAMS):
+        """
+        Args:
+            app (IBApp): A connected IBApp instance with its positions downloaded
+            watchlist (dict): The filtered watchlist the portfolio is rebalanced towards
+            threshold (float): Allocation drift, in percentage points, that triggers a rebalance
+            account (str, optional): The account to subscribe to. May only be left out when the
+                                     login manages a single account
+            max_streams (int): The most held symbols to stream prices for
+        """
+        self.app = app
+        self.threshold = threshold
+        self.account = account
+        self.max_streams = max_streams
+        self.watchlist = watchlist
+        self.targets: Dict[str, float] = rebalance_portfolio(watchlist)
+        self.book: Portfolio = Portfolio()
+        self._checked_total: float = 0.0
+        self._streams: Dict[str, int] = {}  # symbol: market data reqId
+        self.polled_symbols: List[str] = []  # Held symbols priced by `poll` instead of a stream
+        self._lock = threading.Lock()
+        self.rebalance_needed: threading.Event = threading.Event()
+        self.reason: str = ""
+
+    def load(self, positions_map: Mapping[str, tuple]) -> None:
+        """
+        Resets the live book from a freshly downloaded positions map.
+
+        Args:
+            positions_map (Mapping): symbol: (quantity, price, market_value, allocation%)
+        """
+        with self._lock:
+            self.book = Portfolio.from_positions(
+                (symbol, quantity, price) for symbol, (quantity, price, _value, _allocation) in positions_map.items())
+            self._checked_total = self.book.total_market_value
+            self.rebalance_needed.clear()
+            self.reason = ""
+        self._update_streams()
+
+    def start(self) -> None:
+        """
+        Loads the app's current positions and subscribes to portfolio and price updates.
+
+        Raises:
+            ValueError: If no account was given and the login manages several, since
+                        account updates can only be subscribed for one account
+        """
+        if not self.account and len(self.app.managed_accounts) > 1:
+            raise ValueError(f"An account is needed to monitor one of {', '.join(self.app.managed_accounts)}")
+        self.app.portfolio_callback = self.on_portfolio
+        self.load(self.app.account_positions.get(self.account, self.app.positions_map))
+        self.app.reqAccountUpdates(True, self.account)
+
+    def stop(self) -> None:
+        """
+        Cancels all subscriptions.
+        """
+        self.app.portfolio_callback = None
+        self.app.reqAccountUpdates(False, self.account)
+        for req_id in self._streams.values():
+            self.app.unsubscribe_market_data(req_id)
+        self._streams = {}
+        self.polled_symbols = []
+
+    def _update_streams(self) -> None:
+        """
+        Streams prices for the `max_streams` largest held positions, and stops streams
+        no longer needed. The other held symbols are left to `poll`.
+        """
+        held = sorted(((abs(value), symbol) for symbol, quantity, value in
+                       zip(self.book.symbols, self.book.quantities.tolist(), self.book.market_values.tolist())
+                       if quantity), reverse=True)
+        wanted = {symbol for _value, symbol in held[:self.max_streams]}
+        self.polled_symbols = [symbol for _value, symbol in held[self.max_streams:]]
+        if self.polled_symbols:
+            logger.warning("%s held symbols exceed the limit of %s price streams, polling the %s smallest "
+                           "positions with snapshots", len(held), self.max_streams, len(self.polled_symbols))
+        for symbol in list(self._streams):
+            if symbol not in wanted:
+                self.app.unsubscribe_market_data(self._streams.pop(symbol))
+        for symbol in wanted - set(self._streams):
+            self.app.limiter.acquire()
+            self._streams[symbol] = self.app.subscribe_market_data(create_stock_contract(symbol), self.on_price)
+
+    def poll(self) -> None:
+        """
+        Prices the held symbols without a stream with one round of snapshots.
+        """
+        if not self.polled_symbols:
+            return
+        provider = IBPriceProvider(self.app, max_in_flight=max(1, MAX_SNAPSHOTS_IN_FLIGHT - len(self._streams)))
+        prices = provider.get_prices(self.polled_symbols)
+        with self._lock:
+            for symbol, price in prices.items():
+                self._set(symbol, None, price)
+
+    def _set(self, symbol: str, quantity: Optional[int], price: Optional[float]) -> None:
+        """
+        Updates one symbol's position in the book, then checks drift. Must hold the lock.
+        """
+        self.book.update(symbol, quantity, price)
+        total = self.book.total_market_value
+        if total <= 0:
+            return
+
+        quantity, _price, _value, allocation = self.book[symbol]
+        drift = abs(allocation - self.targets.get(symbol, 0.0))
+        if drift > self.threshold and (quantity or symbol in self.targets):
+            self._trigger(f"{symbol} drifted {drift:.2f} points from its target")
+        elif self._checked_total and abs(total / self._checked_total - 1) * 100 > self.threshold:
+            # Every allocation has been rescaled by the total's move; check them all
+            self._checked_total = total
+            self._check_all()
+
+    def drift(self) -> float:
+        """
+        Returns:
+            float: The largest allocation drift from target, in percentage points
+        """
+        with self._lock:
+            allocations = dict(zip(self.book.symbols, self.book.allocations().tolist()))
+            return max((abs(allocations.get(symbol, 0.0) - self.targets.get(symbol, 0.0))
+                        for symbol in set(allocations) | set(self.targets)), default=0.0)
+
+    def _check_all(self) -> None:
+        allocations = dict(zip(self.book.symbols, self.book.allocations().tolist()))
+        for symbol in set(allocations) | set(self.targets):
+            drift = abs(allocations.get(symbol, 0.0) - self.targets.get(symbol, 0.0))
+            if drift > self.threshold and (symbol in self.targets or self.book[symbol][0]):
+                self._trigger(f"{symbol} drifted {drift:.2f} points from its target")
+                return
+
+    def _trigger(self, reason: str) -> None:
+        if not self.rebalance_needed.is_set():
+            self.reason = reason
+            self.rebalance_needed.set()
+
+    def on_price(self, symbol: str, price: float) -> None:
+        """
+        Price stream callback.
+
+        Args:
+            symbol (str): The stock symbol
+            price (float): The latest price
+        """
+        with self._lock:
+            self._set(symbol, None, price)
+
+    def on_portfolio(self, _account: str, symbol: str, quantity: int, price: float) -> None:
+        """
+        Account updates callback for a changed position.
+
+        Args:
+            _account (str): The account name
+            symbol (str): The stock symbol
+            quantity (int): The position size
+            price (float): The current price
+        """
+        with self._lock:
+            self._set(symbol, quantity, price if price > 0 else None)
+
+    def update_watchlist(self, watchlist: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Replaces the watchlist and triggers a rebalance if the ratings changed.
+
+        Args:
+            watchlist (dict): The freshly fetched, filtered watchlist
+
+        Returns:
+            bool: True if the ratings changed
+        """
+        old_ratings = {symbol: details["rating_id"] for symbol, details in self.watchlist.items()}
+        new_ratings = {symbol: details["rating_id"] for symbol, details in watchlist.items()}
+        if old_ratings == new_ratings:
+            return False
+        with self._lock:
+            self.watchlist = watchlist
+            self.targets = rebalance_portfolio(watchlist)
+            self._trigger("Chaikin ratings changed")
+        self._update_streams()
+        return True
+
+
+def monitored_account(app: IBApp) -> str:
+    """
+    Picks the account to monitor: the one set in the TWS_ACCOUNTS environment
+    variable, or the login's only managed account.
+
+    Args:
+        app (IBApp): A connected IBApp instance
+
+    Returns:
+        str: The account
+
+    Raises:
+        ValueError: If TWS_ACCOUNTS names several accounts or ALL, or is unset while
+                    the login manages several accounts
+    """
+    accounts = configured_accounts()
+    if accounts is None or accounts == []:
+        accounts = app.managed_accounts
+    if len(accounts) != 1:
+        raise ValueError(f"The drift monitor follows one account; set TWS_ACCOUNTS to one of "
+                         f"{', '.join(app.managed_accounts) or 'the managed accounts'}")
+    return accounts[0]
+
+
+def run_daemon(connection: Optional[TWSConnection] = None, threshold: float = DRIFT_THRESHOLD,
+               ratings_interval: float = RATINGS_INTERVAL, cooldown: float = REBALANCE_COOLDOWN,
+               account: Optional[str] = None, poll_interval: float = POLL_INTERVAL) -> None:
+    """
+    Keeps one TWS session open, monitors drift and rebalances only when needed.
+
+    A rebalance that did not reduce the drift, e.g. because its orders were rejected
+    or are still working, doubles the cooldown before the next one, up to
+    MAX_REBALANCE_BACKOFF. The cooldown is reset once a rebalance reduced the drift.
+
+    An error, e.g. a lost TWS session or a failed rebalance, is logged and the monitor
+    is restarted after RESTART_DELAY, doubled while the restarts keep failing up to
+    MAX_REBALANCE_BACKOFF. The restart reconnects if the session was lost and reloads
+    the positions.
+
+    Args:
+        connection (TWSConnection, optional): The connection to use. Defaults to a new TWSConnection
+        threshold (float): Allocation drift, in percentage points, that triggers a rebalance
+        ratings_interval (float): Seconds between Chaikin rating checks
+        cooldown (float): Minimum seconds between two rebalances
+        account (str, optional): The account to monitor and rebalance. Defaults to
+                                 `monitored_account`
+        poll_interval (float): Seconds between snapshot prices for the held symbols that
+                                 are not streamed
+    """
+    connection = connection or TWSConnection()
+    store = create_default_store()
+    exporter = create_default_exporter()
+    with connection as app:
+        account = account or monitored_account(app)
+        monitor = DriftMonitor(app, fetch_watchlist(), threshold, account)
+        running = False
+        next_ratings_check = time.monotonic() + ratings_interval
+        next_poll = time.monotonic() + poll_interval
+        last_rebalance = 0.0
+        backoff = cooldown
+        restart_delay = RESTART_DELAY
+        try:
+            while True:
+                try:
+                    if not running:
+                        # Picks up a new session if the previous one was lost
+                        app = monitor.app = connection.ensure_connected()
+                        download_positions(app, [account])
+                        monitor.start()
+                        running = True
+                    wake_at = min(next_ratings_check, next_poll) if monitor.polled_symbols else next_ratings_check
+                    if monitor.rebalance_needed.wait(timeout=max(0.0, wake_at - time.monotonic())):
+                        wait = last_rebalance + backoff - time.monotonic()
+                        if wait > 0:
+                            time.sleep(wait)
+                        drift = monitor.drift()
+                        logger.info("Rebalancing %s: %s", account, monitor.reason)
+                        execute_rebalance(app, monitor.watchlist, [account], store=store, exporter=exporter)
+                        last_rebalance = time.monotonic()
+                        download_positions(app, [account])
+                        monitor.load(app.account_positions[account])
+                        if monitor.drift() < drift:
+                            backoff = cooldown
+                        else:
+                            backoff = min(2 * backoff or REBALANCE_COOLDOWN, MAX_REBALANCE_BACKOFF)
+                            logger.warning("Rebalance left the drift at %.2f points (was %.2f), next one in %.0fs "
+                                           "at the earliest", monitor.drift(), drift, backoff)
+                        telemetry.flush()
+                    if time.monotonic() >= next_ratings_check:
+                        monitor.update_watchlist(fetch_watchlist())
+                        next_ratings_check = time.monotonic() + ratings_interval
+                    if monitor.polled_symbols and time.monotonic() >= next_poll:
+                        monitor.poll()
+                        next_poll = time.monotonic() + poll_interval
+                    restart_delay = RESTART_DELAY
+                except Exception as e:
+                    logger.error("Drift monitor failed, restarting in %.0fs: %s", restart_delay, e)
+                    if running:
+                        # The session may already be gone, taking the subscriptions with it
+                        with contextlib.suppress(Exception):
+                            monitor.stop()
+                        running = False
+                    telemetry.flush()
+                    time.sleep(restart_delay)
+                    restart_delay = min(2 * restart_delay, MAX_REBALANCE_BACKOFF)
+        finally:
+            if running:
+                monitor.stop()
+
+
+if __name__ == "__main__":
+    run_daemon(threshold=float(os.environ.get("DRIFT_THRESHOLD", DRIFT_THRESHOLD)))
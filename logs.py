@@ -0,0 +1,203 @@
+import atexit
+import collections
+import logging
+import os
+import sys
+import threading
+from typing import Any, Callable, Deque, Optional, TextIO
+
+LOGGER_NAME = "ib_trade_helper"
+DEFAULT_LEVEL = "INFO"
+DEFAULT_FORMAT = "%(message)s"
+DEFAULT_BATCH_SIZE = 256  # records per write
+DEFAULT_FLUSH_INTERVAL = 0.05  # seconds a record may wait in the queue
+DEFAULT_MAX_QUEUE = 100_000  # records buffered before new ones are dropped
+SHUTDOWN_TIMEOUT = 5  # seconds
+
+
+class QueueLogHandler(logging.Handler):
+    """
+    Logging handler that only appends records to an in-memory queue; a background
+    thread formats them and writes them to the sink in batches.
+
+    Emitting a record costs an append to a deque, whatever the sink is, so it is
+    safe to log from the ibapi reader thread. Formatting and I/O happen on the
+    writer thread. When the queue is full new records are dropped and counted
+    instead of blocking the caller, and the writer reports how many were lost.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_queue: int = DEFAULT_MAX_QUEUE):
+        """
+        Args:
+            stream (file, optional): The sink. Defaults to whatever sys.stdout is at write time
+            batch_size (int): Maximum number of records formatted and written at once
+            flush_interval (float): Seconds the writer sleeps between polls of a quiet queue
+            max_queue (int): Maximum number of queued records
+        """
+        super().__init__()
+        self.stream = stream
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped: int = 0
+        self._records: Deque[logging.LogRecord] = collections.deque()
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # deque.append is atomic, so the handler lock taken by Handler.handle is not needed
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if len(self._records) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._records.append(record)
+        if len(self._records) == self.batch_size:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes every queued record to the sink.
+        """
+        with self._write_lock:
+            while self._records or self.dropped:
+                lines = []
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    lines.append(f"[logs] {dropped} log records dropped, queue full")
+                while self._records and len(lines) < self.batch_size:
+                    record = self._records.popleft()
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:
+                        self.handleError(record)
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except (OSError, ValueError):
+                    # The sink went away (closed pipe, closed file); there is nowhere left to report it
+                    self._records.clear()
+                    return
+
+    def close(self) -> None:
+        """
+        Stops the writer thread after writing the queued records.
+        """
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=SHUTDOWN_TIMEOUT)
+        self.flush()
+        super().close()
+
+
+class Lazy:
+    """
+    Log argument that is only rendered by the writer thread, for messages that are
+    expensive to build, e.g. one line per position of a large book:
+
+        logger.info("%s", Lazy(format_positions, portfolio))
+
+    The arguments must not be mutated after logging.
+    """
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn: Callable[..., str], *args: Any):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self) -> str:
+        return self.fn(*self.args)
+
+
+_handler: Optional[QueueLogHandler] = None
+_configure_lock = threading.Lock()
+
+
+def configure(level: Optional[str] = None, stream: Optional[TextIO] = None, batch_size: Optional[int] = None,
+              flush_interval: Optional[float] = None, max_queue: Optional[int] = None,
+              fmt: Optional[str] = None) -> logging.Logger:
+    """
+    (Re)configures the project logger. Arguments left as None come from the LOG_LEVEL,
+    LOG_FILE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_QUEUE_SIZE and LOG_FORMAT
+    environment variables, or the module defaults.
+
+    Args:
+        level (str, optional): Minimum level to log, e.g. "INFO" or "WARNING"
+        stream (file, optional): The sink. Defaults to LOG_FILE (appended to) or stdout
+        batch_size (int, optional): Maximum number of records written at once
+        flush_interval (float, optional): Maximum seconds a record waits before it is written
+        max_queue (int, optional): Maximum number of queued records before new ones are dropped
+        fmt (str, optional): A logging format string
+
+    Returns:
+        logging.Logger: The project logger
+    """
+    global _handler
+    with _configure_lock:
+        if stream is None and os.environ.get("LOG_FILE"):
+            stream = open(os.environ["LOG_FILE"], "a")
+        handler = QueueLogHandler(
+            stream=stream,
+            batch_size=batch_size or int(os.environ.get("LOG_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+            flush_interval=flush_interval or float(os.environ.get("LOG_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+            max_queue=max_queue or int(os.environ.get("LOG_QUEUE_SIZE", DEFAULT_MAX_QUEUE)),
+        )
+        handler.setFormatter(logging.Formatter(fmt or os.environ.get("LOG_FORMAT", DEFAULT_FORMAT)))
+
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.setLevel((level or os.environ.get("LOG_LEVEL", DEFAULT_LEVEL)).upper())
+        logger.propagate = False
+        if _handler is not None:
+            logger.removeHandler(_handler)
+            _handler.close()
+        logger.addHandler(handler)
+        _handler = handler
+        return logger
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns a child of the project logger, configuring the queue handler on first use.
+
+    Args:
+        name (str): The module name
+
+    Returns:
+        logging.Logger: The logger
+    """
+    if _handler is None:
+        configure()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def flush() -> None:
+    """
+    Writes every queued record now, e.g. before printing to the same stream directly.
+    """
+    if _handler is not None:
+        _handler.flush()
+
+
+def shutdown() -> None:
+    if _handler is not None:
+        _handler.close()
+
+
+atexit.register(shutdown)
@@ -1,94 +1,87 @@
-import threading
-from typing import Dict, Any
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-from chaikin import get_watchlist
-from orders import create_stock_contract, create_market_order
-from rebalance import rebalance_portfolio
-from tws_api import create_and_connect_app, disconnect_app
+import telemetry
+from basket_export import BasketExporter, create_default_exporter
+from logs import get_logger
+from pricing import deadline
+from rebalance_steps import (PRICING_DEADLINE, configured_accounts, download_positions, execute_rebalance,
+                             fetch_watchlist, skip_max_age, skip_unchanged)
+from snapshot_store import SnapshotStore, create_default_store
+from tws_api import TWSConnection
 
+logger = get_logger(__name__)
 
-def main() -> None:
+
+def main(concurrent: bool = True, connection: Optional[TWSConnection] = None,
+         accounts: Optional[List[str]] = None, store: Optional[SnapshotStore] = None,
+         exporter: Optional[BasketExporter] = None) -> None:
     """
     Main function that orchestrates the portfolio rebalancing process.
 
     This function:
-    1. Connects to Interactive Brokers TWS
-    2. Retrieves the watchlist from Chaikin Analytics
-    3. Gets current positions from IB
-    4. Calculates and executes rebalancing orders
-    5. Waits for order completion
-    6. Disconnects from TWS
-
-    The function uses threading events to coordinate asynchronous operations
-    and ensures proper cleanup in case of errors.
+    1. Retrieves the watchlist from Chaikin Analytics and prefetches its prices
+    2. Connects to Interactive Brokers TWS and gets current positions
+    3. Calculates and executes rebalancing orders
+    4. Waits for order completion
+    5. Disconnects from TWS
+
+    Steps 1 and 2 are independent, so by default they run at the same time and are
+    only joined at the rebalance step. All price lookups of the run share the
+    PRICING_DEADLINE budget (seconds, from the environment variable of the same name);
+    desired symbols still unpriced when it runs out are not traded, and an unpriced
+    held position stops the run before any order is placed.
+
+    Args:
+        concurrent (bool): Whether to run the watchlist and TWS stages concurrently.
+                           When False they run one after the other.
+        connection (TWSConnection, optional): A persistent connection to reuse. It is
+                           reconnected if needed and left open when the run ends, so a
+                           long-lived process can hand it to repeated runs.
+        accounts (list, optional): Accounts to rebalance separately from one watchlist
+                           fetch. Defaults to the TWS_ACCOUNTS environment variable, see
+                           `configured_accounts`.
+        store (SnapshotStore, optional): Snapshot store every run is recorded in. Defaults to
+                           the SNAPSHOT_DIR environment variable, see `create_default_store`.
+                           With a store, a single-book run whose ratings are unchanged and
+                           whose drift is under threshold stops before pricing the positions,
+                           as long as the latest priced run is at most SKIP_MAX_AGE seconds old.
+        exporter (BasketExporter, optional): Exports the target holdings of every run. Defaults
+                           to the BASKET_DIR environment variable, see `create_default_exporter`.
     """
-    # Create events to signal completion
-    positions_received = threading.Event()
-    orders_placed = threading.Event()
-
-    # Create and connect to IB TWS
-    app = create_and_connect_app()
-
-    def on_positions_received(_positions_map: Dict[str, Any]) -> None:
-        """
-        Callback function executed when all positions are received from TWS.
-
-        Args:
-            _positions_map : The positions map (unused in this callback)
-
-        This function:
-        1. Calculates the desired portfolio allocation
-        2. Creates rebalancing orders
-        3. Executes the orders through TWS
-        4. Sets the orders_placed event when complete
-        """
-        try:
-            # Calculate rebalance
-            desired_portfolio = rebalance_portfolio(watchlist)
-
-            # Create rebalance orders
-            orders = app.create_rebalance_orders(desired_portfolio)
-
-            # Print results
-            print("Rebalance Orders:", orders)
-
-            app.set_order_count(len(orders))
-
-            # Execute orders
-            for symbol, action, shares in orders:
-                print(f"Executing Order: {action} {shares} shares of {symbol}")
-                contract = create_stock_contract(symbol)
-                order = create_market_order(action, shares)
-                app.placeOrder(app.nextId(), contract, order)
-            orders_placed.set()
-
-        except Exception as e1:
-            print(f"Error in callback: {e1}")
-        finally:
-            positions_received.set()
-
+    if accounts is None:
+        accounts = configured_accounts()
+    if store is None:
+        store = create_default_store()
+    if exporter is None:
+        exporter = create_default_exporter()
+    short_circuit = store is not None and accounts is None and store.latest_priced(skip_max_age()) is not None
+    persistent = connection is not None
+    if connection is None:
+        connection = TWSConnection()
     try:
-        # Get the watchlist from Chaikin Analytics
-        watchlist: Dict[str, Dict[str, Any]] = get_watchlist()
-
-        # Filter watchlist
-        watchlist = {sym: details for sym, details in watchlist.items() if details['rating_id'] >= 5 and sym not in ['U', 'GSK']}
-
-        # Get current positions with callback
-        app.get_my_positions(callback=on_positions_received)
-
-        # Wait for callback to complete (timeout after 30 seconds)
-        positions_received.wait(timeout=30)
-
-        if positions_received.wait(timeout=30) and orders_placed.wait(timeout=30):
-            app.orders_completed.wait(timeout=60)  # Wait for orders to complete
+        with telemetry.span("rebalance_run", concurrent=concurrent), \
+                deadline(float(os.environ.get("PRICING_DEADLINE", PRICING_DEADLINE))):
+            with ThreadPoolExecutor(max_workers=2 if concurrent else 1) as executor:
+                watchlist_future = executor.submit(fetch_watchlist, False if short_circuit else None)
+                positions_future = executor.submit(
+                    connection.run_job, lambda app: download_positions(app, accounts, price=not short_circuit))
+                app = positions_future.result()
+                watchlist = watchlist_future.result()
+
+            if short_circuit and skip_unchanged(app, watchlist, store):
+                return
+            execute_rebalance(app, watchlist, accounts, store, exporter)
 
     except Exception as e:
-        print(f"Error occurred: {e}")
+        logger.error("Error occurred: %s", e)
 
     finally:
         # Cleanup
-        disconnect_app(app)
+        if not persistent:
+            connection.disconnect()
+        telemetry.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ibapi.contract import Contract
+
+from logs import get_logger
+from orders import create_stock_contract, create_market_order
+from rate_limit import TokenBucket
+
+# Lower values are submitted first, so sells free up cash before the buys go out
+ACTION_PRIORITY = {"SELL": 0, "BUY": 1}
+
+logger = get_logger(__name__)
+
+
+class OrderScheduler:
+    """
+    Submits rebalance orders to TWS as fast as IB pacing rules allow.
+
+    Orders are queued with sells ahead of buys, and each placeOrder call takes a
+    token from the app's pacing limiter so that large baskets never trigger pacing
+    violations. Contracts are built once per symbol and reused.
+    """
+
+    def __init__(self, app, limiter: Optional[TokenBucket] = None):
+        """
+        Args:
+            app (IBApp): A connected IBApp instance
+            limiter (TokenBucket, optional): Pacing limiter. Defaults to the app's shared limiter
+        """
+        self.app = app
+        self.limiter = limiter if limiter is not None else app.limiter
+        self._contracts: Dict[str, Contract] = {}
+        self._queue: List[Tuple[int, int, str, str, int, str]] = []  # (priority, sequence, symbol, action, shares, account)
+        self._sequence = itertools.count()
+        self.submitted: int = 0
+        self.elapsed: float = 0.0
+
+    def contract_for(self, symbol: str) -> Contract:
+        """
+        Returns the cached stock contract for a symbol, creating it on first use.
+
+        Args:
+            symbol (str): The stock symbol
+
+        Returns:
+            Contract: The IB contract for the symbol
+        """
+        contract = self._contracts.get(symbol)
+        if contract is None:
+            contract = self._contracts[symbol] = create_stock_contract(symbol)
+        return contract
+
+    def add(self, symbol: str, action: str, shares: int, account: str = "") -> None:
+        """
+        Queues an order for submission.
+
+        Args:
+            symbol (str): The stock symbol
+            action (str): The order action ("BUY" or "SELL")
+            shares (int): The number of shares
+            account (str, optional): The account to route the order to
+        """
+        heapq.heappush(self._queue, (ACTION_PRIORITY.get(action, len(ACTION_PRIORITY)), next(self._sequence),
+                                     symbol, action, shares, account))
+
+    def add_all(self, orders: List[Tuple[str, str, int]], account: str = "") -> None:
+        """
+        Queues several orders for submission.
+
+        Args:
+            orders (list): A list of (symbol, action, shares) tuples
+            account (str, optional): The account to route the orders to
+        """
+        for symbol, action, shares in orders:
+            self.add(symbol, action, shares, account)
+
+    def submit(self) -> List[Tuple[int, str, str, int]]:
+        """
+        Submits all queued orders, sells first, paced by the limiter.
+
+        Returns:
+            list: The submitted orders as (order_id, symbol, action, shares) tuples, in submission order
+        """
+        submitted = []
+        start_time = time.monotonic()
+        while self._queue:
+            _priority, _sequence, symbol, action, shares, account = heapq.heappop(self._queue)
+            self.limiter.acquire()
+            order_id = self.app.nextId()
+            logger.info("Executing Order: %s %s shares of %s%s", action, shares, symbol, f" in {account}" if account else "")
+            self.app.order_tracker.submitted(order_id, symbol, action, shares, account)
+            self.app.placeOrder(order_id, self.contract_for(symbol), create_market_order(action, shares, account))
+            submitted.append((order_id, symbol, action, shares))
+        self.elapsed += time.monotonic() - start_time
+        self.submitted += len(submitted)
+        return submitted
+
+    def throughput(self) -> float:
+        """
+        Returns:
+            float: The submission rate in orders per second over all `submit` calls
+        """
+        return self.submitted / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self) -> None:
+        """
+        Logs the number of submitted orders and the submission throughput.
+        """
+        logger.info("Submitted %s orders in %.2fs (%.1f orders/s)", self.submitted, self.elapsed, self.throughput())
@@ -0,0 +1,278 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import telemetry
+from logs import get_logger
+
+TERMINAL_STATUSES = {"Filled", "Cancelled", "ApiCancelled", "Inactive"}
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+LATENCY_METRICS = ("submit_to_ack", "ack_to_fill", "submit_to_fill")
+
+logger = get_logger(__name__)
+
+
+class OrderRecord:
+    """
+    The lifecycle of a single order: its details and every distinct status
+    transition with the monotonic time it was seen.
+    """
+
+    __slots__ = ("order_id", "symbol", "action", "shares", "account", "submitted_at", "acked_at", "finished_at",
+                 "status", "filled", "transitions")
+
+    def __init__(self, order_id: int, symbol: str = "", action: str = "", shares: int = 0,
+                 submitted_at: Optional[float] = None, account: str = ""):
+        self.order_id = order_id
+        self.symbol = symbol
+        self.action = action
+        self.shares = shares
+        self.account = account
+        self.submitted_at = submitted_at
+        self.acked_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.status: Optional[str] = None
+        self.filled: float = 0.0
+        self.transitions: List[Tuple[str, float, float]] = []  # (status, filled, monotonic time)
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def latencies(self) -> Dict[str, Optional[float]]:
+        """
+        Returns:
+            dict: The submit→ack, ack→fill and submit→fill latencies in seconds, None where unknown
+        """
+        filled_at = self.finished_at if self.status == "Filled" else None
+        return {
+            "submit_to_ack": _elapsed(self.submitted_at, self.acked_at),
+            "ack_to_fill": _elapsed(self.acked_at, filled_at),
+            "submit_to_fill": _elapsed(self.submitted_at, filled_at),
+        }
+
+
+def _elapsed(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+def _record_order_telemetry(record: OrderRecord) -> None:
+    """
+    Exports a finished order's lifecycle: its terminal status, latencies and transitions.
+    """
+    latencies = record.latencies()
+    telemetry.count("orders_finished_total", status=record.status)
+    for metric, value in latencies.items():
+        if value is not None:
+            telemetry.observe("order_latency_seconds", value, metric=metric)
+    telemetry.event("order", order_id=record.order_id, symbol=record.symbol, action=record.action,
+                    shares=record.shares, status=record.status, filled=record.filled,
+                    transitions=[status for status, _filled, _at in record.transitions], **latencies)
+
+
+class OrderTracker:
+    """
+    Thread-safe tracker of order lifecycles keyed by orderId.
+
+    TWS routinely repeats order status callbacks, so repeated statuses are ignored
+    and an order's terminal state is recorded only once. Callers can wait on
+    specific orders or on every tracked order.
+    """
+
+    def __init__(self):
+        self.orders: Dict[int, OrderRecord] = {}
+        self._condition = threading.Condition()
+
+    def submitted(self, order_id: int, symbol: str, action: str, shares: int, account: str = "") -> None:
+        """
+        Records that an order was sent to TWS.
+
+        Args:
+            order_id (int): The order ID
+            symbol (str): The stock symbol
+            action (str): The order action ("BUY" or "SELL")
+            shares (int): The number of shares
+            account (str, optional): The account the order was routed to
+        """
+        with self._condition:
+            self.orders[order_id] = OrderRecord(order_id, symbol, action, shares, time.monotonic(), account)
+        telemetry.count("orders_submitted_total", action=action)
+
+    def opened(self, order_id: int, symbol: str, action: str, shares: int, account: str = "") -> None:
+        """
+        Records an order TWS reports as open, e.g. one placed by an earlier run. The
+        details of an order already tracked are kept.
+
+        Args:
+            order_id (int): The order ID
+            symbol (str): The stock symbol
+            action (str): The order action ("BUY" or "SELL")
+            shares (int): The number of shares
+            account (str, optional): The account the order was routed to
+        """
+        with self._condition:
+            record = self.orders.get(order_id)
+            if record is None:
+                record = self.orders[order_id] = OrderRecord(order_id)
+            if not record.symbol:
+                record.symbol, record.action, record.shares, record.account = symbol, action, shares, account
+
+    def on_status(self, order_id: int, status: str, filled: float) -> bool:
+        """
+        Records an order status update.
+
+        Args:
+            order_id (int): The order ID
+            status (str): The order status
+            filled (float): The quantity filled so far
+
+        Returns:
+            bool: True if this was a new transition, False if it was a duplicate or arrived after a terminal state
+        """
+        now = time.monotonic()
+        with self._condition:
+            record = self.orders.get(order_id)
+            if record is None:
+                # Status for an order we did not submit in this session (e.g. placed by another client)
+                record = self.orders[order_id] = OrderRecord(order_id)
+            if record.done or (status == record.status and filled == record.filled):
+                return False
+
+            record.transitions.append((status, filled, now))
+            record.status = status
+            record.filled = filled
+            if record.acked_at is None:
+                record.acked_at = now
+            if status in TERMINAL_STATUSES:
+                record.finished_at = now
+                self._condition.notify_all()
+            else:
+                return True
+        if telemetry.enabled():
+            _record_order_telemetry(record)
+        return True
+
+    def wait_for(self, order_ids: Iterable[int], timeout: Optional[float] = None) -> bool:
+        """
+        Waits until all given orders have reached a terminal state.
+
+        Args:
+            order_ids (iterable): The order IDs to wait for
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if all orders finished, False on timeout
+        """
+        order_ids = list(order_ids)
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: all(order_id in self.orders and self.orders[order_id].done for order_id in order_ids),
+                timeout=timeout)
+
+    def wait_all(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every tracked order has reached a terminal state.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if all orders finished, False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: all(record.done for record in self.orders.values()),
+                                            timeout=timeout)
+
+    def pending(self) -> List[int]:
+        """
+        Returns:
+            list: The IDs of tracked orders that have not reached a terminal state
+        """
+        with self._condition:
+            return [order_id for order_id, record in self.orders.items() if not record.done]
+
+    def working(self, account: str = "") -> Dict[str, int]:
+        """
+        Args:
+            account (str): The account, "" for the orders of every account, as the merged
+                           single-book mode holds the positions of every account
+
+        Returns:
+            dict: Symbol mapped to the signed shares not yet filled by the account's orders
+                  that have not reached a terminal state, positive for buys
+        """
+        working: Dict[str, int] = {}
+        with self._condition:
+            for record in self.orders.values():
+                if record.symbol and (not account or record.account == account) and not record.done:
+                    remaining = max(0, record.shares - int(record.filled))
+                    working[record.symbol] = working.get(record.symbol, 0) + (
+                        remaining if record.action == "BUY" else -remaining)
+        return working
+
+    def latencies(self, order_id: int) -> Dict[str, Optional[float]]:
+        """
+        Args:
+            order_id (int): The order ID
+
+        Returns:
+            dict: The order's latencies as returned by `OrderRecord.latencies`
+        """
+        with self._condition:
+            return self.orders[order_id].latencies()
+
+    def histogram(self, metric: str) -> Dict[float, int]:
+        """
+        Builds a latency histogram over all tracked orders.
+
+        Args:
+            metric (str): One of LATENCY_METRICS
+
+        Returns:
+            dict: Bucket upper bounds in seconds mapped to the number of orders in that bucket
+        """
+        counts = {bound: 0 for bound in LATENCY_BUCKETS}
+        with self._condition:
+            values = [record.latencies()[metric] for record in self.orders.values()]
+        for value in values:
+            if value is None:
+                continue
+            for bound in LATENCY_BUCKETS:
+                if value <= bound:
+                    counts[bound] += 1
+                    break
+        return counts
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Aggregates the latencies of all tracked orders.
+
+        Returns:
+            dict: For each metric in LATENCY_METRICS, its count, mean, p50, p90 and max in seconds
+        """
+        with self._condition:
+            all_latencies = [record.latencies() for record in self.orders.values()]
+        summary = {}
+        for metric in LATENCY_METRICS:
+            values = sorted(latency[metric] for latency in all_latencies if latency[metric] is not None)
+            if not values:
+                continue
+            summary[metric] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[int(0.5 * (len(values) - 1))],
+                "p90": values[int(0.9 * (len(values) - 1))],
+                "max": values[-1],
+            }
+        return summary
+
+    def report(self) -> None:
+        """
+        Logs the aggregate order latencies.
+        """
+        for metric, stats in self.summary().items():
+            logger.info("%s: n=%s, mean=%.3fs, p50=%.3fs, p90=%.3fs, max=%.3fs", metric, stats["count"],
+                        stats["mean"], stats["p50"], stats["p90"], stats["max"])
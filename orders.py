@@ -20,13 +20,14 @@ def create_stock_contract(symbol: str) -> Contract:
     return contract
 
 
-def create_market_order(action: str, quantity: int) -> Order:
+def create_market_order(action: str, quantity: int, account: str = "") -> Order:
     """
     Creates an Interactive Brokers market order.
 
     Args:
         action (str): The order action ("BUY" or "SELL")
         quantity (int): The number of shares to buy or sell
+        account (str, optional): The account to route the order to. Leave empty for the default account
 
     Returns:
         Order: An IB order object configured as a market order
@@ -35,4 +36,5 @@ def create_market_order(action: str, quantity: int) -> Order:
     order.action = action  # "BUY" or "SELL"
     order.orderType = "MKT"
     order.totalQuantity = quantity
+    order.account = account
     return order
@@ -0,0 +1,160 @@
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+INITIAL_CAPACITY = 64
+
+
+class Portfolio(Mapping):
+    """
+    Array-backed position book.
+
+    Quantities, prices and market values live in contiguous NumPy arrays indexed
+    through a symbol -> index map. Updating a position or a price adjusts that
+    symbol's market value and the running total in constant time, and allocations
+    are only computed when they are read.
+
+    The class is a read-only Mapping of symbol -> (quantity, price, market_value,
+    allocation%) tuples, so it can be used wherever a positions map is expected.
+    The `quantities`, `prices` and `market_values` properties expose non-writeable
+    views of the arrays for vectorized consumers without copying.
+    """
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        """
+        Args:
+            capacity (int): Initial number of positions the arrays can hold before growing
+        """
+        self._index: Dict[str, int] = {}
+        self._symbols: List[str] = []
+        self._quantities = np.zeros(capacity, dtype=np.int64)
+        self._prices = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._total: float = 0.0
+
+    @classmethod
+    def from_positions(cls, positions: Iterable[Tuple[str, int, float]]) -> "Portfolio":
+        """
+        Builds a portfolio from (symbol, quantity, price) rows in one pass.
+
+        Args:
+            positions (iterable): (symbol, quantity, price) rows
+
+        Returns:
+            Portfolio: The populated portfolio
+        """
+        positions = list(positions)
+        portfolio = cls(max(INITIAL_CAPACITY, len(positions)))
+        for symbol, quantity, price in positions:
+            i = portfolio._slot(symbol)
+            portfolio._quantities[i] = quantity
+            portfolio._prices[i] = price
+            portfolio._values[i] = price * quantity
+        portfolio.recompute_total()
+        return portfolio
+
+    def _slot(self, symbol: str) -> int:
+        i = self._index.get(symbol)
+        if i is None:
+            i = len(self._symbols)
+            if i == len(self._quantities):
+                capacity = 2 * len(self._quantities)
+                self._quantities = np.resize(self._quantities, capacity)
+                self._prices = np.resize(self._prices, capacity)
+                self._values = np.resize(self._values, capacity)
+            self._quantities[i] = 0
+            self._prices[i] = 0.0
+            self._values[i] = 0.0
+            self._index[symbol] = i
+            self._symbols.append(symbol)
+        return i
+
+    def update(self, symbol: str, quantity: Optional[int] = None, price: Optional[float] = None) -> None:
+        """
+        Updates a position's quantity and/or price, adding the symbol if it is new.
+
+        Args:
+            symbol (str): The stock symbol
+            quantity (int, optional): The new position size. Unchanged if None
+            price (float, optional): The new price. Unchanged if None
+        """
+        i = self._slot(symbol)
+        if quantity is not None:
+            self._quantities[i] = quantity
+        if price is not None:
+            self._prices[i] = price
+        value = float(self._prices[i] * self._quantities[i])
+        self._total += value - float(self._values[i])
+        self._values[i] = value
+
+    def recompute_total(self) -> float:
+        """
+        Recomputes the total market value from scratch, discarding the rounding error
+        accumulated by incremental updates.
+
+        Returns:
+            float: The total market value
+        """
+        # Sequential sum in position order, so the result matches sum() over the positions
+        self._total = sum(self._values[:len(self._symbols)].tolist())
+        return self._total
+
+    @property
+    def total_market_value(self) -> float:
+        return self._total
+
+    @property
+    def symbols(self) -> List[str]:
+        return self._symbols
+
+    @property
+    def quantities(self) -> np.ndarray:
+        return self._read_only(self._quantities)
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self._read_only(self._prices)
+
+    @property
+    def market_values(self) -> np.ndarray:
+        return self._read_only(self._values)
+
+    def _read_only(self, array: np.ndarray) -> np.ndarray:
+        view = array[:len(self._symbols)]
+        view.flags.writeable = False
+        return view
+
+    def allocation(self, symbol: str) -> float:
+        """
+        Args:
+            symbol (str): The stock symbol
+
+        Returns:
+            float: The symbol's share of the total market value, in percent
+        """
+        if not self._total:
+            return 0.0
+        return float(self._values[self._index[symbol]]) / self._total * 100
+
+    def allocations(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The allocation percentage of every position, in position order
+        """
+        if not self._total:
+            return np.zeros(len(self._symbols))
+        return self._values[:len(self._symbols)] / self._total * 100
+
+    def __getitem__(self, symbol: str) -> Tuple[int, float, float, float]:
+        i = self._index[symbol]
+        return int(self._quantities[i]), float(self._prices[i]), float(self._values[i]), self.allocation(symbol)
+
+    def __contains__(self, symbol: object) -> bool:
+        return symbol in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._symbols)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
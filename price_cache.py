@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+DEFAULT_TTL = 300.0  # seconds
+DEFAULT_NEGATIVE_TTL = 600.0  # seconds a symbol that could not be priced is not asked for again
+DEFAULT_MAX_ENTRIES = 5000
+SQLITE_CHUNK_SIZE = 500
+
+
+class PriceCache:
+    """
+    Thread-safe TTL + LRU cache of symbol prices with optional SQLite persistence.
+
+    Entries live in an in-memory LRU map bounded by `max_entries`. When a `path` is
+    given, every stored price is also written to a SQLite file so that separate
+    processes running within the TTL window can reuse each other's quotes.
+
+    Symbols the provider could not price (delisted, unknown) are remembered in
+    memory for `negative_ttl` seconds, so that a run does not ask for them again.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES, path: Optional[str] = None,
+                 negative_ttl: float = DEFAULT_NEGATIVE_TTL):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl (float): Number of seconds a price stays valid
+            max_entries (int): Maximum number of prices kept in memory
+            path (str, optional): SQLite file used to share prices between processes
+            negative_ttl (float): Number of seconds a symbol stays marked as unpriceable
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # symbol: (price, fetched_at)
+        self._unpriced: Dict[str, float] = {}  # symbol: marked_at
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self._db.execute("CREATE TABLE IF NOT EXISTS prices (symbol TEXT PRIMARY KEY, price REAL, fetched_at REAL)")
+            self._db.commit()
+
+    def _is_fresh(self, fetched_at: float, now: float) -> bool:
+        return now - fetched_at < self.ttl
+
+    def _remember(self, symbol: str, price: float, fetched_at: float) -> None:
+        self._entries[symbol] = (price, fetched_at)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """
+        Look up fresh prices for the given symbols.
+
+        Args:
+            symbols (iterable): The stock symbols to look up
+
+        Returns:
+            dict: The symbols that had a fresh cached price, mapped to that price
+        """
+        now = time.time()
+        found: Dict[str, float] = {}
+        with self._lock:
+            requested = list(dict.fromkeys(symbols))
+            pending = []
+            for symbol in requested:
+                entry = self._entries.get(symbol)
+                if entry and self._is_fresh(entry[1], now):
+                    self._entries.move_to_end(symbol)
+                    found[symbol] = entry[0]
+                else:
+                    pending.append(symbol)
+
+            # SQLite limits the number of bound parameters, so look up missing symbols in chunks
+            for start in range(0, len(pending) if self._db is not None else 0, SQLITE_CHUNK_SIZE):
+                chunk = pending[start:start + SQLITE_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT symbol, price, fetched_at FROM prices WHERE symbol IN ({placeholders})", chunk).fetchall()
+                for symbol, price, fetched_at in rows:
+                    if self._is_fresh(fetched_at, now):
+                        self._remember(symbol, price, fetched_at)
+                        found[symbol] = price
+
+            self.hits += len(found)
+            self.misses += len(requested) - len(found)
+        return found
+
+    def get(self, symbol: str) -> Optional[float]:
+        """
+        Look up a fresh price for a single symbol.
+
+        Args:
+            symbol (str): The stock symbol to look up
+
+        Returns:
+            float: The cached price, or None if there is no fresh entry
+        """
+        return self.get_many([symbol]).get(symbol)
+
+    def set_many(self, prices: Dict[str, float]) -> None:
+        """
+        Store prices for several symbols.
+
+        Args:
+            prices (dict): Symbols mapped to their freshly fetched prices
+        """
+        now = time.time()
+        with self._lock:
+            for symbol, price in prices.items():
+                self._remember(symbol, price, now)
+                self._unpriced.pop(symbol, None)
+            if self._db is not None and prices:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO prices (symbol, price, fetched_at) VALUES (?, ?, ?)",
+                    [(symbol, float(price), now) for symbol, price in prices.items()])
+                self._db.commit()
+
+    def set(self, symbol: str, price: float) -> None:
+        """
+        Store the price for a single symbol.
+
+        Args:
+            symbol (str): The stock symbol
+            price (float): The freshly fetched price
+        """
+        self.set_many({symbol: price})
+
+    def set_unpriced(self, symbols: Iterable[str]) -> None:
+        """
+        Mark symbols the provider could not price.
+
+        Args:
+            symbols (iterable): The stock symbols
+        """
+        now = time.time()
+        with self._lock:
+            for symbol in symbols:
+                self._unpriced[symbol] = now
+
+    def get_unpriced(self, symbols: Iterable[str]) -> Set[str]:
+        """
+        Look up which symbols are still marked as unpriceable.
+
+        Args:
+            symbols (iterable): The stock symbols to look up
+
+        Returns:
+            set: The symbols marked within the negative TTL
+        """
+        now = time.time()
+        with self._lock:
+            marked = set()
+            for symbol in symbols:
+                marked_at = self._unpriced.get(symbol)
+                if marked_at is None:
+                    continue
+                if now - marked_at < self.negative_ttl:
+                    marked.add(symbol)
+                else:
+                    del self._unpriced[symbol]
+            return marked
+
+    def clear(self) -> None:
+        """
+        Drop all in-memory and persisted entries and reset the hit/miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._unpriced.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM prices")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report the cache counters.
+
+        Returns:
+            dict: The hit and miss counters and the number of in-memory entries
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "unpriced": len(self._unpriced)}
+
+
+def create_default_cache() -> PriceCache:
+    """
+    Creates a PriceCache configured from the PRICE_CACHE_TTL, PRICE_CACHE_MAX_ENTRIES,
+    PRICE_CACHE_PATH and PRICE_NEGATIVE_TTL environment variables. Persistence is only
+    enabled when PRICE_CACHE_PATH is set.
+
+    Returns:
+        PriceCache: The configured cache
+    """
+    return PriceCache(
+        ttl=float(os.environ.get("PRICE_CACHE_TTL", DEFAULT_TTL)),
+        max_entries=int(os.environ.get("PRICE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        path=os.environ.get("PRICE_CACHE_PATH") or None,
+        negative_ttl=float(os.environ.get("PRICE_NEGATIVE_TTL", DEFAULT_NEGATIVE_TTL)),
+    )
@@ -0,0 +1,354 @@
+import abc
+import contextlib
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+import telemetry
+from circuit_breaker import CircuitBreaker
+from logs import get_logger
+from price_cache import PriceCache, create_default_cache
+
+DEFAULT_FETCH_TIMEOUT = 30.0  # seconds one provider call may take
+
+logger = get_logger(__name__)
+
+
+class PriceUnavailableError(LookupError):
+    """Raised when a symbol cannot be priced, e.g. because it is delisted."""
+
+
+class ProviderUnavailableError(RuntimeError):
+    """
+    Raised by a price provider that is failing as a whole, e.g. because it is rate
+    limited. `prices` holds whatever it priced before giving up.
+    """
+
+    def __init__(self, message: str, prices: Optional[Dict[str, float]] = None):
+        super().__init__(message)
+        self.prices: Dict[str, float] = prices or {}
+
+
+class UnpricedPositionsError(PriceUnavailableError):
+    """
+    Raised when held positions could not be priced. The book's total value would be
+    understated, so no rebalance may be computed from it. `symbols` lists them.
+    """
+
+    def __init__(self, symbols: Iterable[str], account: str = ""):
+        self.symbols = sorted(set(symbols))
+        self.account = account
+        super().__init__(f"No price for {len(self.symbols)} held symbols"
+                         f"{f' in account {account}' if account else ''}, not rebalancing: {self.symbols}")
+
+
+class Prices(dict):
+    """
+    The prices of the symbols that could be priced. The requested symbols that
+    could not be are listed in `unpriced` instead of being left out silently.
+    Those whose lookup failed, e.g. on a timeout, rather than coming back without
+    a price are also listed in `failed`; they may well be priced on the next try.
+    """
+
+    def __init__(self, prices: Optional[Dict[str, float]] = None, unpriced: Iterable[str] = (),
+                 failed: Iterable[str] = ()):
+        super().__init__(prices or {})
+        self.unpriced: Set[str] = set(unpriced)
+        self.failed: Set[str] = set(failed)
+
+
+class PriceProvider(abc.ABC):
+    """
+    Interface for a source of current market prices.
+
+    Implementations only need to provide `get_prices`; single-symbol lookups are
+    routed through it. Symbols a provider has no price for are left out of its
+    result; a provider that fails as a whole raises. A provider whose lookups for
+    some symbols failed can return `Prices` with those symbols in `failed`, so they
+    are not remembered as unpriceable.
+    """
+
+    name: str = "base"
+
+    @abc.abstractmethod
+    def get_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """
+        Get the current market prices for many symbols at once.
+
+        Args:
+            symbols (iterable): The stock symbols to look up
+
+        Returns:
+            dict: A dictionary mapping each symbol to its current market price
+
+        Raises:
+            ProviderUnavailableError: If the provider is failing as a whole
+        """
+
+    def get_price(self, symbol: str) -> float:
+        """
+        Get the current market price for a single symbol.
+
+        Args:
+            symbol (str): The stock symbol to look up
+
+        Returns:
+            float: The current market price for the stock
+
+        Raises:
+            PriceUnavailableError: If the symbol cannot be priced
+        """
+        price = self.get_prices([symbol]).get(symbol)
+        if price is None:
+            raise PriceUnavailableError(f"No {self.name} price for {symbol}")
+        return price
+
+
+class YahooPriceProvider(PriceProvider):
+    """
+    Price provider backed by Yahoo Finance.
+    """
+
+    name = "yahoo"
+
+    # yahoo_finance pulls in yfinance and pandas, so it is only imported once a price is needed
+    def get_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        import yahoo_finance
+        return yahoo_finance.get_prices(symbols)
+
+    def get_price(self, symbol: str) -> float:
+        import yahoo_finance
+        return yahoo_finance.get_price(symbol)
+
+
+price_cache: PriceCache = create_default_cache()
+_provider: PriceProvider = YahooPriceProvider()
+_breakers: Dict[str, CircuitBreaker] = {}
+_fetch_locks: Dict[str, threading.Lock] = {}  # provider name: held while a call to it is in flight
+_deadline: Optional[float] = None  # time.monotonic() by which the pricing phase must be done
+
+
+def set_price_provider(provider: PriceProvider) -> None:
+    """
+    Sets the process-wide default provider used by `get_price` and `get_prices`
+    when they are not given one. A provider tied to a connection, such as
+    `IBPriceProvider`, should be passed to those calls explicitly instead.
+
+    Args:
+        provider (PriceProvider): The provider to use
+    """
+    global _provider
+    _provider = provider
+
+
+def get_price_provider() -> PriceProvider:
+    """
+    Returns:
+        PriceProvider: The default provider used by `get_price` and `get_prices`
+    """
+    return _provider
+
+
+def use_ib_prices() -> bool:
+    """
+    Returns:
+        bool: Whether the PRICE_PROVIDER environment variable selects IB market data
+    """
+    return os.environ.get("PRICE_PROVIDER", "yahoo").lower() == "ib"
+
+
+def _breaker(provider: PriceProvider) -> CircuitBreaker:
+    return _breakers.setdefault(provider.name, CircuitBreaker(f"prices_{provider.name}"))
+
+
+@contextlib.contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    Bounds the time all price lookups inside the block may take together:
+
+        with pricing.deadline(60):
+            ...
+
+    Lookups from any thread count against it. Once it has passed, the symbols not
+    already cached come back unpriced without asking the provider. Nested deadlines
+    keep the earlier one.
+
+    Args:
+        seconds (float): The time budget
+    """
+    global _deadline
+    previous = _deadline
+    _deadline = time.monotonic() + seconds if previous is None else min(previous, time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline = previous
+
+
+def _time_budget(timeout: Optional[float]) -> float:
+    budget = timeout if timeout is not None else float(os.environ.get("PRICE_FETCH_TIMEOUT", DEFAULT_FETCH_TIMEOUT))
+    if _deadline is not None:
+        budget = min(budget, _deadline - time.monotonic())
+    return budget
+
+
+def _is_valid(price: float) -> bool:
+    return isinstance(price, (int, float)) and math.isfinite(price) and price > 0
+
+
+def _fetch(provider: PriceProvider, symbols: list, timeout: float) -> Dict[str, float]:
+    """
+    Runs one provider call on a daemon thread and waits at most `timeout` for it. A
+    call that overruns keeps going in the background and still caches what it gets.
+
+    Only one call per provider is in flight at a time. A later lookup waits for the
+    running call within its own time budget, then takes what that call cached and
+    only asks the provider for the rest, instead of starting a second download next
+    to one that is still running.
+
+    Raises:
+        TimeoutError: If the call, or the one before it, did not finish in time
+        Exception: Whatever the provider raised
+    """
+    deadline_at = time.monotonic() + max(0.0, timeout)
+    lock = _fetch_locks.setdefault(provider.name, threading.Lock())
+    if not lock.acquire(timeout=max(0.0, timeout)):
+        raise TimeoutError(f"{provider.name} was still busy with an earlier lookup after {timeout:.1f}s")
+    # Whatever the previous call cached while this one waited need not be fetched again
+    cached = price_cache.get_many(symbols)
+    missing = [symbol for symbol in symbols if symbol not in cached]
+    if not missing:
+        lock.release()
+        return cached
+
+    outcome: Dict[str, object] = {}
+    done = threading.Event()
+
+    def run() -> None:
+        try:
+            fetched = provider.get_prices(missing)
+            price_cache.set_many({symbol: price for symbol, price in fetched.items() if _is_valid(price)})
+            outcome["prices"] = fetched
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            # Released by the fetch itself, so an overrunning call keeps the next one waiting
+            lock.release()
+            done.set()
+
+    threading.Thread(target=run, name="price-fetch", daemon=True).start()
+    if not done.wait(max(0.0, deadline_at - time.monotonic())):
+        raise TimeoutError(f"{provider.name} did not return {len(symbols)} prices within {timeout:.1f}s")
+    if "error" in outcome:
+        error = outcome["error"]
+        if isinstance(error, ProviderUnavailableError):
+            error.prices = {**cached, **error.prices}
+        raise error
+    fetched = outcome["prices"]
+    return Prices({**cached, **fetched}, failed=getattr(fetched, "failed", ()))
+
+
+def get_price(symbol: str, provider: Optional[PriceProvider] = None) -> float:
+    """
+    Get the current market price for a given stock symbol from a provider, served
+    from the price cache when a fresh quote is available.
+
+    Args:
+        symbol (str): The stock symbol to look up
+        provider (PriceProvider, optional): The provider to ask. Defaults to the
+                                            provider set with `set_price_provider`
+
+    Returns:
+        float: The current market price for the stock
+
+    Raises:
+        PriceUnavailableError: If the symbol cannot be priced
+    """
+    prices = get_prices([symbol], provider=provider)
+    if symbol not in prices:
+        raise PriceUnavailableError(f"No price for {symbol}")
+    return prices[symbol]
+
+
+def get_prices(symbols: Iterable[str], timeout: Optional[float] = None,
+               provider: Optional[PriceProvider] = None) -> Prices:
+    """
+    Get the current market prices for many symbols at once. Symbols with a fresh
+    entry in the price cache are served from it, and the rest are fetched from the
+    provider in one batch and added to the cache.
+
+    Lookups degrade instead of stalling. Symbols the provider had no valid price for
+    are remembered in the negative cache and not asked for again for a while. A
+    provider that raises or overruns its time budget trips a circuit breaker, and
+    while the breaker is open no requests are made. Either way the symbols without
+    a price come back in the result's `unpriced` set.
+
+    Args:
+        symbols (iterable): The stock symbols to look up
+        timeout (float, optional): Seconds the provider call may take. Defaults to the
+                                   PRICE_FETCH_TIMEOUT environment variable, and is cut
+                                   short by an enclosing `deadline`
+        provider (PriceProvider, optional): The provider to ask. Defaults to the
+                                   provider set with `set_price_provider`
+
+    Returns:
+        Prices: A dictionary mapping each priced symbol to its current market price,
+                with the symbols that could not be priced in `unpriced`
+    """
+    unique_symbols = list(dict.fromkeys(symbols))
+    prices = Prices(price_cache.get_many(unique_symbols))
+    remaining = [symbol for symbol in unique_symbols if symbol not in prices]
+    prices.unpriced = price_cache.get_unpriced(remaining)
+    to_fetch = [symbol for symbol in remaining if symbol not in prices.unpriced]
+    telemetry.count("price_cache_hits_total", len(prices))
+    telemetry.count("price_cache_misses_total", len(to_fetch))
+    if to_fetch:
+        prices.update(_fetch_with_guards(provider or _provider, to_fetch, timeout, prices.unpriced))
+    if prices.unpriced:
+        telemetry.count("prices_unpriced_total", len(prices.unpriced))
+    return prices
+
+
+def _fetch_with_guards(provider: PriceProvider, symbols: list, timeout: Optional[float],
+                       unpriced: Set[str]) -> Dict[str, float]:
+    """
+    Fetches prices from the provider through its circuit breaker and the time budget,
+    adding the symbols left without a price to `unpriced`.
+    """
+    breaker = _breaker(provider)
+    budget = _time_budget(timeout)
+    if budget <= 0 or not breaker.allow():
+        logger.warning("Skipping %s price lookups for %s symbols: %s", provider.name, len(symbols),
+                       "pricing deadline passed" if budget <= 0 else
+                       f"circuit open for another {breaker.retry_in():.1f}s")
+        unpriced.update(symbols)
+        return {}
+
+    with telemetry.span("price_fetch", provider=provider.name, symbols=len(symbols)) as span:
+        try:
+            fetched = _fetch(provider, symbols, budget)
+            breaker.record_success()
+            symbol_failures = True
+        except (TimeoutError, ProviderUnavailableError) as e:
+            breaker.record_failure()
+            logger.warning("%s", e)
+            fetched = e.prices if isinstance(e, ProviderUnavailableError) else {}
+            symbol_failures = False
+        except Exception as e:
+            breaker.record_failure()
+            logger.warning("%s price lookup failed: %s", provider.name, e)
+            fetched, symbol_failures = {}, False
+
+        requested = set(symbols)
+        valid = {symbol: price for symbol, price in fetched.items() if symbol in requested and _is_valid(price)}
+        missing = [symbol for symbol in symbols if symbol not in valid]
+        failed = getattr(fetched, "failed", set())
+        if missing and symbol_failures:
+            # The provider answered but had nothing for these symbols; do not ask again for a while.
+            # Symbols whose lookup failed are only unpriced for this call
+            price_cache.set_unpriced([symbol for symbol in missing if symbol not in failed])
+        unpriced.update(missing)
+        span.set(fetched=len(valid), unpriced=len(missing))
+    return valid
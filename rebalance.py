@@ -1,8 +1,6 @@
-import csv
-from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterable, Mapping, Union
 
-from chaikin import get_watchlist
+from basket_export import BasketExporter, BasketRow
 
 TOTAL_PERCENTAGE = 99.9
 IGNORE_SYMBOLS = {'U', 'GSK', 'FLR', 'PRIM', 'DAVE', 'SKWD', 'LRN'}
@@ -62,31 +60,28 @@ def rebalance_portfolio(watchlist: Dict[str, Dict[str, Any]], rating_weights_ove
     return result
 
 
-def download_rebalance_csv(portfolio: Dict[str, float], suffix: str = "rebal") -> None:
-    """Downloads the rebalanced portfolio to a CSV file.
+def download_rebalance_csv(portfolio: Union[Mapping[str, float], Iterable[BasketRow]], suffix: str = "rebal") -> List[str]:
+    """Downloads the rebalanced portfolio to TWS basket CSV files.
 
-    This function generates a CSV file with the current date and a specified suffix,
-    containing the rebalanced portfolio data in a specific format.
+    This function writes a CSV file with the current date and a specified suffix,
+    containing the rebalanced portfolio data in the TWS basket format. It streams
+    the rows through `BasketExporter`, so a plan for many accounts does not have to
+    be held in memory.
 
     Args:
         portfolio: A dictionary where keys are stock symbols and values are their
-                  assigned percentages as floats.
+                  assigned percentages as floats, or an iterable of (account, symbol,
+                  target, shares) rows such as `basket_export.target_rows` yields.
+                  Rows of account "" go to the dated file, and every other account
+                  gets its own file in a directory of the same name.
         suffix: A string suffix to append to the filename for the CSV export.
+
+    Returns:
+        The paths of the files written.
     """
-    today = datetime.now().strftime("%Y%m%d")
-    filename: str = f"{today} {suffix}.csv"
-    with open(filename, "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["CSVEXPORT"])  # First row
-        for symbol, percent in portfolio.items():
-            row: List[Any] = ["DES",  # Column A
-                   symbol,  # Column B
-                   "STK",  # Column C
-                   "SMART/AMEX",  # Column D
-                   "", "", "", "", "",  # Columns E to I (empty)
-                   percent  # Column J
-                   ]
-            writer.writerow(row)
+    if isinstance(portfolio, Mapping):
+        portfolio = (("", symbol, percent, 0) for symbol, percent in portfolio.items())
+    return BasketExporter(".", suffix).export(portfolio)
 
 
 def filter_watchlist(watchlist: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
@@ -94,6 +89,8 @@ def filter_watchlist(watchlist: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str
 
 
 if __name__ == "__main__":
+    from chaikin import get_watchlist
+
     my_portfolio = rebalance_portfolio(filter_watchlist(get_watchlist()))
     print(my_portfolio)
     download_rebalance_csv(my_portfolio)
@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TOTAL_PERCENTAGE = 99.9  # Must match rebalance.TOTAL_PERCENTAGE
+
+
+def target_percentages(symbols: Sequence[str], ratings: Sequence[int],
+                       rating_weights_override: Optional[Dict[int, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized equivalent of `rebalance.rebalance_portfolio`.
+
+    Weights double per rating step (or come from `rating_weights_override`), are
+    normalized to TOTAL_PERCENTAGE and rounded to 4 decimals, and the smallest
+    allocation absorbs any rounding excess. The results are identical to
+    `rebalance_portfolio`, including the order of the symbols.
+
+    Args:
+        symbols (sequence): The watchlist symbols
+        ratings (sequence): The rating id of each symbol, aligned with `symbols`
+        rating_weights_override (dict, optional): Rating weights to use instead of doubling per rating
+
+    Returns:
+        tuple: The symbols in `rebalance_portfolio` order (grouped by ascending rating)
+               and their target percentages
+
+    Raises:
+        ValueError: If there are no valid ratings to rebalance
+    """
+    symbols = np.asarray(symbols, dtype=object)
+    ratings = np.asarray(ratings, dtype=np.int64)
+    order = np.argsort(ratings, kind="stable")
+    rating_ids, inverse, counts = np.unique(ratings[order], return_inverse=True, return_counts=True)
+
+    if rating_weights_override:
+        rating_weights = [rating_weights_override.get(int(rid), 1.0) for rid in rating_ids]
+    else:
+        rating_weights = [1.0 * (2 ** int(rid - rating_ids[0])) for rid in rating_ids]
+
+    # Only one value per rating, so these reductions stay in Python to round exactly like the original
+    total_weight = sum(weight * int(count) for weight, count in zip(rating_weights, counts))
+    if total_weight == 0:
+        raise ValueError("No valid ratings found to rebalance.")
+    scale = TOTAL_PERCENTAGE / total_weight
+    per_rating = np.array([round(weight * scale, 4) for weight in rating_weights], dtype=np.float64)
+
+    percentages = per_rating[inverse]
+    if len(percentages):
+        # cumsum adds sequentially, matching Python's sum() bit for bit
+        total = np.cumsum(percentages)[-1]
+        if total > TOTAL_PERCENTAGE:
+            smallest = int(np.argmin(percentages))
+            percentages[smallest] = round(float(percentages[smallest]) - (float(total) - TOTAL_PERCENTAGE), 4)
+
+    return symbols[order], percentages
+
+
+def share_deltas(target_pct: np.ndarray, prices: np.ndarray, quantities: np.ndarray,
+                 total_values: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Computes the number of shares to trade for every symbol in one vectorized pass.
+
+    Works on a single account (1-D `quantities`) or on many accounts at once
+    (2-D `quantities` of shape accounts x symbols). Columns with a NaN target are
+    not part of the desired allocation and are fully closed when held long.
+
+    Args:
+        target_pct (np.ndarray): Target percentage per symbol, NaN for symbols to close
+        prices (np.ndarray): Price per symbol
+        quantities (np.ndarray): Current quantity per symbol (per account)
+        total_values (np.ndarray, optional): Total market value (per account). Defaults to
+                                             the sequential sum of quantity x price
+
+    Returns:
+        np.ndarray: Signed share deltas with the shape of `quantities`; positive to buy, negative to sell
+
+    Raises:
+        ZeroDivisionError: If a symbol in the desired allocation has a zero price
+    """
+    target_pct = np.asarray(target_pct, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    desired = ~np.isnan(target_pct)
+    if np.any(prices[desired] == 0):
+        raise ZeroDivisionError("Cannot size an order for a symbol with a zero price.")
+
+    market_values = prices * quantities
+    if total_values is None:
+        total_values = np.cumsum(market_values, axis=-1)[..., -1] if market_values.shape[-1] else np.zeros(market_values.shape[:-1])
+    total_values = np.asarray(total_values, dtype=np.float64)
+
+    desired_values = total_values[..., np.newaxis] * (np.where(desired, target_pct, 0.0) / 100)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deltas = np.trunc((desired_values - market_values) / np.where(desired, prices, 1.0))
+    closing = np.where(quantities > 0, -quantities, 0)
+    return np.where(desired, deltas, closing).astype(np.int64)
+
+
+def generate_orders(desired_symbols: Sequence[str], target_pct: Sequence[float], held_symbols: Sequence[str],
+                    held_quantities: Sequence[int], prices: Dict[str, float],
+                    total_value: float) -> List[Tuple[str, str, int]]:
+    """
+    Vectorized equivalent of `IBApp.create_rebalance_orders` for a single account.
+
+    Args:
+        desired_symbols (sequence): Symbols in the desired allocation, in order
+        target_pct (sequence): Target percentage for each desired symbol
+        held_symbols (sequence): Currently held symbols, in order
+        held_quantities (sequence): Quantity of each held symbol
+        prices (dict): Price of every desired and held symbol
+        total_value (float): Total market value of the account
+
+    Returns:
+        list: (symbol, action, shares) orders in the same order `create_rebalance_orders` produces them
+    """
+    held_index = {symbol: i for i, symbol in enumerate(held_symbols)}
+    desired_set = set(desired_symbols)
+    closing_symbols = [symbol for symbol in held_symbols if symbol not in desired_set]
+    universe = list(desired_symbols) + closing_symbols
+
+    quantities = np.zeros(len(universe), dtype=np.int64)
+    for i, symbol in enumerate(universe):
+        if symbol in held_index:
+            quantities[i] = held_quantities[held_index[symbol]]
+    targets = np.concatenate([np.asarray(target_pct, dtype=np.float64), np.full(len(closing_symbols), np.nan)])
+    price_array = np.array([prices[symbol] for symbol in universe], dtype=np.float64)
+
+    deltas = share_deltas(targets, price_array, quantities, np.float64(total_value))
+    return [(universe[i], "BUY" if deltas[i] > 0 else "SELL", abs(int(deltas[i]))) for i in np.flatnonzero(deltas)]
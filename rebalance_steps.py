@@ -0,0 +1,232 @@
+"""
+The steps of a rebalance run: fetching the watchlist, downloading the positions,
+and computing, recording and placing the orders. `main` runs them once and
+`drift_monitor` whenever the portfolio has drifted.
+"""
+import math
+import os
+from typing import Dict, Any, List, Optional
+
+import telemetry
+from basket_export import BasketExporter, target_rows
+from chaikin import get_watchlist
+from logs import get_logger
+from order_scheduler import OrderScheduler
+from rebalance import rebalance_portfolio
+from trade_bands import TradeBands
+from pricing import UnpricedPositionsError, get_prices, price_cache, use_ib_prices
+from snapshot_store import DRIFT_THRESHOLD, SKIP_MAX_AGE, SnapshotStore
+from tws_api import IBApp, IBPriceProvider
+
+POSITIONS_TIMEOUT = 30  # seconds
+PRICING_DEADLINE = 25  # seconds all price lookups of a run may take, so pricing fails before the positions wait does
+ORDERS_TIMEOUT = 60  # seconds
+
+logger = get_logger(__name__)
+
+
+@telemetry.traced("watchlist_fetch")
+def fetch_watchlist(prefetch: Optional[bool] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Retrieves and filters the watchlist from Chaikin Analytics, then prefetches the
+    prices of its symbols so that the rebalance step is served from the price cache.
+
+    Args:
+        prefetch (bool, optional): Whether to prefetch the prices from the default provider.
+                                   Defaults to prefetching unless PRICE_PROVIDER selects IB
+                                   prices, which need the TWS connection and are looked up
+                                   in the rebalance step
+
+    Returns:
+        dict: The filtered watchlist
+    """
+    # Get the watchlist from Chaikin Analytics
+    watchlist: Dict[str, Dict[str, Any]] = get_watchlist()
+
+    # Filter watchlist
+    watchlist = {sym: details for sym, details in watchlist.items() if details['rating_id'] >= 5 and sym not in ['U', 'GSK']}
+
+    # Warm the price cache for the symbols we may buy
+    if prefetch is None:
+        prefetch = not use_ib_prices()
+    if prefetch:
+        get_prices(watchlist.keys())
+    return watchlist
+
+
+def skip_max_age() -> float:
+    """
+    Reads from the SKIP_MAX_AGE environment variable how many seconds after the latest
+    priced run a rebalance may still be skipped.
+
+    Returns:
+        float: The maximum age in seconds
+    """
+    return float(os.environ.get("SKIP_MAX_AGE", SKIP_MAX_AGE))
+
+
+def configured_accounts() -> Optional[List[str]]:
+    """
+    Reads the accounts to rebalance from the TWS_ACCOUNTS environment variable.
+
+    Returns:
+        list: None for the single-account mode (TWS_ACCOUNTS unset), an empty list for
+              all managed accounts (TWS_ACCOUNTS=ALL), or the comma-separated accounts
+    """
+    value = os.environ.get("TWS_ACCOUNTS", "").strip()
+    if not value:
+        return None
+    if value.upper() == "ALL":
+        return []
+    return [account.strip() for account in value.split(",") if account.strip()]
+
+
+@telemetry.traced("position_download")
+def download_positions(app: IBApp, accounts: Optional[List[str]] = None, price: bool = True) -> IBApp:
+    """
+    Downloads and prices the current positions on a connected app. When the
+    PRICE_PROVIDER environment variable is "ib", prices come from IB market data
+    snapshots on this connection.
+
+    Args:
+        app (IBApp): A connected IBApp instance
+        accounts (list, optional): Accounts to load separate position books for.
+                                   None merges all positions into one book; an empty
+                                   list loads every managed account.
+        price (bool): Whether to price the merged book. When False only the quantities
+                      are downloaded, into app.received_positions, and app.price_positions
+                      prices them later. Per-account books are always priced.
+
+    Returns:
+        IBApp: The same app with its positions_map (or account_positions) populated
+
+    Raises:
+        RuntimeError: If the positions are not received in time
+        Exception: Whatever pricing the merged book raised
+    """
+    # Scoped to this connection rather than set process-wide, so the watchlist prefetch on
+    # the other thread and later runs on a new connection do not use this app
+    app.price_provider = IBPriceProvider(app) if use_ib_prices() else None
+
+    if accounts is not None:
+        app.get_account_positions(accounts or None, timeout=POSITIONS_TIMEOUT)
+        return app
+
+    app.get_my_positions(price=price)
+    if not app.positions_done.wait(timeout=POSITIONS_TIMEOUT):
+        raise RuntimeError("Timed out waiting for positions from TWS")
+    if app.positions_error is not None:
+        raise app.positions_error
+    return app
+
+
+def execute_rebalance(app: IBApp, watchlist: Dict[str, Dict[str, Any]], accounts: Optional[List[str]] = None,
+                      store: Optional[SnapshotStore] = None, exporter: Optional[BasketExporter] = None) -> None:
+    """
+    Calculates the rebalancing orders for the app's current positions, places them
+    and waits for them to complete.
+
+    Args:
+        app (IBApp): A connected IBApp instance with its positions downloaded
+        watchlist (dict): The filtered watchlist to rebalance towards
+        accounts (list, optional): When not None, rebalance each account loaded by
+                                   `download_positions` separately and route its orders to it
+        store (SnapshotStore, optional): Records the watchlist, positions, prices and planned
+                                   orders of the run before the orders are placed
+        exporter (BasketExporter, optional): Exports every account's target holdings as
+                                   basket CSV files before the orders are placed
+
+    Raises:
+        UnpricedPositionsError: If a held position could not be priced; no orders are placed
+    """
+    with telemetry.span("rebalance_compute") as span:
+        # Calculate rebalance
+        desired_portfolio = rebalance_portfolio(watchlist)
+
+        # Skip orders that would only nudge allocations that are already close to their targets
+        bands = TradeBands.from_env()
+        # Orders still working from an earlier run are netted against like this run's own
+        app.load_open_orders()
+
+        # Execute orders, sells first so that freed cash funds the buys
+        scheduler = OrderScheduler(app)
+        if accounts is not None:
+            account_orders = app.create_account_rebalance_orders(desired_portfolio, bands)
+            for account, orders in account_orders.items():
+                scheduler.add_all(orders, account)
+            books = dict(app.account_positions)
+        else:
+            # Create rebalance orders
+            orders = app.create_rebalance_orders(desired_portfolio, bands)
+
+            logger.info("Rebalance Orders: %s", orders)
+            scheduler.add_all(orders)
+            account_orders, books = {"": orders}, {"": app.positions_map}
+        bands.report()
+        span.set(symbols=len(desired_portfolio), suppressed_orders=bands.suppressed_orders,
+                 netted_orders=bands.netted_orders)
+
+    # Never submit orders sized from a partial valuation, e.g. after the pricing deadline ran out
+    held = {symbol for book in books.values() for symbol, (quantity, *_rest) in book.items() if quantity}
+    if held & app.unpriced_symbols:
+        raise UnpricedPositionsError(held & app.unpriced_symbols)
+
+    prices = price_cache.get_many(desired_portfolio)
+    if store is not None:
+        run_id = store.record(watchlist, desired_portfolio, books, prices, account_orders)
+        logger.info("Recorded snapshot run %s", run_id)
+
+    if exporter is not None:
+        with telemetry.span("basket_export") as span:
+            exporter.export(target_rows(desired_portfolio, books, prices))
+            span.set(rows=exporter.rows_written, changed=exporter.rows_changed)
+        exporter.report()
+
+    with telemetry.span("order_submission") as span:
+        submitted = scheduler.submit()
+        span.set(orders=len(submitted))
+    scheduler.report()
+
+    if submitted:
+        # Wait for orders to complete
+        with telemetry.span("order_completion", orders=len(submitted)):
+            if not app.order_tracker.wait_for([order_id for order_id, *_ in submitted], timeout=ORDERS_TIMEOUT):
+                logger.warning("Orders still working after %ss: %s", ORDERS_TIMEOUT, app.order_tracker.pending())
+        app.order_tracker.report()
+
+
+def skip_unchanged(app: IBApp, watchlist: Dict[str, Dict[str, Any]], store: SnapshotStore) -> bool:
+    """
+    Checks the unpriced positions downloaded with `download_positions(app, price=False)`
+    against the latest snapshot. When the ratings are unchanged and no allocation has
+    drifted past the DRIFT_THRESHOLD environment variable (in percentage points), the
+    run is recorded as skipped. Otherwise the positions are priced for the rebalance.
+
+    Only cached prices and those of the latest priced run are used for the check, so a
+    skipped run makes no price requests. Once that run is older than `skip_max_age`,
+    the rebalance runs regardless. The skipped run records only the cached prices; the
+    others were not observed on it.
+
+    Args:
+        app (IBApp): A connected IBApp instance with its positions downloaded unpriced
+        watchlist (dict): The filtered watchlist
+        store (SnapshotStore): The snapshot store
+
+    Returns:
+        bool: True if the rebalance can be skipped
+    """
+    desired_portfolio = rebalance_portfolio(watchlist)
+    quantities = {symbol: position for symbol, (position, _contract) in app.received_positions.items()}
+    fresh_prices = price_cache.get_many(quantities)
+    reason = store.unchanged(watchlist, desired_portfolio, quantities, fresh_prices,
+                             float(os.environ.get("DRIFT_THRESHOLD", DRIFT_THRESHOLD)), skip_max_age())
+    if reason is None:
+        app.price_positions()
+        return False
+
+    run_id = store.record(watchlist, desired_portfolio,
+                          {"": {symbol: (quantity, fresh_prices.get(symbol, math.nan))
+                                for symbol, quantity in quantities.items()}},
+                          skipped=True, reason=reason)
+    logger.info("Skipping rebalance, %s (recorded snapshot run %s)", reason, run_id)
+    return True
@@ -0,0 +1,501 @@
+import contextlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from portfolio import Portfolio
+
+RUN_PREFIX = "run-"
+STRINGS_FILE = "strings.txt"
+LOCK_FILE = ".lock"
+META_FILE = "meta.json"
+DRIFT_THRESHOLD = 1.0  # percentage points
+SKIP_MAX_AGE = 60 * 60  # seconds since the last priced run after which a rebalance is no longer skipped
+
+# Table name: column name: dtype. Symbols and accounts are stored as indexes into
+# the store's string dictionary; order quantities are signed, positive for buys.
+TABLES: Dict[str, Dict[str, Any]] = {
+    "watchlist": {"symbol": np.int32, "rating_id": np.int16, "target": np.float64},
+    "prices": {"symbol": np.int32, "price": np.float64},
+    "positions": {"account": np.int32, "symbol": np.int32, "quantity": np.int64, "price": np.float64},
+    "orders": {"account": np.int32, "symbol": np.int32, "quantity": np.int64},
+}
+
+
+class Snapshot:
+    """
+    One recorded run. Columns are memory-mapped read-only on first access, so
+    opening a snapshot or querying one table does not read the others.
+    """
+
+    def __init__(self, store: "SnapshotStore", run_id: int):
+        """
+        Args:
+            store (SnapshotStore): The store the run belongs to
+            run_id (int): The run number
+        """
+        self.store = store
+        self.run_id = run_id
+        self.path = store.run_path(run_id)
+        self._columns: Dict[str, np.ndarray] = {}
+        with open(os.path.join(self.path, META_FILE)) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+
+    def column(self, table: str, column: str) -> np.ndarray:
+        """
+        Args:
+            table (str): A table in `TABLES`
+            column (str): One of the table's columns
+
+        Returns:
+            np.ndarray: The read-only column
+        """
+        key = f"{table}.{column}"
+        if key not in self._columns:
+            path = os.path.join(self.path, f"{key}.npy")
+            try:
+                self._columns[key] = np.load(path, mmap_mode="r")
+            except ValueError:  # An empty column cannot be memory-mapped
+                self._columns[key] = np.load(path)
+        return self._columns[key]
+
+    def _strings(self, table: str, column: str) -> List[str]:
+        strings = self.store.strings
+        return [strings[i] for i in self.column(table, column).tolist()]
+
+    def ratings(self) -> Dict[str, int]:
+        """
+        Returns:
+            dict: The watchlist symbols mapped to their Chaikin rating IDs
+        """
+        return dict(zip(self._strings("watchlist", "symbol"), self.column("watchlist", "rating_id").tolist()))
+
+    def targets(self) -> Dict[str, float]:
+        """
+        Returns:
+            dict: The target allocation percentages of the run
+        """
+        return dict(zip(self._strings("watchlist", "symbol"), self.column("watchlist", "target").tolist()))
+
+    def prices(self) -> Dict[str, float]:
+        """
+        Returns:
+            dict: Every price the run used, including those of the held positions it priced
+        """
+        prices = {symbol: price for symbol, price in zip(self._strings("positions", "symbol"),
+                                                         self.column("positions", "price").tolist())
+                  if not math.isnan(price)}
+        prices.update(zip(self._strings("prices", "symbol"), self.column("prices", "price").tolist()))
+        return prices
+
+    def positions(self, account: str = "") -> Dict[str, Tuple[int, float]]:
+        """
+        Args:
+            account (str): The account, "" for the merged single-book mode
+
+        Returns:
+            dict: symbol: (quantity, price) of the account's positions. The price is NaN for
+                  positions the run did not price, e.g. on a skipped run
+        """
+        rows = self.column("positions", "account") == self.store.string_id(account, add=False)
+        symbols = self.column("positions", "symbol")[rows].tolist()
+        return {self.store.strings[symbol]: (quantity, price) for symbol, quantity, price in
+                zip(symbols, self.column("positions", "quantity")[rows].tolist(),
+                    self.column("positions", "price")[rows].tolist())}
+
+    def orders(self) -> List[Tuple[str, str, str, int]]:
+        """
+        Returns:
+            list: The planned (account, symbol, action, shares) orders of the run
+        """
+        return [(account, symbol, "BUY" if quantity > 0 else "SELL", abs(quantity)) for account, symbol, quantity in
+                zip(self._strings("orders", "account"), self._strings("orders", "symbol"),
+                    self.column("orders", "quantity").tolist())]
+
+
+class SnapshotDiff:
+    """
+    The changes between two snapshots: watchlist symbols added and removed, rating
+    changes, position quantity changes and price moves.
+    """
+
+    def __init__(self, old: Snapshot, new: Snapshot):
+        """
+        Args:
+            old (Snapshot): The earlier run
+            new (Snapshot): The later run
+        """
+        self.old_run = old.run_id
+        self.new_run = new.run_id
+        size = len(new.store.strings)
+
+        # Columns are scattered into dense arrays indexed by string ID and compared in one pass
+        old_ratings = _dense(size, old.column("watchlist", "symbol"), old.column("watchlist", "rating_id"), -1)
+        new_ratings = _dense(size, new.column("watchlist", "symbol"), new.column("watchlist", "rating_id"), -1)
+        changed = np.flatnonzero(old_ratings != new_ratings)
+        strings = new.store.strings
+        self.added: List[str] = [strings[i] for i in changed[old_ratings[changed] == -1].tolist()]
+        self.removed: List[str] = [strings[i] for i in changed[new_ratings[changed] == -1].tolist()]
+        both = changed[(old_ratings[changed] != -1) & (new_ratings[changed] != -1)]
+        self.rating_changes: Dict[str, Tuple[int, int]] = {
+            strings[i]: (old_rating, new_rating)
+            for i, old_rating, new_rating in zip(both.tolist(), old_ratings[both].tolist(), new_ratings[both].tolist())
+        }
+
+        # Positions are keyed by (account, symbol)
+        old_keys = old.column("positions", "account").astype(np.int64) * size + old.column("positions", "symbol")
+        new_keys = new.column("positions", "account").astype(np.int64) * size + new.column("positions", "symbol")
+        keys = np.union1d(old_keys, new_keys)
+        old_quantities = np.zeros(len(keys), dtype=np.int64)
+        new_quantities = np.zeros(len(keys), dtype=np.int64)
+        old_quantities[np.searchsorted(keys, old_keys)] = old.column("positions", "quantity")
+        new_quantities[np.searchsorted(keys, new_keys)] = new.column("positions", "quantity")
+        moved = np.flatnonzero(old_quantities != new_quantities)
+        self.quantity_changes: Dict[Tuple[str, str], Tuple[int, int]] = {
+            (strings[key // size], strings[key % size]): (old_quantity, new_quantity)
+            for key, old_quantity, new_quantity in zip(keys[moved].tolist(), old_quantities[moved].tolist(),
+                                                       new_quantities[moved].tolist())
+        }
+
+        old_prices, new_prices = old.prices(), new.prices()
+        self.price_changes: Dict[str, Tuple[float, float]] = {
+            symbol: (old_prices[symbol], price) for symbol, price in new_prices.items()
+            if symbol in old_prices and price != old_prices[symbol]
+        }
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.rating_changes or self.quantity_changes)
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: A human readable summary of the changes
+        """
+        lines = [f"Changes from run {self.old_run} to run {self.new_run}:"]
+        if self.added:
+            lines.append(f"  Added to watchlist: {', '.join(self.added)}")
+        if self.removed:
+            lines.append(f"  Removed from watchlist: {', '.join(self.removed)}")
+        for symbol, (old_rating, new_rating) in self.rating_changes.items():
+            lines.append(f"  {symbol}: rating {old_rating} -> {new_rating}")
+        for (account, symbol), (old_quantity, new_quantity) in self.quantity_changes.items():
+            lines.append(f"  {account + ' ' if account else ''}{symbol}: {old_quantity} -> {new_quantity} shares")
+        moves = sorted(self.price_changes.items(), key=lambda item: -abs(item[1][1] / item[1][0] - 1))
+        for symbol, (old_price, new_price) in moves[:10]:
+            lines.append(f"  {symbol}: price {old_price} -> {new_price} ({(new_price / old_price - 1) * 100:+.2f}%)")
+        if len(lines) == 1:
+            lines.append("  No changes")
+        return "\n".join(lines)
+
+
+def _dense(size: int, index: np.ndarray, values: np.ndarray, fill: int) -> np.ndarray:
+    dense = np.full(size, fill, dtype=np.int64)
+    dense[index] = values
+    return dense
+
+
+class SnapshotStore:
+    """
+    Append-only store of rebalance runs.
+
+    Every run is a directory of column files (`<table>.<column>.npy`) plus a JSON
+    metadata file, written to a temporary directory and renamed into place, so a
+    run is either complete or absent. Symbols and account names are interned in
+    one append-only string dictionary shared by all runs, which keeps the columns
+    fixed-width and lets runs be compared by integer ID.
+
+    Writers hold an exclusive lock on the store while they record a run, and catch
+    up with the strings other writers added before interning their own, so several
+    processes may record into the same store. Any number of processes may read it.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The store directory. Created if it does not exist
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self._new_strings: List[str] = []  # Interned here but not yet in the strings file
+        self._strings_read = 0  # Bytes of the strings file read so far
+        self._reload_strings()
+
+    def _reload_strings(self) -> None:
+        """
+        Reads the strings other writers appended to the strings file since it was last
+        read. Strings interned here but not yet written are re-interned after them, so
+        their IDs may change until they are recorded.
+        """
+        pending = self._new_strings
+        for string in pending:
+            del self._string_ids[string]
+        del self.strings[len(self.strings) - len(pending):]
+        self._new_strings = []
+
+        strings_path = os.path.join(self.path, STRINGS_FILE)
+        if os.path.exists(strings_path):
+            with open(strings_path, "rb") as f:
+                f.seek(self._strings_read)
+                data = f.read()
+            # A line still being appended by a writer is picked up by the next read
+            data = data[:data.rfind(b"\n") + 1]
+            self._strings_read += len(data)
+            for line in data.decode("utf-8").splitlines():
+                self._intern(line)
+        for string in pending:
+            self.string_id(string)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Holds the store's exclusive writer lock for the duration of the block.
+        """
+        with open(os.path.join(self.path, LOCK_FILE), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _intern(self, string: str) -> int:
+        self._string_ids[string] = len(self.strings)
+        self.strings.append(string)
+        return len(self.strings) - 1
+
+    def string_id(self, string: str, add: bool = True) -> int:
+        """
+        Args:
+            string (str): A symbol or account name
+            add (bool): Whether to add the string to the dictionary if it is new
+
+        Returns:
+            int: The string's ID, or -1 if it is unknown and `add` is False
+        """
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            if not add:
+                return -1
+            string_id = self._intern(string)
+            self._new_strings.append(string)
+        return string_id
+
+    def _ids(self, strings: Iterable[str]) -> np.ndarray:
+        return np.array([self.string_id(string) for string in strings], dtype=np.int32)
+
+    def run_path(self, run_id: int) -> str:
+        return os.path.join(self.path, f"{RUN_PREFIX}{run_id:06d}")
+
+    def runs(self) -> List[int]:
+        """
+        Returns:
+            list: The recorded run numbers, oldest first
+        """
+        return sorted(int(name[len(RUN_PREFIX):]) for name in os.listdir(self.path)
+                      if name.startswith(RUN_PREFIX) and name[len(RUN_PREFIX):].isdigit())
+
+    def load(self, run_id: int) -> Snapshot:
+        # The run may use strings another process added after this store read them
+        self._reload_strings()
+        return Snapshot(self, run_id)
+
+    def latest(self) -> Optional[Snapshot]:
+        """
+        Returns:
+            Snapshot: The most recent run, or None if the store is empty
+        """
+        runs = self.runs()
+        return self.load(runs[-1]) if runs else None
+
+    def latest_priced(self, max_age: Optional[float] = None) -> Optional[Snapshot]:
+        """
+        Args:
+            max_age (float, optional): Seconds the run may be old
+
+        Returns:
+            Snapshot: The most recent run that was not skipped, or None if there is none
+                      or it is older than `max_age`
+        """
+        for run_id in reversed(self.runs()):
+            snapshot = self.load(run_id)
+            if snapshot.meta.get("skipped"):
+                continue
+            if max_age is not None and time.time() - snapshot.meta["time"] > max_age:
+                return None
+            return snapshot
+        return None
+
+    def diff(self, old_run: int, new_run: int) -> SnapshotDiff:
+        """
+        Args:
+            old_run (int): The earlier run number
+            new_run (int): The later run number
+
+        Returns:
+            SnapshotDiff: The changes between the two runs
+        """
+        return SnapshotDiff(self.load(old_run), self.load(new_run))
+
+    def record(self, watchlist: Dict[str, Dict[str, Any]], targets: Mapping[str, float],
+               positions: Mapping[str, Mapping[str, Any]], prices: Optional[Mapping[str, float]] = None,
+               orders: Optional[Mapping[str, List[Tuple[str, str, int]]]] = None, **meta: Any) -> int:
+        """
+        Appends a run.
+
+        Args:
+            watchlist (dict): The filtered watchlist, symbol: details with a 'rating_id'
+            targets (Mapping): The target allocation percentages
+            positions (Mapping): Each account ("" for the merged book) mapped to its positions,
+                                 either a Portfolio or symbol: (quantity, price, ...) tuples.
+                                 A NaN price marks a position the run did not price
+            prices (Mapping, optional): Prices used for symbols that are not held
+            orders (Mapping, optional): Each account mapped to its (symbol, action, shares) orders
+            **meta: Extra JSON-serializable run attributes, e.g. skipped=True
+
+        Returns:
+            int: The new run number
+        """
+        with self._locked():
+            # Another process may have added strings and runs since this store last looked
+            self._reload_strings()
+            return self._record(watchlist, targets, positions, prices, orders, meta)
+
+    def _record(self, watchlist: Dict[str, Dict[str, Any]], targets: Mapping[str, float],
+                positions: Mapping[str, Mapping[str, Any]], prices: Optional[Mapping[str, float]],
+                orders: Optional[Mapping[str, List[Tuple[str, str, int]]]], meta: Dict[str, Any]) -> int:
+        runs = self.runs()
+        run_id = runs[-1] + 1 if runs else 1
+        columns: Dict[str, Dict[str, Any]] = {table: {} for table in TABLES}
+
+        symbols = list(watchlist)
+        columns["watchlist"] = {
+            "symbol": self._ids(symbols),
+            "rating_id": [watchlist[symbol]["rating_id"] for symbol in symbols],
+            "target": [targets.get(symbol, 0.0) for symbol in symbols],
+        }
+        prices = prices or {}
+        columns["prices"] = {"symbol": self._ids(prices), "price": list(prices.values())}
+
+        accounts, position_symbols, quantities, position_prices = [], [], [], []
+        for account, book in positions.items():
+            if isinstance(book, Portfolio):
+                book_symbols, book_quantities, book_prices = book.symbols, book.quantities, book.prices
+            else:
+                book_symbols = list(book)
+                book_quantities = [book[symbol][0] for symbol in book_symbols]
+                book_prices = [book[symbol][1] for symbol in book_symbols]
+            accounts.append(np.full(len(book_symbols), self.string_id(account), dtype=np.int32))
+            position_symbols.append(self._ids(book_symbols))
+            quantities.append(np.asarray(book_quantities, dtype=np.int64))
+            position_prices.append(np.asarray(book_prices, dtype=np.float64))
+        columns["positions"] = {"account": accounts, "symbol": position_symbols, "quantity": quantities,
+                                "price": position_prices}
+
+        order_rows = [(account, symbol, shares if action == "BUY" else -shares)
+                      for account, account_orders in (orders or {}).items() for symbol, action, shares in account_orders]
+        columns["orders"] = {
+            "account": self._ids(account for account, _symbol, _quantity in order_rows),
+            "symbol": self._ids(symbol for _account, symbol, _quantity in order_rows),
+            "quantity": [quantity for _account, _symbol, quantity in order_rows],
+        }
+
+        # New strings go to the dictionary before the run that references them becomes visible
+        if self._new_strings:
+            with open(os.path.join(self.path, STRINGS_FILE), "ab") as f:
+                f.write("".join(f"{string}\n" for string in self._new_strings).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                self._strings_read = f.tell()
+            self._new_strings = []
+
+        tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.path)
+        try:
+            for table, dtypes in TABLES.items():
+                for column, dtype in dtypes.items():
+                    values = columns[table][column]
+                    if isinstance(values, list) and values and isinstance(values[0], np.ndarray):
+                        values = np.concatenate(values)
+                    np.save(os.path.join(tmp_path, f"{table}.{column}.npy"), np.asarray(values, dtype=dtype))
+            with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                json.dump({"run_id": run_id, "time": time.time(), **meta}, f)
+            os.rename(tmp_path, self.run_path(run_id))
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return run_id
+
+    def unchanged(self, watchlist: Dict[str, Dict[str, Any]], targets: Mapping[str, float],
+                  quantities: Mapping[str, int], fresh_prices: Mapping[str, float],
+                  threshold: float = DRIFT_THRESHOLD, max_age: float = SKIP_MAX_AGE) -> Optional[str]:
+        """
+        Checks whether a rebalance can be skipped without pricing the positions: the
+        ratings must match the latest priced run, that run may be at most `max_age`
+        old, and no allocation may have drifted from its target by more than the
+        threshold. Allocations are computed from the current quantities, with
+        `fresh_prices` where available and the latest priced run's prices otherwise.
+        Skipped runs are passed over, so their age does not extend how long old prices
+        are trusted.
+
+        Args:
+            watchlist (dict): The freshly fetched, filtered watchlist
+            targets (Mapping): The target allocation percentages for the watchlist
+            quantities (Mapping): The current position quantities
+            fresh_prices (Mapping): Prices known to be current, e.g. from the price cache
+            threshold (float): Allocation drift, in percentage points, that requires a rebalance
+            max_age (float): Seconds after the latest priced run from which a rebalance must run
+
+        Returns:
+            str: Why the rebalance can be skipped, or None if it must run
+        """
+        latest = self.latest_priced(max_age)
+        if latest is None:
+            return None
+        if latest.ratings() != {symbol: details["rating_id"] for symbol, details in watchlist.items()}:
+            return None
+
+        prices = latest.prices()
+        prices.update(fresh_prices)
+        if any(symbol not in prices for symbol, quantity in quantities.items() if quantity):
+            return None
+        book = Portfolio.from_positions((symbol, quantity, prices.get(symbol, 0.0))
+                                        for symbol, quantity in quantities.items())
+        if book.total_market_value <= 0:
+            return None
+        allocations = dict(zip(book.symbols, book.allocations().tolist()))
+        drift = max((abs(allocations.get(symbol, 0.0) - targets.get(symbol, 0.0))
+                     for symbol in set(allocations) | set(targets)), default=0.0)
+        if drift > threshold:
+            return None
+        return f"ratings unchanged since run {latest.run_id} and largest drift {drift:.2f} points"
+
+
+def create_default_store() -> Optional[SnapshotStore]:
+    """
+    Creates a SnapshotStore in the SNAPSHOT_DIR directory.
+
+    Returns:
+        SnapshotStore: The store, or None when SNAPSHOT_DIR is not set
+    """
+    path = os.environ.get("SNAPSHOT_DIR")
+    return SnapshotStore(path) if path else None
@@ -0,0 +1,268 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TextIO, Tuple, TypeVar
+
+METRIC_PREFIX = "ib_trade_helper_"
+STAGE_DURATION_METRIC = "stage_duration_seconds"
+
+F = TypeVar("F", bound=Callable[..., Any])
+_MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Telemetry:
+    """
+    Process-wide telemetry state: the JSON lines sink, the Prometheus textfile
+    path, and the counters and summaries accumulated since startup.
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.jsonl: Optional[TextIO] = None
+        self.prom_path: Optional[str] = None
+        self.counters: Dict[_MetricKey, float] = {}
+        self.summaries: Dict[_MetricKey, list] = {}  # key: [count, sum]
+        self.lock = threading.Lock()
+
+
+_state = _Telemetry()
+
+
+def configure(jsonl_path: Optional[str] = None, prom_path: Optional[str] = None) -> None:
+    """
+    Enables telemetry when at least one export path is given, and disables it otherwise.
+
+    Args:
+        jsonl_path (str, optional): File that spans and events are appended to, one JSON object per line
+        prom_path (str, optional): Prometheus textfile collector file the metrics are written to on `flush`
+    """
+    flush()
+    with _state.lock:
+        if _state.jsonl is not None:
+            _state.jsonl.close()
+        _state.jsonl = open(jsonl_path, "a", buffering=1 << 16) if jsonl_path else None
+        _state.prom_path = prom_path
+        _state.enabled = bool(jsonl_path or prom_path)
+
+
+def configure_from_env() -> None:
+    """
+    Configures telemetry from the TELEMETRY_JSONL and TELEMETRY_PROM environment
+    variables. Telemetry stays disabled when neither is set.
+    """
+    configure(os.environ.get("TELEMETRY_JSONL") or None, os.environ.get("TELEMETRY_PROM") or None)
+
+
+def enabled() -> bool:
+    return _state.enabled
+
+
+def _key(name: str, labels: Dict[str, Any]) -> _MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _write(record: Dict[str, Any]) -> None:
+    line = json.dumps(record, default=str)
+    with _state.lock:
+        if _state.jsonl is not None:
+            _state.jsonl.write(line + "\n")
+
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    """
+    Increments a counter.
+
+    Args:
+        name (str): The metric name, without the prefix
+        value (float): The amount to add
+        **labels: Metric labels
+    """
+    if not _state.enabled:
+        return
+    key = _key(name, labels)
+    with _state.lock:
+        _state.counters[key] = _state.counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """
+    Adds an observation to a summary, exported as its count and sum.
+
+    Args:
+        name (str): The metric name, without the prefix
+        value (float): The observed value
+        **labels: Metric labels
+    """
+    if not _state.enabled:
+        return
+    key = _key(name, labels)
+    with _state.lock:
+        summary = _state.summaries.setdefault(key, [0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+
+
+def event(name: str, **attributes: Any) -> None:
+    """
+    Appends a point-in-time event to the JSON lines log.
+
+    Args:
+        name (str): The event name
+        **attributes: Event attributes
+    """
+    if not _state.enabled:
+        return
+    _write({"type": "event", "name": name, "time": time.time(), "thread": threading.current_thread().name,
+            **attributes})
+
+
+class Span:
+    """
+    A timed section of work. On exit its duration is added to the stage duration
+    summary and the span is appended to the JSON lines log, with any error raised
+    inside it.
+    """
+
+    __slots__ = ("name", "attributes", "start_time", "_start")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = 0.0
+        self._start = 0.0
+
+    def set(self, **attributes: Any) -> None:
+        """
+        Adds attributes known only once the work is under way, e.g. result sizes.
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        duration = time.perf_counter() - self._start
+        observe(STAGE_DURATION_METRIC, duration, stage=self.name)
+        record = {"type": "span", "name": self.name, "start": self.start_time, "duration_s": duration,
+                  "thread": threading.current_thread().name, **self.attributes}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+            count("stage_errors_total", stage=self.name, error=exc_type.__name__)
+        _write(record)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes: Any):
+    """
+    Times a block of work:
+
+        with telemetry.span("price_fetch", symbols=len(symbols)) as s:
+            ...
+            s.set(fetched=len(prices))
+
+    When telemetry is disabled a shared no-op span is returned, so an
+    instrumented block costs one function call.
+
+    Args:
+        name (str): The stage name
+        **attributes: Span attributes
+
+    Returns:
+        Span: A context manager for the span
+    """
+    if not _state.enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """
+    Decorator that runs every call of the function inside a span.
+
+    Args:
+        name (str): The stage name
+    """
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+    label_text = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+    return f"{METRIC_PREFIX}{name}{{{label_text}}} {value!r}" if labels else f"{METRIC_PREFIX}{name} {value!r}"
+
+
+def render_prometheus() -> str:
+    """
+    Returns:
+        str: All counters and summaries in the Prometheus text exposition format
+    """
+    with _state.lock:
+        counters = sorted(_state.counters.items())
+        summaries = sorted((key, tuple(value)) for key, value in _state.summaries.items())
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+        lines.append(_series(name, labels, float(value)))
+    for (name, labels), (observations, total) in summaries:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} summary")
+        lines.append(_series(f"{name}_count", labels, float(observations)))
+        lines.append(_series(f"{name}_sum", labels, float(total)))
+    return "\n".join(lines) + "\n"
+
+
+def flush() -> None:
+    """
+    Flushes the JSON lines log and rewrites the Prometheus textfile. The textfile is
+    replaced atomically so that a collector never reads a partial file.
+    """
+    if not _state.enabled:
+        return
+    with _state.lock:
+        if _state.jsonl is not None:
+            _state.jsonl.flush()
+        prom_path = _state.prom_path
+    if prom_path:
+        tmp_path = f"{prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, prom_path)
+
+
+configure_from_env()
+atexit.register(flush)
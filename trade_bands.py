@@ -0,0 +1,141 @@
+import os
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+
+class TradeBands:
+    """
+    Tolerance bands applied to generated rebalance orders.
+
+    Orders are first netted: the orders for a symbol are combined into one, less the
+    shares still to be filled by orders of an earlier run that are working in the
+    same account, so a rebalance started before those orders completed does not
+    trade the same shares twice. An order netted down to nothing is dropped.
+
+    Then an order for a symbol in the desired allocation is dropped when the symbol's
+    current allocation is already close enough to its target, when its notional is
+    below a minimum, or when rounding it down to whole lots leaves nothing to trade.
+    Orders that close a position outside the desired allocation are always kept.
+    """
+
+    def __init__(self, abs_drift: float = 0.0, rel_drift: float = 0.0, min_notional: float = 0.0, lot_size: int = 1):
+        """
+        Args:
+            abs_drift (float): Skip symbols whose allocation is within this many percentage points of the target
+            rel_drift (float): Skip symbols whose allocation is within this fraction of the target (0.1 = 10%)
+            min_notional (float): Skip orders worth less than this amount
+            lot_size (int): Round order sizes down to a multiple of this many shares
+        """
+        self.abs_drift = abs_drift
+        self.rel_drift = rel_drift
+        self.min_notional = min_notional
+        self.lot_size = max(1, lot_size)
+        self.suppressed_orders: int = 0
+        self.suppressed_notional: float = 0.0
+        self.netted_orders: int = 0
+        self.netted_notional: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "TradeBands":
+        """
+        Creates TradeBands from the TRADE_BAND_ABS, TRADE_BAND_REL, TRADE_MIN_NOTIONAL
+        and TRADE_LOT_SIZE environment variables. Unset variables disable that band.
+
+        Returns:
+            TradeBands: The configured bands
+        """
+        return cls(
+            abs_drift=float(os.environ.get("TRADE_BAND_ABS", 0.0)),
+            rel_drift=float(os.environ.get("TRADE_BAND_REL", 0.0)),
+            min_notional=float(os.environ.get("TRADE_MIN_NOTIONAL", 0.0)),
+            lot_size=int(os.environ.get("TRADE_LOT_SIZE", 1)),
+        )
+
+    def within_band(self, current_pct: float, target_pct: float) -> bool:
+        """
+        Args:
+            current_pct (float): The symbol's current allocation percentage
+            target_pct (float): The symbol's target allocation percentage
+
+        Returns:
+            bool: True if the allocation is close enough to the target that no trade is needed
+        """
+        drift = abs(current_pct - target_pct)
+        if self.abs_drift > 0 and drift <= self.abs_drift:
+            return True
+        return self.rel_drift > 0 and target_pct > 0 and drift <= self.rel_drift * target_pct
+
+    def net(self, orders: List[Tuple[str, str, int]], working: Mapping[str, int],
+            prices: Dict[str, float]) -> List[Tuple[str, str, int]]:
+        """
+        Combines the orders for each symbol into one and subtracts the working shares,
+        adding the orders and notional this saved to the netting counters. Working
+        orders for symbols without a new order are left alone.
+
+        Args:
+            orders (list): (symbol, action, shares) orders as generated for the account
+            working (Mapping): Symbol mapped to the signed shares still to be filled by
+                               working orders, positive for buys
+            prices (dict): Price per symbol in `orders`
+
+        Returns:
+            list: One order per symbol that still needs trading, in first-seen order
+        """
+        wanted: Dict[str, int] = {}
+        for symbol, action, shares in orders:
+            wanted[symbol] = wanted.get(symbol, 0) + (shares if action == "BUY" else -shares)
+
+        netted = []
+        for symbol, quantity in wanted.items():
+            net_quantity = quantity - working.get(symbol, 0)
+            self.netted_notional += max(0, abs(quantity) - abs(net_quantity)) * prices[symbol]
+            if net_quantity:
+                netted.append((symbol, "BUY" if net_quantity > 0 else "SELL", abs(net_quantity)))
+        self.netted_orders += len(orders) - len(netted)
+        return netted
+
+    def apply(self, orders: List[Tuple[str, str, int]], desired_alloc: Dict[str, float],
+              current_values: Dict[str, float], prices: Dict[str, float],
+              total_value: float, working: Optional[Mapping[str, int]] = None) -> List[Tuple[str, str, int]]:
+        """
+        Nets, filters and rounds orders, adding what was dropped to the netting and
+        suppression counters.
+
+        Args:
+            orders (list): (symbol, action, shares) orders as generated for the account
+            desired_alloc (dict): Target allocation percentage per symbol
+            current_values (dict): Current market value per held symbol
+            prices (dict): Price per symbol in `orders`
+            total_value (float): Total market value of the account
+            working (Mapping, optional): Symbol mapped to the signed unfilled shares of the
+                                         account's working orders, see `OrderTracker.working`
+
+        Returns:
+            list: The orders that should be placed
+        """
+        kept = []
+        for symbol, action, shares in self.net(orders, working or {}, prices):
+            price = prices[symbol]
+            if symbol in desired_alloc:
+                current_pct = current_values.get(symbol, 0.0) / total_value * 100 if total_value else 0.0
+                rounded = shares - shares % self.lot_size
+                if (self.within_band(current_pct, desired_alloc[symbol]) or rounded == 0
+                        or rounded * price < self.min_notional):
+                    self.suppressed_orders += 1
+                    self.suppressed_notional += shares * price
+                    continue
+                if rounded != shares:
+                    self.suppressed_notional += (shares - rounded) * price
+                    shares = rounded
+            kept.append((symbol, action, shares))
+        return kept
+
+    def report(self) -> None:
+        """
+        Logs how many orders and how much notional netting and the bands suppressed.
+        """
+        logger.info("Trade bands suppressed %s orders (%.2f notional), and netted away %s orders (%.2f notional)",
+                    self.suppressed_orders, self.suppressed_notional, self.netted_orders, self.netted_notional)
@@ -1,11 +1,49 @@
+import itertools
+import logging
+import os
 import threading
 import time
-from typing import Dict, List, Any, Optional, Callable, Tuple
+from typing import Dict, List, Any, Optional, Callable, Tuple, TypeVar, Iterable, Mapping
 
+import numpy as np
 from ibapi.client import *
+from ibapi.ticktype import TickTypeEnum
 from ibapi.wrapper import *
 
-from yahoo_finance import get_price
+import telemetry
+from logs import Lazy, get_logger
+from order_tracker import OrderTracker
+from portfolio import Portfolio
+from orders import create_stock_contract
+from pricing import PriceProvider, Prices, ProviderUnavailableError, UnpricedPositionsError, YahooPriceProvider, get_prices
+from rate_limit import TokenBucket
+from rebalance_engine import share_deltas
+from trade_bands import TradeBands
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7496
+DEFAULT_CLIENT_ID = 0
+CONNECT_TIMEOUT = 5  # seconds
+ACCOUNT_POSITIONS_TIMEOUT = 30  # seconds
+OPEN_ORDERS_TIMEOUT = 10  # seconds
+THREAD_JOIN_TIMEOUT = 5  # seconds
+
+# IB allows at most 50 messages per second from a client; stay safely below it
+IB_MESSAGES_PER_SECOND = 40
+REQ_ID_START = 10_000_000  # Keep market data and position request ids clear of order ids
+SNAPSHOT_TIMEOUT = 12  # seconds, IB completes snapshots within 11 seconds
+MAX_SNAPSHOTS_IN_FLIGHT = 90  # Stay below the default 100 market data lines
+DELAYED_MARKET_DATA = 3  # Returns live data when subscribed, delayed data otherwise
+# Tick types to take a snapshot price from, in order of preference
+SNAPSHOT_PRICE_TICKS = (TickTypeEnum.LAST, TickTypeEnum.DELAYED_LAST, TickTypeEnum.CLOSE, TickTypeEnum.DELAYED_CLOSE)
+SNAPSHOT_QUOTE_TICKS = ((TickTypeEnum.BID, TickTypeEnum.ASK), (TickTypeEnum.DELAYED_BID, TickTypeEnum.DELAYED_ASK))
+STREAM_PRICE_TICKS = (TickTypeEnum.LAST, TickTypeEnum.DELAYED_LAST)
+NON_FATAL_MARKET_DATA_ERRORS = {10167}  # "Displaying delayed market data"
+NOTICE_ERROR_CODES = range(2100, 2200)  # TWS warnings and notices, e.g. "Market data farm connection is OK"
+
+T = TypeVar("T")
+
+logger = get_logger(__name__)
 
 
 class IBApp(EClient, EWrapper):
@@ -24,13 +62,32 @@ class IBApp(EClient, EWrapper):
         """
         EClient.__init__(self, self)
         self.orderId: Optional[int] = None
-        self.positions_map: Dict[str, Tuple[int, float, float, float]] = {}  # symbol: (quantity, price, market_value, allocation%)
+        self.ready: threading.Event = threading.Event()  # Set once nextValidId has been received
+        self.api_thread: Optional[threading.Thread] = None
+        self.snapshots: Dict[int, Tuple[str, Dict[int, float], threading.Event]] = {}  # reqId: (symbol, ticks, done)
+        self.price_streams: Dict[int, Tuple[str, Callable[[str, float], None]]] = {}  # reqId: (symbol, callback)
+        self.portfolio_callback: Optional[Callable[[str, str, int, float], None]] = None  # (account, symbol, qty, price)
+        self._req_ids = itertools.count(REQ_ID_START)
+        # Pacing limiter shared by everything that sends bursts of messages on this connection
+        self.limiter: TokenBucket = TokenBucket(IB_MESSAGES_PER_SECOND)
+        self.positions_map: Portfolio = Portfolio()  # symbol: (quantity, price, market_value, allocation%)
         self.orders: List[Tuple[str, str, int]] = []  # List of (symbol, action, shares)
         self.total_market_value: float = 0
+        self.received_positions: Dict[str, Tuple[int, Contract]] = {}  # symbol: (quantity, contract)
         self.position_callback: Optional[Callable[[Dict[str, Any]], None]] = None
-        self.orders_completed: threading.Event = threading.Event()
-        self.order_count: int = 0
-        self.completed_orders: int = 0
+        self._price_received_positions: bool = True
+        self.positions_done: threading.Event = threading.Event()  # Set once a get_my_positions request completed or failed
+        self.positions_error: Optional[Exception] = None  # Why the last get_my_positions request failed
+        self.order_tracker: OrderTracker = OrderTracker()
+        self.open_orders_done: threading.Event = threading.Event()  # Set once TWS finished listing the open orders
+        self.managed_accounts: List[str] = []
+        # Per-account position books for multi-account mode
+        self.account_positions: Dict[str, Portfolio] = {}
+        self._account_requests: Dict[int, Tuple[str, Dict[str, Tuple[int, Contract]], threading.Event]] = {}  # reqId: (account, positions, done)
+        self._failed_account_requests: set = set()
+        # Provider for this connection's price lookups; None uses the process-wide default
+        self.price_provider: Optional[PriceProvider] = None
+        self.unpriced_symbols: set = set()  # Symbols the last pricing or order generation had no price for
 
     def nextValidId(self, order_id: int) -> None:
         """
@@ -41,6 +98,13 @@ class IBApp(EClient, EWrapper):
             order_id (int): The next valid order ID from TWS
         """
         self.orderId = order_id - 1  # Subtract 1 since nextId will increment it
+        self.ready.set()
+
+    def connectionClosed(self) -> None:
+        """
+        Callback that is called when the connection to TWS is closed.
+        """
+        self.ready.clear()
 
     def nextId(self) -> int:
         """
@@ -67,12 +131,136 @@ class IBApp(EClient, EWrapper):
             error_string (str): The error description
             advanced_order_reject (str, optional): Advanced order rejection reason
         """
-        print(
-            f"reqId: {req_id}, errorCode: {error_code}, errorString: {error_string}, orderReject: {advanced_order_reject}")
+        logger.log(logging.WARNING if error_code in NOTICE_ERROR_CODES else logging.ERROR,
+                   "reqId: %s, errorCode: %s, errorString: %s, orderReject: %s",
+                   req_id, error_code, error_string, advanced_order_reject)
+        telemetry.count("tws_errors_total", code=error_code)
+        snapshot = self.snapshots.get(req_id)
+        if snapshot and error_code not in NON_FATAL_MARKET_DATA_ERRORS:
+            # No data will arrive for this snapshot (e.g. no market data subscription)
+            snapshot[2].set()
+        account_request = self._account_requests.get(req_id)
+        if account_request:
+            # The account's positions will not arrive, e.g. because the account is invalid
+            self._failed_account_requests.add(req_id)
+            account_request[2].set()
+
+    def request_snapshot(self, contract: Contract) -> Tuple[int, threading.Event]:
+        """
+        Request a market data snapshot for a contract.
+
+        Args:
+            contract (Contract): The contract to price
+
+        Returns:
+            tuple: The request id and an event that is set once the snapshot is complete or failed
+        """
+        req_id = next(self._req_ids)
+        done = threading.Event()
+        self.snapshots[req_id] = (contract.symbol, {}, done)
+        self.reqMktData(req_id, contract, "", True, False, [])
+        return req_id, done
+
+    def pop_snapshot(self, req_id: int) -> Optional[float]:
+        """
+        Remove a snapshot request and return the price it produced.
+
+        Args:
+            req_id (int): The request id returned by `request_snapshot`
+
+        Returns:
+            float: The last (or close, or bid/ask midpoint) price, or None if no price was received
+        """
+        _symbol, ticks, _done = self.snapshots.pop(req_id)
+        for tick_type in SNAPSHOT_PRICE_TICKS:
+            if tick_type in ticks:
+                return ticks[tick_type]
+        for bid_tick, ask_tick in SNAPSHOT_QUOTE_TICKS:
+            if bid_tick in ticks and ask_tick in ticks:
+                return (ticks[bid_tick] + ticks[ask_tick]) / 2
+        return None
+
+    def subscribe_market_data(self, contract: Contract, callback: Callable[[str, float], None]) -> int:
+        """
+        Start streaming last prices for a contract.
+
+        Args:
+            contract (Contract): The contract to stream
+            callback (callable): Called with (symbol, price) on every last-price tick
+
+        Returns:
+            int: The request id, to pass to `unsubscribe_market_data`
+        """
+        req_id = next(self._req_ids)
+        self.price_streams[req_id] = (contract.symbol, callback)
+        self.reqMktData(req_id, contract, "", False, False, [])
+        return req_id
+
+    def unsubscribe_market_data(self, req_id: int) -> None:
+        """
+        Stop a price stream started with `subscribe_market_data`.
+
+        Args:
+            req_id (int): The request id returned by `subscribe_market_data`
+        """
+        if self.price_streams.pop(req_id, None):
+            self.cancelMktData(req_id)
+
+    def tickPrice(self, req_id: int, tick_type: int, price: float, _attrib: TickAttrib) -> None:
+        """
+        Market data callback with a price tick for a snapshot request or a price stream.
+
+        Args:
+            req_id (int): The market data request ID
+            tick_type (int): The tick type
+            price (float): The price, or -1 if not available
+            _attrib (TickAttrib): The tick attributes
+        """
+        if price <= 0:
+            return
+        snapshot = self.snapshots.get(req_id)
+        if snapshot:
+            snapshot[1][tick_type] = price
+            return
+        stream = self.price_streams.get(req_id)
+        if stream and tick_type in STREAM_PRICE_TICKS:
+            stream[1](stream[0], price)
+
+    def updatePortfolio(self, contract: Contract, position: float, market_price: float, _market_value: float,
+                        _average_cost: float, _unrealized_pnl: float, _realized_pnl: float, account_name: str) -> None:
+        """
+        Portfolio callback for a reqAccountUpdates subscription, called whenever a
+        held position or its price changes.
+
+        Args:
+            contract (Contract): The contract object
+            position (float): The position size
+            market_price (float): The current price of the contract
+            _market_value (float): The current market value of the position
+            _average_cost (float): The average cost of the position
+            _unrealized_pnl (float): The unrealized profit and loss
+            _realized_pnl (float): The realized profit and loss
+            account_name (str): The account name
+        """
+        if self.portfolio_callback:
+            self.portfolio_callback(account_name, contract.symbol, int(position), market_price)
+
+    def tickSnapshotEnd(self, req_id: int) -> None:
+        """
+        Called when all the data of a snapshot request has been received.
+
+        Args:
+            req_id (int): The market data request ID
+        """
+        snapshot = self.snapshots.get(req_id)
+        if snapshot:
+            snapshot[2].set()
 
     def position(self, account: str, contract: Contract, position: float, _avg_cost: float) -> None:
         """
         Position callback method that is called with the current position for a contract.
+        Only the quantity and contract are recorded here; pricing happens after positionEnd
+        so that the message-processing thread is never blocked on network I/O.
 
         Args:
             account (str): The account name
@@ -80,40 +268,273 @@ class IBApp(EClient, EWrapper):
             position (float): The position size
             _avg_cost (float): The average cost of the position
         """
-        symbol = contract.symbol
-        price = get_price(symbol)
-        market_value = price * int(position)
-        # Initialize with 0% allocation - will be updated in positionEnd
-        self.positions_map[symbol] = (int(position), price, market_value, 0.0)
+        self.received_positions[contract.symbol] = (int(position), contract)
 
     def positionEnd(self) -> None:
         """
-        Called when all position data has been received. This method calculates the
-        total market value of all positions and the allocation percentage for each
-        position. It also triggers the position callback if it has been set.
+        Called when all position data has been received. The received positions are
+        priced on a separate thread so that other TWS messages keep flowing while the
+        price requests are in flight. When pricing was not requested, the position
+        callback gets the received quantities instead. Either way `positions_done` is
+        set at the end, with the error in `positions_error` if pricing failed.
+        """
+        if not self._price_received_positions:
+            try:
+                if self.position_callback:
+                    self.position_callback({symbol: position for symbol, (position, _contract)
+                                            in self.received_positions.items()})
+            finally:
+                self.positions_done.set()
+            return
+        threading.Thread(target=self._price_positions_in_background, name="position-pricing", daemon=True).start()
+
+    def _price_positions_in_background(self) -> None:
+        try:
+            self.price_positions()
+        except Exception as e:
+            # Keep the error for the waiting caller instead of losing it with the thread
+            logger.error("Pricing the positions failed: %s", e, exc_info=True)
+            self.positions_error = e
+        finally:
+            self.positions_done.set()
+
+    def price_positions(self) -> None:
+        """
+        Prices all received positions concurrently, then calculates the total market
+        value of all positions and the allocation percentage for each position. It
+        also triggers the position callback if it has been set.
+
+        Raises:
+            UnpricedPositionsError: If a held position could not be priced
         """
-        self.total_market_value = sum(value[2] for value in self.positions_map.values())
-        print("Total Market Value:", self.total_market_value)
-        for symbol, (position, price, market_value, _allocation) in self.positions_map.items():
-            self.positions_map[symbol] = (position, price, market_value, market_value / self.total_market_value * 100)
-            print(
-                f"Symbol: {symbol}, Position: {position}, Current Price: {price}, Market Value: {price * int(position):.2f}, Allocation: {market_value / self.total_market_value * 100:.2f}%")
+        prices = get_prices(self.received_positions.keys(), provider=self.price_provider)
+        self._note_unpriced(prices.unpriced, "held")
+        self.positions_map = Portfolio.from_positions(
+            (symbol, position, prices.get(symbol, 0.0))
+            for symbol, (position, _contract) in self.received_positions.items())
+
+        self.total_market_value = self.positions_map.total_market_value
+        self._check_priced(self.positions_map)
+        logger.info("Total Market Value: %s", self.total_market_value)
+        if self.positions_map:
+            # One record for the whole book, rendered on the log writer thread
+            logger.info("%s", Lazy(format_positions, self.positions_map))
         if self.position_callback:
             self.position_callback(self.positions_map)
 
-    def get_my_positions(self, callback: Optional[Callable[[dict], None]] = None) -> None:
+    @staticmethod
+    def _check_priced(book: Mapping[str, tuple], account: str = "") -> None:
+        """
+        Refuses to go on with a partially valued book, e.g. when the pricing deadline
+        ran out: its total would be understated and every order sized from it wrong.
+
+        Args:
+            book (Mapping): The position book, symbol: (quantity, price, market_value, allocation%)
+            account (str): The book's account, for the error message
+
+        Raises:
+            UnpricedPositionsError: If a non-zero position in the book has no price
+        """
+        unpriced = [symbol for symbol, (quantity, price, *_rest) in book.items() if quantity and not price > 0]
+        if unpriced:
+            raise UnpricedPositionsError(unpriced, account)
+
+    def _note_unpriced(self, symbols: Iterable[str], what: str) -> None:
+        """
+        Records symbols that could not be priced and logs them once. Held symbols stop
+        the rebalance (see `_check_priced`); desired symbols are not traded.
+
+        Args:
+            symbols (iterable): The unpriced symbols
+            what (str): "held" when pricing positions, which starts a new set, or "desired"
+        """
+        symbols = sorted(set(symbols))
+        if what == "held":
+            self.unpriced_symbols = set()
+        self.unpriced_symbols.update(symbols)
+        if symbols:
+            logger.warning("No price for %s %s symbols: %s", len(symbols), what, symbols)
+
+    def managedAccounts(self, accounts_list: str) -> None:
+        """
+        Callback with the comma-separated list of accounts this login can trade.
+        This is called automatically when the connection is established.
+
+        Args:
+            accounts_list (str): The managed accounts
+        """
+        self.managed_accounts = [account for account in accounts_list.split(",") if account]
+
+    def positionMulti(self, req_id: int, account: str, _model_code: str, contract: Contract, pos: float,
+                      _avg_cost: float) -> None:
+        """
+        Position callback for a per-account positions request.
+
+        Args:
+            req_id (int): The request ID
+            account (str): The account name
+            _model_code (str): The model code
+            contract (Contract): The contract object
+            pos (float): The position size
+            _avg_cost (float): The average cost of the position
+        """
+        request = self._account_requests.get(req_id)
+        if request:
+            request[1][contract.symbol] = (int(pos), contract)
+
+    def positionMultiEnd(self, req_id: int) -> None:
+        """
+        Called when all positions of a per-account positions request have been received.
+
+        Args:
+            req_id (int): The request ID
+        """
+        request = self._account_requests.get(req_id)
+        if request:
+            request[2].set()
+
+    def get_account_positions(self, accounts: Optional[List[str]] = None,
+                              timeout: float = ACCOUNT_POSITIONS_TIMEOUT) -> Dict[str, Portfolio]:
+        """
+        Request the positions of several accounts with one reqPositionsMulti request
+        per account, then price the union of all held symbols in one batch and build
+        a separate position book and total market value for each account.
+
+        Args:
+            accounts (list, optional): The accounts to load. Defaults to all managed accounts
+            timeout (float): Seconds to wait for all accounts to report their positions
+
+        Returns:
+            dict: Each account mapped to its Portfolio
+
+        Raises:
+            RuntimeError: If an account's positions are rejected or not reported in time
+            UnpricedPositionsError: If a held position could not be priced
+        """
+        accounts = accounts or self.managed_accounts
+        self.account_positions = {}
+        requests = {}
+        for account in accounts:
+            req_id = next(self._req_ids)
+            requests[req_id] = self._account_requests[req_id] = (account, {}, threading.Event())
+            self.limiter.acquire()
+            self.reqPositionsMulti(req_id, account, "")
+
+        deadline = time.monotonic() + timeout
+        try:
+            for req_id, (account, _positions, done) in requests.items():
+                if not done.wait(max(0.0, deadline - time.monotonic())):
+                    raise RuntimeError(f"Timed out waiting for positions of account {account}")
+                if req_id in self._failed_account_requests:
+                    raise RuntimeError(f"TWS rejected the positions request for account {account}")
+        finally:
+            for req_id in requests:
+                self._account_requests.pop(req_id, None)
+                self._failed_account_requests.discard(req_id)
+                self.limiter.acquire()
+                self.cancelPositionsMulti(req_id)
+
+        prices = get_prices((symbol for _account, positions, _done in requests.values() for symbol in positions),
+                            provider=self.price_provider)
+        self._note_unpriced(prices.unpriced, "held")
+        for account, positions, _done in requests.values():
+            book = Portfolio.from_positions(
+                (symbol, position, prices.get(symbol, 0.0)) for symbol, (position, _contract) in positions.items())
+            self.account_positions[account] = book
+            logger.info("Account %s: %s positions, Total Market Value: %s", account, len(book), book.total_market_value)
+        for account in accounts:
+            self._check_priced(self.account_positions[account], account)
+        return {account: self.account_positions[account] for account in accounts}
+
+    def create_account_rebalance_orders(self, desired_alloc: Dict[str, float],
+                                        bands: Optional[TradeBands] = None) -> Dict[str, List[Tuple[str, str, int]]]:
+        """
+        Create rebalance orders for every account loaded by `get_account_positions`.
+        All accounts are sized in one vectorized pass over an accounts x symbols matrix.
+
+        Args:
+            desired_alloc (dict): A dictionary with symbols as keys and desired
+                                  allocation percentages as values
+            bands (TradeBands, optional): Tolerance bands that drop or round small orders
+
+        Returns:
+            dict: Each account mapped to its list of (symbol, action, shares) orders
+
+        Raises:
+            UnpricedPositionsError: If a held position has no price
+        """
+        accounts = list(self.account_positions)
+        books = [self.account_positions[account] for account in accounts]
+        for account, book in zip(accounts, books):
+            self._check_priced(book, account)
+
+        # Use each symbol's held price if any account holds it, and price the rest in one batch
+        prices: Dict[str, float] = {}
+        for book in books:
+            for symbol, price in zip(book.symbols, book.prices.tolist()):
+                if price > 0:
+                    prices.setdefault(symbol, price)
+        fetched = get_prices((symbol for symbol in desired_alloc if symbol not in prices),
+                             provider=self.price_provider)
+        prices.update(fetched)
+
+        # Desired symbols without a price cannot be sized and are left alone
+        unpriced = [symbol for symbol in desired_alloc if symbol not in prices]
+        self._note_unpriced(unpriced, "desired")
+        if unpriced:
+            desired_alloc = {symbol: pct for symbol, pct in desired_alloc.items() if symbol in prices}
+
+        # Columns: the desired symbols, then every held symbol outside the desired allocation.
+        # Closing a position sells its whole quantity, so its price is not needed
+        closing_symbols = list(dict.fromkeys(
+            symbol for book in books for symbol in book if symbol not in desired_alloc and symbol not in unpriced))
+        universe = list(desired_alloc) + closing_symbols
+
+        quantities = np.zeros((len(accounts), len(universe)), dtype=np.int64)
+        column = {symbol: i for i, symbol in enumerate(universe)}
+        for row, book in enumerate(books):
+            quantities[row, [column[symbol] for symbol in book.symbols]] = book.quantities
+        targets = np.concatenate([np.fromiter(desired_alloc.values(), dtype=np.float64, count=len(desired_alloc)),
+                                  np.full(len(closing_symbols), np.nan)])
+        totals = np.array([book.total_market_value for book in books], dtype=np.float64)
+
+        deltas = share_deltas(targets, np.array([prices.get(symbol, 0.0) for symbol in universe]), quantities, totals)
+        account_orders = {}
+        for account, account_deltas in zip(accounts, deltas):
+            account_orders[account] = [
+                (universe[i], "BUY" if account_deltas[i] > 0 else "SELL", abs(int(account_deltas[i])))
+                for i in np.flatnonzero(account_deltas)
+            ]
+            if bands is not None:
+                book = self.account_positions[account]
+                current_values = dict(zip(book.symbols, book.market_values.tolist()))
+                account_orders[account] = bands.apply(account_orders[account], desired_alloc, current_values, prices,
+                                                      book.total_market_value, self.order_tracker.working(account))
+            logger.info("Generated Rebalance Orders for %s: %s", account, account_orders[account])
+        return account_orders
+
+    def get_my_positions(self, callback: Optional[Callable[[dict], None]] = None, price: bool = True) -> None:
         """
         Request the current positions for the account. The results will be sent to
-        the position callback method.
+        the position callback method, and `positions_done` is set once the request
+        completed or failed.
 
         Args:
             callback (callable, optional): A callback method that will be called with
                                             the positions data
+            price (bool): Whether to price the positions and build positions_map. When False
+                          the callback gets symbol: quantity, and `price_positions` can be
+                          called later
         """
         self.position_callback = callback
+        self._price_received_positions = price
+        self.received_positions = {}
+        self.positions_error = None
+        self.positions_done.clear()
         self.reqPositions()
 
-    def create_rebalance_orders(self, desired_alloc: Dict[str, float]) -> List[Tuple[str, str, int]]:
+    def create_rebalance_orders(self, desired_alloc: Dict[str, float],
+                                bands: Optional[TradeBands] = None) -> List[Tuple[str, str, int]]:
         """
         Create rebalance orders based on the difference between current and desired
         allocation percentages.
@@ -121,16 +542,32 @@ class IBApp(EClient, EWrapper):
         Args:
             desired_alloc (dict): A dictionary with symbols as keys and desired
                                   allocation percentages as values
+            bands (TradeBands, optional): Tolerance bands that drop or round small orders
 
         Returns:
             List: A list of orders to be executed for rebalancing
+
+        Raises:
+            UnpricedPositionsError: If a held position has no price
         """
         # Get current allocations
         current_alloc = self.positions_map
+        self._check_priced(current_alloc)
+
+        # Price every symbol we do not already hold in one batch instead of one request per symbol
+        new_symbols = [symbol for symbol in desired_alloc if symbol not in current_alloc]
+        new_prices = get_prices(new_symbols, provider=self.price_provider)
+
+        # Symbols without a price (unpriceable, or a zero position valued at 0) cannot be sized and are left alone
+        unpriced = set(new_prices.unpriced)
+        unpriced.update(symbol for symbol in desired_alloc if symbol in current_alloc and current_alloc[symbol][1] <= 0)
+        self._note_unpriced(unpriced, "desired")
 
         # Generate orders based on the difference
         self.orders = []
         for symbol, desired_pct in desired_alloc.items():
+            if symbol in unpriced:
+                continue
             desired_value = self.total_market_value * (desired_pct / 100)
 
             # Get current position details
@@ -143,7 +580,7 @@ class IBApp(EClient, EWrapper):
             if symbol in self.positions_map:
                 price = self.positions_map[symbol][1]
             else:
-                price = get_price(symbol)
+                price = new_prices[symbol]
             shares_to_trade = int(value_difference / price)
 
             # Generate buy/sell order if needed
@@ -158,10 +595,58 @@ class IBApp(EClient, EWrapper):
             if symbol not in desired_alloc and position > 0:
                 self.orders.append((symbol, "SELL", position))
 
-        print("Generated Rebalance Orders:", self.orders)
+        if bands is not None:
+            prices = {symbol: value[1] for symbol, value in current_alloc.items()}
+            prices.update(new_prices)
+            current_values = {symbol: value[2] for symbol, value in current_alloc.items()}
+            self.orders = bands.apply(self.orders, desired_alloc, current_values, prices, self.total_market_value,
+                                      self.order_tracker.working())
+
+        logger.info("Generated Rebalance Orders: %s", self.orders)
 
         return self.orders
 
+    def load_open_orders(self, timeout: float = OPEN_ORDERS_TIMEOUT) -> bool:
+        """
+        Requests the orders of this client ID that are still open in TWS and adds them
+        to `order_tracker`, so the orders of earlier runs are netted against like the
+        ones placed by this process. TWS also sends their order statuses, which record
+        how much of them has filled.
+
+        Args:
+            timeout (float): Seconds to wait for TWS to list the open orders
+
+        Returns:
+            bool: True if the list was complete in time
+        """
+        self.open_orders_done.clear()
+        self.limiter.acquire()
+        self.reqOpenOrders()
+        if not self.open_orders_done.wait(timeout):
+            logger.warning("TWS did not list the open orders within %ss, only netting against orders placed "
+                           "by this process", timeout)
+            return False
+        return True
+
+    def openOrder(self, order_id: int, contract: Contract, order: Order, _order_state: OrderState) -> None:
+        """
+        Callback with an open order, for every order listed by `load_open_orders` and
+        for every order placed.
+
+        Args:
+            order_id (int): The order ID
+            contract (Contract): The order's contract
+            order (Order): The order
+            _order_state (OrderState): The order's margin and commission state
+        """
+        self.order_tracker.opened(order_id, contract.symbol, order.action, int(order.totalQuantity), order.account)
+
+    def openOrderEnd(self) -> None:
+        """
+        Callback that ends the list of open orders requested by `load_open_orders`.
+        """
+        self.open_orders_done.set()
+
     def orderStatus(self, order_id: int, status: str, filled: float, remaining: float,
                    _avg_fill_price: float, _perm_id: str, _parent_id: str, _last_fill_price: float,
                    _client_id: int, _why_held: str, _mkt_cap_price: float) -> None:
@@ -181,59 +666,205 @@ class IBApp(EClient, EWrapper):
             _why_held (str): The reason the order is held in the market
             _mkt_cap_price (float): The market cap price
         """
-        print(f"Order {order_id} status: {status}, filled: {filled}")
-        if status in ["Filled", "Cancelled", "Inactive"]:
-            self.completed_orders += 1
-            if self.completed_orders >= self.order_count:
-                self.orders_completed.set()
+        if self.order_tracker.on_status(order_id, status, filled):
+            logger.info("Order %s status: %s, filled: %s", order_id, status, filled)
+
+
+def format_positions(positions_map: Portfolio) -> str:
+    """
+    Args:
+        positions_map (Portfolio): The position book
+
+    Returns:
+        str: One line per position with its quantity, price, market value and allocation
+    """
+    return "\n".join(
+        f"Symbol: {symbol}, Position: {position}, Current Price: {price}, Market Value: {market_value:.2f}, Allocation: {allocation:.2f}%"
+        for symbol, (position, price, market_value, allocation) in positions_map.items())
+
+
+class IBPriceProvider(PriceProvider):
+    """
+    Price provider backed by IB market data snapshots on a connected IBApp.
+
+    Snapshot requests for many contracts are sent at once, paced by a token bucket
+    that respects IB's messages-per-second limit, and multiplexed by request id.
+    Symbols IB cannot price (e.g. no market data subscription) are priced by the
+    fallback provider.
+    """
+
+    name = "ib"
+
+    def __init__(self, app: IBApp, fallback: Optional[PriceProvider] = None, limiter: Optional[TokenBucket] = None,
+                 timeout: float = SNAPSHOT_TIMEOUT, max_in_flight: int = MAX_SNAPSHOTS_IN_FLIGHT):
+        """
+        Args:
+            app (IBApp): A connected IBApp instance
+            fallback (PriceProvider, optional): Provider for symbols IB cannot price. Defaults to Yahoo Finance
+            limiter (TokenBucket, optional): Pacing limiter. Defaults to the app's shared limiter
+            timeout (float): Seconds to wait for a round of snapshots
+            max_in_flight (int): Maximum number of outstanding snapshot requests
+        """
+        self.app = app
+        self.fallback = fallback if fallback is not None else YahooPriceProvider()
+        self.limiter = limiter if limiter is not None else app.limiter
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.limiter.acquire()
+        self.app.reqMarketDataType(DELAYED_MARKET_DATA)
+
+    def get_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        unique_symbols = list(dict.fromkeys(symbols))
+        prices: Dict[str, float] = {}
+        for start in range(0, len(unique_symbols), self.max_in_flight):
+            requests = []
+            for symbol in unique_symbols[start:start + self.max_in_flight]:
+                self.limiter.acquire()
+                requests.append((symbol, *self.app.request_snapshot(create_stock_contract(symbol))))
+
+            deadline = time.monotonic() + self.timeout
+            for symbol, req_id, done in requests:
+                if not done.wait(max(0.0, deadline - time.monotonic())):
+                    self.limiter.acquire()
+                    self.app.cancelMktData(req_id)
+                price = self.app.pop_snapshot(req_id)
+                if price is not None:
+                    prices[symbol] = price
+
+        missing = [symbol for symbol in unique_symbols if symbol not in prices]
+        failed: Iterable[str] = ()
+        if missing:
+            logger.warning("No IB market data for %s, falling back to %s", missing, self.fallback.name)
+            try:
+                fallback_prices = self.fallback.get_prices(missing)
+            except ProviderUnavailableError as e:
+                e.prices = {**prices, **e.prices}
+                raise
+            prices.update(fallback_prices)
+            failed = getattr(fallback_prices, "failed", ())
+        return Prices(prices, failed=failed)
+
+
+class TWSConnection:
+    """
+    Manages the lifecycle of a TWS/IB Gateway session: connecting, waiting for the
+    handshake, and disconnecting with a clean join of the API thread.
 
-    def set_order_count(self, count: int) -> None:
+    The connection can be used as a context manager for one-shot jobs, or kept open
+    by a long-lived process that hands the same session to repeated jobs through
+    `run_job`, which reconnects only if the session was lost.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, client_id: Optional[int] = None,
+                 timeout: float = CONNECT_TIMEOUT):
+        """
+        Args:
+            host (str, optional): TWS host. Defaults to the TWS_HOST environment variable or 127.0.0.1
+            port (int, optional): TWS port. Defaults to the TWS_PORT environment variable or 7496
+            client_id (int, optional): API client id. Defaults to the TWS_CLIENT_ID environment variable or 0
+            timeout (float): Seconds to wait for the handshake to complete
+        """
+        self.host: str = host if host is not None else os.environ.get("TWS_HOST", DEFAULT_HOST)
+        self.port: int = port if port is not None else int(os.environ.get("TWS_PORT", DEFAULT_PORT))
+        self.client_id: int = client_id if client_id is not None else int(os.environ.get("TWS_CLIENT_ID", DEFAULT_CLIENT_ID))
+        self.timeout = timeout
+        self.app: Optional[IBApp] = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> IBApp:
+        """
+        Creates a new IBApp, connects it to TWS and waits for the nextValidId handshake.
+
+        Returns:
+            IBApp: A connected IBApp instance ready for trading
+
+        Raises:
+            RuntimeError: If connection fails or order ID is not initialized
         """
-        Set the expected number of orders to be completed. This is used to synchronize
-        the order processing.
+        app = IBApp()
+        app.connect(self.host, self.port, self.client_id)
+
+        # Start the client thread
+        app.api_thread = threading.Thread(target=app.run, name="ibapi-reader", daemon=True)
+        app.api_thread.start()
+
+        # nextValidId signals that the connection is ready
+        if not app.ready.wait(timeout=self.timeout):
+            disconnect_app(app)
+            raise RuntimeError("Failed to connect to TWS or receive initial order ID")
+
+        self.app = app
+        return app
+
+    def ensure_connected(self) -> IBApp:
+        """
+        Returns the current session, reconnecting first if it was never opened or has been lost.
+
+        Returns:
+            IBApp: A connected IBApp instance
+        """
+        with self._lock:
+            if self.app is None or not self.app.isConnected():
+                if self.app is not None:
+                    disconnect_app(self.app)
+                self.connect()
+            return self.app
+
+    def run_job(self, job: Callable[[IBApp], T]) -> T:
+        """
+        Runs a job against the persistent session, leaving the connection open afterwards.
 
         Args:
-            count (int): The number of orders expected
+            job (callable): A function that receives the connected IBApp
+
+        Returns:
+            The value returned by the job
+        """
+        return job(self.ensure_connected())
+
+    def disconnect(self) -> None:
         """
-        self.order_count = count
-        self.completed_orders = 0
-        self.orders_completed.clear()
+        Disconnects the session, if any, and joins its API thread.
+        """
+        with self._lock:
+            if self.app is not None:
+                disconnect_app(self.app)
+                self.app = None
+
+    def __enter__(self) -> IBApp:
+        return self.ensure_connected()
 
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.disconnect()
 
-def create_and_connect_app() -> IBApp:
+
+def create_and_connect_app(host: Optional[str] = None, port: Optional[int] = None,
+                           client_id: Optional[int] = None) -> IBApp:
     """
     Creates and connects a new IBApp instance to TWS/IB Gateway.
 
+    Args:
+        host (str, optional): TWS host, see `TWSConnection`
+        port (int, optional): TWS port, see `TWSConnection`
+        client_id (int, optional): API client id, see `TWSConnection`
+
     Returns:
         IBApp: A connected IBApp instance ready for trading
 
     Raises:
         RuntimeError: If connection fails or order ID is not initialized
     """
-    app = IBApp()
-    app.connect("127.0.0.1", 7496, 0)
-
-    # Start the client thread
-    api_thread = threading.Thread(target=app.run)
-    api_thread.start()
-
-    # Wait for connection and orderId initialization
-    timeout = 5  # seconds
-    start_time = time.time()
-    while app.orderId is None:
-        time.sleep(0.1)
-        if time.time() - start_time > timeout:
-            app.disconnect()
-            raise RuntimeError("Failed to connect to TWS or receive initial order ID")
-
-    return app
+    return TWSConnection(host, port, client_id).connect()
 
 
 def disconnect_app(app: IBApp) -> None:
     """
-    Safely disconnects an IBApp instance from TWS/IB Gateway.
+    Safely disconnects an IBApp instance from TWS/IB Gateway and waits for its
+    API thread to finish.
 
     Args:
         app (IBApp): The IBApp instance to disconnect
     """
     app.disconnect()
+    if app.api_thread is not None and app.api_thread is not threading.current_thread():
+        app.api_thread.join(timeout=THREAD_JOIN_TIMEOUT)
@@ -0,0 +1,471 @@
+import heapq
+import itertools
+import os
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ibapi.message import IN, OUT
+from ibapi.ticktype import TickTypeEnum
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7499  # Clear of the live (7496) and paper (7497) TWS ports
+DEFAULT_ACCOUNT = "DU0000001"
+# Highest protocol version the simulator speaks. Newer clients negotiate down to it,
+# which keeps every message in the plain text encoding decoded below.
+SERVER_VERSION = 157
+FIRST_ORDER_ID = 1
+SYMBOL_PREFIX = "SIM"
+PRICE_RANGE = (5.0, 500.0)
+QUANTITY_RANGE = (1, 500)
+
+# Message layouts at SERVER_VERSION, as field indices into the received message
+PLACE_ORDER_FIELDS = {"order_id": 1, "symbol": 3, "action": 16, "quantity": 17, "account": 23}
+MKT_DATA_FIELDS = {"req_id": 2, "symbol": 4, "snapshot": 17}
+
+NO_MARKET_DATA_ERROR = (354, "Requested market data is not subscribed.")
+UNKNOWN_ACCOUNT_ERROR = (321, "Error validating request: invalid account code")
+PACING_ERROR = (100, "Max rate of messages per second has been exceeded.")
+
+
+def _frame(*fields) -> bytes:
+    """
+    Encodes fields as one length-prefixed, NUL-terminated IB API message.
+    """
+    text = "".join(f"{int(field) if isinstance(field, bool) else field}\0" for field in fields).encode()
+    return struct.pack("!I", len(text)) + text
+
+
+class TWSSimulator:
+    """
+    Local stand-in for TWS/IB Gateway that speaks enough of the IB socket protocol
+    for an unmodified IBApp to connect, download positions, price snapshots and
+    place orders.
+
+    The simulator serves a synthetic book of `positions` holdings per account with
+    deterministic prices, answers market data snapshots for any symbol, and fills
+    market orders with a scripted sequence of order statuses. Fill latency,
+    partial fills, duplicated status messages and unpriceable symbols are
+    configurable, so the client's message handling can be load-tested at any size
+    without a live gateway. Fills update the simulated book, so a later positions
+    request reflects the executed orders.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = 0, positions: int = 1000,
+                 accounts: Iterable[str] = (DEFAULT_ACCOUNT,), fill_latency: float = 0.0, partial_fills: int = 1,
+                 duplicate_statuses: int = 0, snapshot_latency: float = 0.0,
+                 unpriced_symbols: Iterable[str] = (), max_messages_per_second: Optional[float] = None,
+                 seed: int = 0):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on. 0 picks a free port, see `port` after `start`
+            positions (int): Number of synthetic positions held by each account
+            accounts (iterable): The managed accounts
+            fill_latency (float): Seconds between an order being placed and each of its fills
+            partial_fills (int): Number of fills each order is executed in
+            duplicate_statuses (int): Extra copies of every order status message, as TWS sometimes sends
+            snapshot_latency (float): Seconds before a market data snapshot is answered
+            unpriced_symbols (iterable): Symbols whose market data requests fail with error 354
+            max_messages_per_second (float, optional): Report a pacing violation (error 100) when a
+                                                       client sends faster than this. Disabled if None
+            seed (int): Seed for the synthetic book
+        """
+        self.host = host
+        self.port = port
+        self.accounts: List[str] = list(accounts)
+        self.fill_latency = fill_latency
+        self.partial_fills = max(1, partial_fills)
+        self.duplicate_statuses = duplicate_statuses
+        self.snapshot_latency = snapshot_latency
+        self.unpriced_symbols = set(unpriced_symbols)
+        self.max_messages_per_second = max_messages_per_second
+        self.prices: Dict[str, float] = {}
+        self.books: Dict[str, Dict[str, int]] = {}  # account: {symbol: quantity}
+        self.stats: Counter = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._order_ids = itertools.count(FIRST_ORDER_ID)
+        self._server: Optional[socket.socket] = None
+        self._sessions: List["_Session"] = []
+        self._thread: Optional[threading.Thread] = None
+        self.generate_book(positions)
+
+    def generate_book(self, positions: int) -> None:
+        """
+        Replaces every account's book with `positions` synthetic holdings.
+
+        Args:
+            positions (int): Number of positions per account
+        """
+        with self._lock:
+            symbols = [f"{SYMBOL_PREFIX}{i:05d}" for i in range(positions)]
+            for symbol in symbols:
+                self.prices.setdefault(symbol, round(self._rng.uniform(*PRICE_RANGE), 2))
+            self.books = {account: {symbol: self._rng.randint(*QUANTITY_RANGE) for symbol in symbols}
+                          for account in self.accounts}
+
+    def price(self, symbol: str) -> float:
+        """
+        Args:
+            symbol (str): The stock symbol
+
+        Returns:
+            float: The symbol's simulated price, created on first use
+        """
+        with self._lock:
+            if symbol not in self.prices:
+                self.prices[symbol] = round(self._rng.uniform(*PRICE_RANGE), 2)
+            return self.prices[symbol]
+
+    def publish_price(self, symbol: str, price: float) -> None:
+        """
+        Sets a symbol's price and pushes it to every streaming market data subscriber.
+
+        Args:
+            symbol (str): The stock symbol
+            price (float): The new price
+        """
+        with self._lock:
+            self.prices[symbol] = price
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.on_price(symbol, price)
+
+    def start(self) -> "TWSSimulator":
+        """
+        Starts listening for API connections on a background thread.
+
+        Returns:
+            TWSSimulator: The started simulator, with `port` set to the bound port
+        """
+        self._server = socket.create_server((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept_loop, name="tws-simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Closes the listening socket and every client connection.
+        """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self) -> "TWSSimulator":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def _accept_loop(self) -> None:
+        server = self._server
+        while True:
+            try:
+                conn, _address = server.accept()
+            except OSError:
+                return  # Listening socket closed by stop()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, conn)
+            with self._lock:
+                self._sessions.append(session)
+            session.start()
+
+    def _remove_session(self, session: "_Session") -> None:
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+
+    def next_order_id(self) -> int:
+        return next(self._order_ids)
+
+    def fill(self, account: str, symbol: str, action: str, shares: int) -> int:
+        """
+        Applies a fill to an account's book.
+
+        Returns:
+            int: The account's new quantity of the symbol
+        """
+        with self._lock:
+            book = self.books.setdefault(account, {})
+            book[symbol] = book.get(symbol, 0) + (shares if action == "BUY" else -shares)
+            return book[symbol]
+
+
+class _Session:
+    """
+    One client connection: reads requests on its own thread and writes replies
+    either immediately or from a delayed-event thread for latency simulation.
+    """
+
+    def __init__(self, simulator: TWSSimulator, conn: socket.socket):
+        self.sim = simulator
+        self.conn = conn
+        self.server_version = SERVER_VERSION
+        self.streams: Dict[int, str] = {}  # reqId: symbol
+        self.account_updates: Optional[str] = None  # Account subscribed with reqAccountUpdates
+        self._send_lock = threading.Lock()
+        self._events: List[Tuple[float, int, bytes]] = []  # (due, seq, payload) heap
+        self._events_ready = threading.Condition()
+        self._seq = itertools.count()
+        self._closed = False
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def start(self) -> None:
+        threading.Thread(target=self._read_loop, name="tws-simulator-session", daemon=True).start()
+        threading.Thread(target=self._event_loop, name="tws-simulator-events", daemon=True).start()
+
+    def close(self) -> None:
+        self._closed = True
+        with self._events_ready:
+            self._events_ready.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+        self.sim._remove_session(self)
+
+    def send(self, payload: bytes) -> None:
+        with self._send_lock:
+            try:
+                self.conn.sendall(payload)
+            except OSError:
+                self._closed = True
+
+    def send_later(self, delay: float, payload: bytes) -> None:
+        if delay <= 0:
+            self.send(payload)
+            return
+        with self._events_ready:
+            heapq.heappush(self._events, (time.monotonic() + delay, next(self._seq), payload))
+            self._events_ready.notify()
+
+    def _event_loop(self) -> None:
+        with self._events_ready:
+            while not self._closed:
+                if not self._events:
+                    self._events_ready.wait()
+                    continue
+                due, _seq, payload = self._events[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._events_ready.wait(wait)
+                    continue
+                heapq.heappop(self._events)
+                self._events_ready.release()
+                try:
+                    self.send(payload)
+                finally:
+                    self._events_ready.acquire()
+
+    def _recv_exactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Client disconnected")
+            data += chunk
+        return data
+
+    def _recv_message(self) -> List[str]:
+        size = struct.unpack("!I", self._recv_exactly(4))[0]
+        return self._recv_exactly(size).decode().split("\0")[:-1]
+
+    def _read_loop(self) -> None:
+        try:
+            self._handshake()
+            while not self._closed:
+                self._dispatch(self._recv_message())
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if not self._closed:
+                self.close()
+
+    def _handshake(self) -> None:
+        if self._recv_exactly(4) != b"API\0":
+            raise ConnectionError("Not an IB API client")
+        match = re.match(r"v(\d+)\.\.(\d+)", self._recv_exactly(struct.unpack("!I", self._recv_exactly(4))[0]).decode())
+        if match:
+            self.server_version = min(int(match.group(2)), SERVER_VERSION)
+        self.send(_frame(self.server_version, time.strftime("%Y%m%d %H:%M:%S UTC", time.gmtime())))
+
+    def _check_pacing(self) -> None:
+        limit = self.sim.max_messages_per_second
+        if limit is None:
+            return
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        if self._window_count > limit:
+            self.sim.stats["pacing_violations"] += 1
+            self.error(-1, *PACING_ERROR)
+
+    def error(self, req_id: int, code: int, message: str) -> None:
+        self.send(_frame(IN.ERR_MSG, 2, req_id, code, message))
+
+    def _dispatch(self, fields: List[str]) -> None:
+        msg_id = int(fields[0])
+        self.sim.stats[f"received_{msg_id}"] += 1
+        self._check_pacing()
+        if msg_id == OUT.START_API:
+            self.send(_frame(IN.MANAGED_ACCTS, 1, ",".join(self.sim.accounts))
+                      + _frame(IN.NEXT_VALID_ID, 1, self.sim.next_order_id()))
+        elif msg_id == OUT.REQ_IDS:
+            self.send(_frame(IN.NEXT_VALID_ID, 1, self.sim.next_order_id()))
+        elif msg_id == OUT.REQ_POSITIONS:
+            self._send_positions()
+        elif msg_id == OUT.REQ_POSITIONS_MULTI:
+            self._send_positions_multi(int(fields[2]), fields[3])
+        elif msg_id == OUT.REQ_MKT_DATA:
+            self._market_data(fields)
+        elif msg_id == OUT.CANCEL_MKT_DATA:
+            self.streams.pop(int(fields[2]), None)
+        elif msg_id == OUT.REQ_ACCT_DATA:
+            self._account_updates(fields[2] == "1", fields[3])
+        elif msg_id == OUT.PLACE_ORDER:
+            self._place_order(fields)
+        elif msg_id == OUT.REQ_OPEN_ORDERS:
+            # Orders are filled as they are placed, so none is left open
+            self.send(_frame(IN.OPEN_ORDER_END, 1))
+        # Other requests (market data type, cancellations, ...) need no reply
+
+    def _position_fields(self, symbol: str, quantity: int) -> tuple:
+        # conId, symbol, secType, lastTradeDate, strike, right, multiplier, exchange, currency, localSymbol, tradingClass
+        return 0, symbol, "STK", "", 0.0, "", "", "SMART", "USD", symbol, symbol, quantity, self.sim.prices.get(symbol, 0.0)
+
+    def _send_positions(self) -> None:
+        with self.sim._lock:
+            rows = [(account, symbol, quantity) for account, book in self.sim.books.items()
+                    for symbol, quantity in book.items()]
+        # One buffer for the whole book, like TWS streams it
+        payload = b"".join(_frame(IN.POSITION_DATA, 3, account, *self._position_fields(symbol, quantity))
+                           for account, symbol, quantity in rows)
+        self.send(payload + _frame(IN.POSITION_END, 1))
+        self.sim.stats["positions_sent"] += len(rows)
+
+    def _send_positions_multi(self, req_id: int, account: str) -> None:
+        with self.sim._lock:
+            book = self.sim.books.get(account)
+            rows = list(book.items()) if book is not None else None
+        if rows is None:
+            self.error(req_id, *UNKNOWN_ACCOUNT_ERROR)
+            return
+        payload = b"".join(_frame(IN.POSITION_MULTI, 1, req_id, account, *self._position_fields(symbol, quantity), "")
+                           for symbol, quantity in rows)
+        self.send(payload + _frame(IN.POSITION_MULTI_END, 1, req_id))
+        self.sim.stats["positions_sent"] += len(rows)
+
+    def _market_data(self, fields: List[str]) -> None:
+        req_id = int(fields[MKT_DATA_FIELDS["req_id"]])
+        symbol = fields[MKT_DATA_FIELDS["symbol"]]
+        if symbol in self.sim.unpriced_symbols:
+            self.error(req_id, *NO_MARKET_DATA_ERROR)
+            return
+        tick = _frame(IN.TICK_PRICE, 6, req_id, TickTypeEnum.LAST, self.sim.price(symbol), 100, 0)
+        if fields[MKT_DATA_FIELDS["snapshot"]] == "1":
+            self.sim.stats["snapshots"] += 1
+            self.send_later(self.sim.snapshot_latency, tick + _frame(IN.TICK_SNAPSHOT_END, 1, req_id))
+        else:
+            self.streams[req_id] = symbol
+            self.send(tick)
+
+    def on_price(self, symbol: str, price: float) -> None:
+        payload = b"".join(_frame(IN.TICK_PRICE, 6, req_id, TickTypeEnum.LAST, price, 100, 0)
+                           for req_id, stream_symbol in list(self.streams.items()) if stream_symbol == symbol)
+        if payload:
+            self.send(payload)
+
+    def _account_updates(self, subscribe: bool, account: str) -> None:
+        account = account or self.sim.accounts[0]
+        self.account_updates = account if subscribe else None
+        if not subscribe:
+            return
+        with self.sim._lock:
+            rows = list(self.sim.books.get(account, {}).items())
+        payload = b"".join(self._portfolio_value(account, symbol, quantity) for symbol, quantity in rows)
+        self.send(payload + _frame(IN.ACCT_DOWNLOAD_END, 1, account))
+
+    def _portfolio_value(self, account: str, symbol: str, quantity: int) -> bytes:
+        price = self.sim.prices.get(symbol, 0.0)
+        # conId, symbol, secType, lastTradeDate, strike, right, multiplier, primaryExchange, currency,
+        # localSymbol, tradingClass, position, marketPrice, marketValue, averageCost, unrealizedPNL, realizedPNL
+        return _frame(IN.PORTFOLIO_VALUE, 8, 0, symbol, "STK", "", 0.0, "", "", "", "USD", symbol, symbol,
+                      quantity, price, round(price * quantity, 2), price, 0.0, 0.0, account)
+
+    def _place_order(self, fields: List[str]) -> None:
+        order_id = int(fields[PLACE_ORDER_FIELDS["order_id"]])
+        symbol = fields[PLACE_ORDER_FIELDS["symbol"]]
+        action = fields[PLACE_ORDER_FIELDS["action"]]
+        total = int(float(fields[PLACE_ORDER_FIELDS["quantity"]]))
+        account = fields[PLACE_ORDER_FIELDS["account"]] or self.sim.accounts[0]
+        price = self.sim.price(symbol)
+        self.sim.stats["orders"] += 1
+
+        self._order_status(0.0, order_id, "Submitted", 0, total, 0.0)
+        filled = 0
+        for step in range(1, self.sim.partial_fills + 1):
+            shares = total * step // self.sim.partial_fills - filled
+            filled += shares
+            quantity = self.sim.fill(account, symbol, action, shares)
+            status = "Filled" if filled == total else "Submitted"
+            delay = self.sim.fill_latency * step
+            self._order_status(delay, order_id, status, filled, total - filled, price)
+            if self.account_updates == account:
+                self.send_later(delay, self._portfolio_value(account, symbol, quantity))
+
+    def _order_status(self, delay: float, order_id: int, status: str, filled: int, remaining: int,
+                      price: float) -> None:
+        # orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId, whyHeld, mktCapPrice
+        message = _frame(IN.ORDER_STATUS, order_id, status, filled, remaining, price, order_id, 0, price, 0, "", 0.0)
+        self.sim.stats["order_statuses"] += 1 + self.sim.duplicate_statuses
+        self.send_later(delay, message * (1 + self.sim.duplicate_statuses))
+
+
+def simulator_from_env() -> TWSSimulator:
+    """
+    Creates a simulator configured from the TWS_SIM_* environment variables.
+
+    Returns:
+        TWSSimulator: The configured, not yet started simulator
+    """
+    accounts = [account.strip() for account in os.environ.get("TWS_SIM_ACCOUNTS", DEFAULT_ACCOUNT).split(",")
+                if account.strip()]
+    return TWSSimulator(
+        host=os.environ.get("TWS_SIM_HOST", DEFAULT_HOST),
+        port=int(os.environ.get("TWS_SIM_PORT", DEFAULT_PORT)),
+        positions=int(os.environ.get("TWS_SIM_POSITIONS", 1000)),
+        accounts=accounts,
+        fill_latency=float(os.environ.get("TWS_SIM_FILL_LATENCY", 0.0)),
+        partial_fills=int(os.environ.get("TWS_SIM_PARTIAL_FILLS", 1)),
+        duplicate_statuses=int(os.environ.get("TWS_SIM_DUPLICATE_STATUSES", 0)),
+        snapshot_latency=float(os.environ.get("TWS_SIM_SNAPSHOT_LATENCY", 0.0)),
+        max_messages_per_second=float(os.environ["TWS_SIM_MAX_RATE"]) if "TWS_SIM_MAX_RATE" in os.environ else None,
+    )
+
+
+if __name__ == "__main__":
+    simulator = simulator_from_env().start()
+    print(f"TWS simulator listening on {simulator.host}:{simulator.port} "
+          f"({len(simulator.accounts)} accounts, {len(next(iter(simulator.books.values()), {}))} positions each)")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        simulator.stop()
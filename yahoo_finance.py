@@ -1,7 +1,30 @@
-from typing import Dict, Any
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 
 import yfinance as yf
 
+import telemetry
+from circuit_breaker import CircuitBreaker
+from logs import get_logger
+from pricing import PriceUnavailableError, Prices, ProviderUnavailableError
+
+MAX_WORKERS = 4
+BATCH_PRICES_ENV = "YAHOO_BATCH_PRICES"
+BATCH_INTERVAL = "5m"  # bar size of the batched download; the latest bar is still forming during market hours
+
+logger = get_logger(__name__)
+
+# Trips when per-symbol quote lookups keep failing (rate limiting, outages), so the
+# rest of a batch is not sent to an endpoint that is refusing us
+quote_breaker = CircuitBreaker("yahoo_quote")
+
+# yf.download keeps its results in module-level state, so concurrent callers (the
+# watchlist prefetch and the position pricing of a run) take turns
+_download_lock = threading.Lock()
+
 
 def get_price(symbol: str) -> float:
     """
@@ -13,15 +36,143 @@ def get_price(symbol: str) -> float:
 
     Returns:
         float: The current market price for the stock
+
+    Raises:
+        PriceUnavailableError: If Yahoo Finance has no price for the symbol, e.g. because it is delisted
     """
+    telemetry.count("http_requests_total", service="yahoo", endpoint="quote")
     ticker = yf.Ticker(symbol)
 
     # Get real-time price information
     current_data: Dict[str, Any] = ticker.info
-    price = current_data.get('regularMarketPrice', 0.0)
+    price = current_data.get('regularMarketPrice') or 0.0
 
     if price == 0.0:  # Fallback to last closing price if real-time price is not available
         data = ticker.history(period="1d")
-        price = data['Close'].iloc[-1]
+        if data.empty:
+            raise PriceUnavailableError(f"No Yahoo Finance price for {symbol}")
+        price = float(data['Close'].iloc[-1])
 
+    if not (math.isfinite(price) and price > 0):
+        raise PriceUnavailableError(f"No Yahoo Finance price for {symbol}")
     return price
+
+
+def _guarded_price(symbol: str) -> Tuple[Optional[float], bool]:
+    """
+    `get_price` through the quote circuit breaker.
+
+    Returns:
+        tuple: The price, or None if there is none, and whether the lookup failed (or was
+               not made because the breaker is open) rather than Yahoo having no price
+    """
+    if not quote_breaker.allow():
+        return None, True
+    try:
+        price = get_price(symbol)
+    except PriceUnavailableError:
+        # Yahoo answered, it just has nothing for this symbol
+        quote_breaker.record_success()
+        return None, False
+    except Exception:
+        quote_breaker.record_failure()
+        return None, True
+    quote_breaker.record_success()
+    return price, False
+
+
+def use_batch_prices() -> bool:
+    """
+    Returns:
+        bool: Whether symbols are priced from one batched download, which is the default.
+              Setting the YAHOO_BATCH_PRICES environment variable to 0 quotes every symbol
+              individually instead
+    """
+    return os.environ.get(BATCH_PRICES_ENV, "1").lower() not in ("0", "false", "no", "")
+
+
+def _download_latest_prices(symbols: List[str], max_workers: int) -> Dict[str, float]:
+    """
+    Fetch the latest intraday price for many symbols with a single bulk Yahoo Finance
+    download of today's `BATCH_INTERVAL` bars. The close of the latest bar is the last
+    trade Yahoo has seen; outside market hours it is the close of the last session.
+
+    Args:
+        symbols (list): The stock symbols to look up
+        max_workers (int): The number of threads yfinance may use for the download
+
+    Returns:
+        dict: Symbols mapped to their latest price. Symbols Yahoo returned no data for are omitted.
+    """
+    telemetry.count("http_requests_total", service="yahoo", endpoint="download")
+    with _download_lock:
+        data = yf.download(symbols, period="1d", interval=BATCH_INTERVAL, progress=False, threads=max_workers,
+                           auto_adjust=False)
+    if data is None or data.empty:
+        return {}
+
+    closes = data["Close"]
+    if not hasattr(closes, "columns"):  # Single ticker downloads may come back as a Series
+        closes = closes.to_frame(name=symbols[0])
+
+    prices: Dict[str, float] = {}
+    for symbol in symbols:
+        if symbol not in closes.columns:
+            continue
+        series = closes[symbol].dropna()
+        if not series.empty:
+            prices[symbol] = float(series.iloc[-1])
+    return prices
+
+
+def get_prices(symbols: Iterable[str], max_workers: int = MAX_WORKERS) -> Prices:
+    """
+    Get the current market prices for many symbols at once.
+
+    All symbols are first fetched in one batched yfinance download of today's
+    intraday bars, a single round trip instead of one request per symbol. Each is
+    priced at the close of its latest bar, which during market hours may trail the
+    live quote by up to a bar. Symbols missing from the batch, or all of them if the
+    download fails or `use_batch_prices` is disabled, get a live quote through
+    `get_price`, with the lookups spread over a bounded worker pool.
+
+    Symbols Yahoo has no price for are left out. Those whose lookup failed, e.g. on
+    a timeout, are left out too and listed in the result's `failed` set. If the
+    individual lookups keep failing, `quote_breaker` opens and the remaining symbols
+    are not requested.
+
+    Args:
+        symbols (iterable): The stock symbols to look up
+        max_workers (int): The maximum number of concurrent requests
+
+    Returns:
+        Prices: A dictionary mapping each symbol to its current market price
+
+    Raises:
+        ProviderUnavailableError: If the quote breaker opened, with the prices fetched so far
+    """
+    unique_symbols = list(dict.fromkeys(symbols))
+    if not unique_symbols:
+        return Prices()
+
+    prices: Dict[str, float] = {}
+    if use_batch_prices():
+        try:
+            prices = _download_latest_prices(unique_symbols, max_workers)
+        except Exception as e:
+            logger.warning("Yahoo Finance batch download failed, quoting symbols individually: %s", e)
+
+    failed: Set[str] = set()
+    missing = [symbol for symbol in unique_symbols if symbol not in prices]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for symbol, (price, lookup_failed) in zip(missing, executor.map(_guarded_price, missing)):
+                if price is not None:
+                    prices[symbol] = price
+                elif lookup_failed:
+                    failed.add(symbol)
+        if quote_breaker.is_open:
+            raise ProviderUnavailableError(
+                f"Yahoo Finance quote lookups are failing, retrying in {quote_breaker.retry_in():.1f}s", prices)
+
+    return Prices(prices, failed=failed)